@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Coordinator Daemon for AI Agents
+
+This module keeps a long-running process between the coordinator CLI and the
+agent files:
+- serve() answers JSON-line requests on a local Unix socket, calling the
+  handler registered for each operation
+- call() is the thin client: it forwards one operation to a running daemon,
+  and raises DaemonUnavailable when there is none so callers can fall back
+  to doing the work themselves
+- MailboxCache keeps the unread part of recently used mailboxes in memory;
+  writes still go straight to disk, and the cache catches up by reading
+  only the appended tail
+"""
+
+import os
+import json
+import time
+import bisect
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+
+import agent_mailbox
+
+SOCKET_ENV = "COORDINATOR_SOCKET"
+SOCKET_NAME = ".coordinator.sock"
+
+# Mailboxes kept in memory by MailboxCache; the least recently read is dropped
+MAX_CACHED_BOXES = 256
+
+class DaemonUnavailable(Exception):
+    """Raised by call() when no daemon is listening on the socket"""
+
+def socket_path(agents_dir):
+    """Socket used by the daemon, from $COORDINATOR_SOCKET or the agents directory"""
+    return os.environ.get(SOCKET_ENV) or os.path.join(agents_dir, SOCKET_NAME)
+
+def call(path, operation, *args, **kwargs):
+    """
+    Run an operation on the daemon
+
+    Args:
+        path: Path of the daemon socket
+        operation: Name of the registered handler
+        *args, **kwargs: JSON-serializable handler arguments
+
+    Returns:
+        The handler's result
+
+    Raises:
+        DaemonUnavailable: If no daemon is listening on the socket
+        RuntimeError: If the handler failed in the daemon
+    """
+    if not os.path.exists(path):
+        raise DaemonUnavailable(path)
+
+    request = json.dumps({"op": operation, "args": args, "kwargs": kwargs}) + "\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(request.encode("utf-8"))
+            with sock.makefile('r', encoding="utf-8") as f:
+                line = f.readline()
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise DaemonUnavailable(path)
+
+    if not line:
+        raise RuntimeError("Daemon closed the connection without a reply")
+    reply = json.loads(line)
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply["result"]
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answer JSON-line requests until the client disconnects"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                handler = self.server.handlers.get(request.get("op"))
+                if handler is None:
+                    reply = {"error": f"Unknown operation: {request.get('op')}"}
+                else:
+                    reply = {"result": handler(*request.get("args", []), **request.get("kwargs", {}))}
+            except Exception as e:
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(path, handlers):
+    """
+    Serve operations on a Unix socket until interrupted
+
+    Args:
+        path: Path of the socket to listen on
+        handlers: Dictionary of operation name to callable
+    """
+    if os.path.exists(path):
+        try:
+            call(path, "ping")
+        except DaemonUnavailable:
+            # Left behind by a daemon that did not shut down cleanly
+            os.remove(path)
+        else:
+            raise RuntimeError(f"A daemon is already listening on {path}")
+
+    handlers = dict(handlers, ping=lambda: "pong")
+    # Bind with a umask that makes the socket owner-only from the moment it exists
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.handlers = handlers
+    print(f"Coordinator daemon listening on {path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+class MailboxCache:
+    """
+    In-memory copy of JSONL mailboxes
+
+    Each read stats the log and parses only what was appended since the
+    last read, so other processes writing to the mailbox stay visible.
+    A log that was replaced or shrank is reloaded from the start.
+    Messages before the read cursor are dropped, and at most max_boxes
+    mailboxes are kept.
+    """
+
+    def __init__(self, max_boxes=MAX_CACHED_BOXES):
+        self.lock = threading.Lock()
+        self.boxes = OrderedDict()
+        self.max_boxes = max_boxes
+
+    def read_unread(self, agent_dir, box, offset=None):
+        """Cached equivalent of agent_mailbox.read_unread"""
+        path = agent_mailbox.mailbox_path(agent_dir, box)
+        if not os.path.exists(path):
+            return agent_mailbox.read_unread(agent_dir, box, offset)
+
+        cursor, acked, layout = agent_mailbox.load_cursor(agent_dir, box)
+        start = max(cursor, agent_mailbox.position_of(layout, offset or 0))
+        now = time.time()
+        with self.lock:
+            cached = self._refresh(path)
+            # Nothing before the cursor is returned again
+            read = bisect.bisect_right(cached["ends"], cursor)
+            del cached["ends"][:read]
+            del cached["messages"][:read]
+            first = bisect.bisect_right(cached["ends"], start)
+            unread = [m for m in cached["messages"][first:]
+                      if not m.get("read", False) and m["_start"] not in acked
+                      and not agent_mailbox.is_expired(m, now)]
+            end = cached["size"]
+        return [{k: v for k, v in m.items() if k != "_start"} for m in unread], agent_mailbox.offset_of(layout, max(end, start))
+
+    def _refresh(self, path):
+        """Bring the cached copy of a log up to date (caller holds the lock)"""
+        st = os.stat(path)
+        cached = self.boxes.get(path)
+        if cached is None or cached["ino"] != st.st_ino or st.st_size < cached["size"]:
+            cached = {"ino": st.st_ino, "size": 0, "ends": [], "messages": []}
+            self.boxes[path] = cached
+            while len(self.boxes) > self.max_boxes:
+                self.boxes.popitem(last=False)
+        self.boxes.move_to_end(path)
+
+        if st.st_size > cached["size"]:
+            for start, end, message in agent_mailbox.iter_log(path, cached["size"]):
+                message["_start"] = start
+                cached["ends"].append(end)
+                cached["messages"].append(message)
+                cached["size"] = end
+        return cached
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Durable Writes for AI Agents
+
+This module is the write path for files whose loss would lose data
+(mailboxes, read cursors, the state journal, memory.md, session logs):
+- append() adds data with a single O_APPEND write, and atomic_write()
+  replaces a file through a temporary file and a rename, so readers never
+  see a partial write
+- $AGENT_DURABILITY picks when data reaches the disk: "group" (default)
+  fsyncs with group commit, "fsync" fsyncs every write on its own, and
+  "none" leaves it to the page cache
+- Group commit batches fsyncs of concurrent writers, threads or processes:
+  the target's group commit file counts the fsyncs started and completed,
+  and a writer that finished before a completed fsync started skips its
+  own; writers queued behind a running fsync are covered by the next one
+  instead of each paying for their own. This covers appends, the data of
+  atomic replacements and directory entries alike
+- Group commit files and the temporary files of atomic_write() live in
+  one hidden .sync directory per directory, out of the way of the files
+  they belong to
+"""
+
+import os
+import time
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Without locks every fsync runs on its own (e.g. on Windows)
+    fcntl = None
+
+import agent_metrics
+
+DURABILITY_ENV = "AGENT_DURABILITY"
+DURABILITY_MODES = ("group", "fsync", "none")
+
+# Hidden directory holding the group commit and temporary files of a directory
+SYNC_DIR_NAME = ".sync"
+
+# Group commit file of the directory's own entries, inside SYNC_DIR_NAME
+DIR_SYNC_NAME = ".dir"
+
+# Suffix of the directory inside SYNC_DIR_NAME holding a target's temporary files
+TEMP_SUFFIX = ".tmp"
+
+# Seconds between checks for a running fsync to finish
+SYNC_POLL_INTERVAL = 0.0002
+
+def durability():
+    """
+    Durability mode from $AGENT_DURABILITY
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    mode = os.environ.get(DURABILITY_ENV) or "group"
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode: {mode}")
+    return mode
+
+def append(path, data, durable=True):
+    """
+    Append data to a file with a single write
+
+    Args:
+        path: Path of the file, created if missing
+        data: Bytes to append
+        durable: Whether the data must reach the disk before returning
+
+    Returns:
+        Offset just past the appended data
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+        # The file offset of an O_APPEND write ends up past its own data
+        end = os.lseek(fd, 0, os.SEEK_CUR)
+        if durable and durability() != "none":
+            sync(_sync_path(path), lambda: os.fsync(fd))
+            # A file this write created also needs its directory entry synced
+            if os.fstat(fd).st_size == len(data):
+                sync_dir(os.path.dirname(path))
+    finally:
+        os.close(fd)
+    return end
+
+def atomic_write(path, data, durable=True):
+    """
+    Replace a file with new contents so readers never see a partial write
+
+    Args:
+        path: Path of the file
+        data: New contents as bytes
+        durable: Whether the new contents must reach the disk before
+            returning
+    """
+    durable = durable and durability() != "none"
+    directory = os.path.dirname(path) or "."
+    waiting = os.path.join(directory, SYNC_DIR_NAME, os.path.basename(path) + TEMP_SUFFIX)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=waiting)
+    except (FileNotFoundError, NotADirectoryError):
+        _make_sync_dir(directory, os.path.basename(waiting))
+        fd, tmp_path = tempfile.mkstemp(dir=waiting)
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                # The contents must be on disk before the rename can be
+                sync(_sync_path(path), lambda: _fsync_temporaries(waiting, f.fileno(), tmp_path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if durable:
+        sync_dir(os.path.dirname(path))
+
+def _fsync_temporaries(waiting, fd, tmp_path):
+    """
+    Fsync the leader's temporary file and every other one waiting to replace the target
+
+    Concurrent atomic_write calls for the same target each have their own
+    temporary file, so the shared fsync of a group commit has to cover all
+    of them, not just the leader's. They share a directory of their own,
+    so only the target's writers are listed.
+    """
+    os.fsync(fd)
+    for name in os.listdir(waiting):
+        path = os.path.join(waiting, name)
+        if path == tmp_path:
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            # Already renamed by a writer that was not waiting on this fsync
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def sync_dir(directory):
+    """Make renames and new files in a directory durable"""
+    directory = directory or "."
+
+    def flush():
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    sync(os.path.join(directory, SYNC_DIR_NAME, DIR_SYNC_NAME), flush)
+
+def _sync_path(path):
+    """Group commit file of a file"""
+    return os.path.join(os.path.dirname(path) or ".", SYNC_DIR_NAME, os.path.basename(path))
+
+def _make_sync_dir(directory, name=""):
+    """Create the .sync directory of a directory, or a directory inside it"""
+    sync_dir_path = os.path.join(directory, SYNC_DIR_NAME)
+    if os.path.isfile(sync_dir_path):
+        # Older versions kept the directory's group commit time in a .sync file
+        try:
+            os.remove(sync_dir_path)
+        except FileNotFoundError:
+            pass
+    os.makedirs(os.path.join(sync_dir_path, name), exist_ok=True)
+
+def sync(sync_path, flush):
+    """
+    Run an fsync for a write that has already been made
+
+    In "group" mode the fsync is shared: a write is covered by any fsync of
+    the same target that started after it finished, so writers queued
+    behind a running fsync only wait for the next one. Fsyncs are numbered
+    by a counter in the group commit file rather than timed, so the file
+    stays valid across reboots.
+
+    Args:
+        sync_path: Group commit file of the target
+        flush: Callable doing the fsync
+    """
+    mode = durability()
+    if mode == "none":
+        return
+    if mode == "fsync" or fcntl is None:
+        with agent_metrics.phase("fsync"):
+            flush()
+        agent_metrics.add_size("fsyncs", 1)
+        return
+
+    try:
+        fd = os.open(sync_path, os.O_RDWR | os.O_CREAT, 0o644)
+    except (FileNotFoundError, NotADirectoryError):
+        _make_sync_dir(os.path.dirname(os.path.dirname(sync_path)))
+        fd = os.open(sync_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        with agent_metrics.phase("fsync"):
+            # The write is done, so every fsync numbered after the ones
+            # started by now begins after it
+            written = _read_counts(fd)
+            # Poll instead of blocking on the lock: a writer covered by the
+            # running fsync must not also wait for the one after it
+            while True:
+                if _covers(_read_counts(fd), written):
+                    agent_metrics.add_size("fsyncs_shared", 1)
+                    return
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    time.sleep(SYNC_POLL_INTERVAL)
+                    continue
+                # Only the lock holder writes the counters, so this read is whole
+                counts = _read_counts(fd)
+                if _covers(counts, written):
+                    agent_metrics.add_size("fsyncs_shared", 1)
+                    return
+                break
+            started, completed = counts or (0, 0)
+            started += 1
+            _write_counts(fd, started, completed)
+            flush()
+            _write_counts(fd, started, started)
+        agent_metrics.add_size("fsyncs", 1)
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+def _read_counts(fd):
+    """
+    Fsync counters of a group commit file
+
+    Returns:
+        Tuple of (number of the last fsync started, number of the last
+        fsync completed), (0, 0) for a new file, or None if the file could
+        not be parsed, e.g. when read while the counters were being written
+    """
+    data = os.pread(fd, 64, 0)
+    if not data:
+        return 0, 0
+    try:
+        started, completed = data.split()
+        return int(started), int(completed)
+    except ValueError:
+        return None
+
+def _covers(counts, written):
+    """Whether the last completed fsync started after a write (unreadable counters never cover)"""
+    return counts is not None and written is not None and counts[1] > written[0]
+
+def _write_counts(fd, started, completed):
+    """Store the fsync counters (fixed width, so no truncation is needed)"""
+    os.pwrite(fd, f"{started:020d} {completed:020d}\n".encode("ascii"), 0)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+State Journal for AI Agents
+
+This module keeps every version of an agent's state in state.journal:
+- Each save appends one JSON line with a patch against the previous
+  version (add/remove/replace operations on JSON pointer paths, as in
+  RFC 6902), so history costs the size of the changes, not a copy of the
+  state per version
+- state.json is rewritten on every save, so it always holds the latest
+  state for readers that do not go through this module (and for git)
+- Every SNAPSHOT_INTERVAL saves, or once the patches since the last
+  snapshot outweigh it, a full snapshot line is journaled instead, so
+  load_state(at=...) replays at most SNAPSHOT_INTERVAL patches from the
+  snapshot before the requested time
+- Each journal line records a hash of the state.json contents written
+  with it. A state.json whose contents no longer match was edited behind
+  the journal's back: it is taken as the latest state and the next save
+  journals a snapshot. Copies, restores and checkouts that keep the
+  contents are not mistaken for edits
+"""
+
+import os
+import json
+import hashlib
+
+import agent_durable
+import agent_mailbox
+
+JOURNAL_NAME = "state.journal"
+STATE_NAME = "state.json"
+
+# Saves between full snapshots
+SNAPSHOT_INTERVAL = 32
+
+def journal_path(agent_dir):
+    """Path of the agent's state journal"""
+    return os.path.join(agent_dir, JOURNAL_NAME)
+
+def state_path(agent_dir):
+    """Path of the agent's state.json, which holds the latest state"""
+    return os.path.join(agent_dir, STATE_NAME)
+
+def diff(old, new, path=""):
+    """
+    Patch operations turning one JSON value into another
+
+    Dictionaries are compared key by key, and lists that only grew at the
+    end get an "add" operation per new item; anything else that changed is
+    replaced whole.
+
+    Args:
+        old: Previous value
+        new: New value
+        path: JSON pointer of the values
+
+    Returns:
+        List of {"op", "path"[, "value"]} operations
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key in old:
+                ops.extend(diff(old[key], value, f"{path}/{_escape(key)}"))
+            else:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+        return ops
+    # Compared as JSON, since 1 == True in Python
+    if (isinstance(old, list) and isinstance(new, list)
+            and json.dumps(new[:len(old)]) == json.dumps(old)):
+        return [{"op": "add", "path": f"{path}/-", "value": value} for value in new[len(old):]]
+    if type(old) is type(new) and not isinstance(old, list) and old == new:
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+def apply_patch(document, ops):
+    """
+    Apply patch operations to a JSON value
+
+    Args:
+        document: Value to patch; dictionaries and lists are changed in place
+        ops: Operations from diff
+
+    Returns:
+        The patched value
+    """
+    for op in ops:
+        if op["path"] == "":
+            document = op["value"]
+            continue
+        parts = [_unescape(part) for part in op["path"].split("/")[1:]]
+        parent = document
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        last = parts[-1]
+        if isinstance(parent, list):
+            if op["op"] == "add":
+                if last == "-":
+                    parent.append(op["value"])
+                else:
+                    parent.insert(int(last), op["value"])
+            elif op["op"] == "replace":
+                parent[int(last)] = op["value"]
+            else:
+                del parent[int(last)]
+        elif op["op"] == "remove":
+            del parent[last]
+        else:
+            parent[last] = op["value"]
+    return document
+
+def save_state(agent_dir, state, timestamp):
+    """
+    Record a new version of the state
+
+    Args:
+        agent_dir: Path of the agent directory
+        state: State dictionary
+        timestamp: Time of the version as epoch seconds
+
+    Returns:
+        "patch" or "snapshot", depending on what was journaled
+
+    Raises:
+        json.JSONDecodeError: If state.json is corrupt
+    """
+    with agent_mailbox.mailbox_lock(agent_dir, "state"):
+        data = _read_state_bytes(agent_dir)
+        chain = _chain(agent_dir, data)
+        text = json.dumps(state, indent=2).encode("utf-8")
+        line = ""
+        if chain is not None:
+            line = json.dumps({"timestamp": timestamp, "patch": diff(chain["state"], state),
+                               "hash": _hash(text)})
+
+        # Snapshot when the journal does not end at the current state.json,
+        # or when replaying the patches would cost more than a snapshot
+        if (chain is None or chain["patches"] >= SNAPSHOT_INTERVAL
+                or chain["patch_bytes"] + len(line) > chain["snapshot_bytes"]):
+            line = json.dumps({"timestamp": timestamp, "snapshot": state, "hash": _hash(text)})
+            kind = "snapshot"
+        else:
+            kind = "patch"
+
+        # state.json goes first: a crash before the journal append leaves a
+        # state.json the journal does not know, which is kept as an edit
+        agent_durable.atomic_write(state_path(agent_dir), text)
+        agent_durable.append(journal_path(agent_dir), (line + "\n").encode("utf-8"))
+        return kind
+
+def load_state(agent_dir, at=None):
+    """
+    Load the latest state, or the state at a point in time
+
+    Args:
+        agent_dir: Path of the agent directory
+        at: Optional epoch seconds; the last version saved at or before
+            this time is returned
+
+    Returns:
+        State dictionary, or None if there is no such version
+
+    Raises:
+        json.JSONDecodeError: If state.json is corrupt
+    """
+    if at is None:
+        data = _read_state_bytes(agent_dir)
+        return json.loads(data) if data is not None else None
+
+    patches = []
+    journaled = False
+    for _, _, entry in agent_mailbox.iter_log_reverse(journal_path(agent_dir)):
+        journaled = True
+        if entry.get("timestamp", 0) > at:
+            continue
+        if "snapshot" in entry:
+            return _replay(entry["snapshot"], patches)
+        patches.append(entry["patch"])
+    if journaled:
+        return None
+
+    # State saved before the journal existed
+    state = _read_state_file(agent_dir)
+    if state is not None and state.get("last_updated", 0) <= at:
+        return state
+    return None
+
+def iter_versions(agent_dir):
+    """
+    List the saved versions, newest first
+
+    Yields:
+        Tuples of (timestamp, "snapshot" or "patch", list of changed paths)
+    """
+    for _, _, entry in agent_mailbox.iter_log_reverse(journal_path(agent_dir)):
+        if "snapshot" in entry:
+            yield entry.get("timestamp"), "snapshot", []
+        else:
+            yield entry.get("timestamp"), "patch", [op["path"] for op in entry.get("patch", [])]
+
+def _chain(agent_dir, data):
+    """
+    Patches since the last snapshot, if the journal ends at the current state.json
+
+    Args:
+        agent_dir: Path of the agent directory
+        data: Contents of state.json, or None if it is missing
+
+    Returns:
+        Dictionary with the current "state" and the "patches",
+        "patch_bytes" and "snapshot_bytes" since the last snapshot, or
+        None if state.json is missing or does not match the journal
+    """
+    if data is None:
+        return None
+    patches = 0
+    patch_bytes = 0
+    for start, end, entry in agent_mailbox.iter_log_reverse(journal_path(agent_dir)):
+        if patches == 0 and entry.get("hash") != _hash(data):
+            # state.json was edited behind the journal's back
+            return None
+        if "snapshot" in entry:
+            return {"state": json.loads(data), "patches": patches,
+                    "patch_bytes": patch_bytes, "snapshot_bytes": end - start}
+        patches += 1
+        patch_bytes += end - start
+    return None
+
+def _replay(state, patches):
+    """Apply patches collected newest first to a snapshot"""
+    for ops in reversed(patches):
+        state = apply_patch(state, ops)
+    return state
+
+def _read_state_file(agent_dir):
+    """Parse state.json, or None if it does not exist"""
+    try:
+        with open(state_path(agent_dir), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _read_state_bytes(agent_dir):
+    """Contents of state.json, or None if it does not exist"""
+    try:
+        with open(state_path(agent_dir), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _hash(data):
+    """Hash of state.json contents, as recorded in the journal"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def _escape(key):
+    """Escape a dictionary key for a JSON pointer"""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+def _unescape(part):
+    """Undo _escape"""
+    return part.replace("~1", "/").replace("~0", "~")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Session Log Writer for AI Agents
+
+This module appends entries to an agent's session_log.md:
+- Every entry is a single append, independent of log size
+- The offset of the current day's "## Session:" header is remembered in a
+  session_log.state sidecar, so finding today's section never rereads the log
+- Without a valid sidecar the log is scanned backwards from the end until
+  the last section header is found
+- session_log.md is only the active segment: when a new day starts, or the
+  segment grows past MAX_SEGMENT_BYTES, it is gzip-archived into
+  session_logs/ and a fresh segment is started
+- iter_entries streams entries across archived and active segments in order
+"""
+
+import os
+import re
+import gzip
+import json
+from datetime import datetime
+
+import agent_durable
+import agent_mailbox
+
+LOG_NAME = "session_log.md"
+SECTION_MARKER = b"## Session: "
+SCAN_CHUNK_SIZE = 64 * 1024
+ARCHIVE_DIR = "session_logs"
+MAX_SEGMENT_BYTES = 1024 * 1024
+
+def log_path(agent_dir):
+    """Path of the agent's session log"""
+    return os.path.join(agent_dir, LOG_NAME)
+
+def state_path(agent_dir):
+    """Path of the sidecar remembering the current section header"""
+    return os.path.join(agent_dir, "session_log.state")
+
+def archive_dir(agent_dir):
+    """Path of the directory holding archived log segments"""
+    return os.path.join(agent_dir, ARCHIVE_DIR)
+
+def format_entry(message_type, content):
+    """Format a single session log entry"""
+    return f"\n### {message_type}\n```\n{content}\n```\n"
+
+def append_entries(agent_dir, agent_name, entries, today=None):
+    """
+    Append entries to today's section of the session log
+
+    Args:
+        agent_dir: Path of the agent directory
+        agent_name: Name of the agent (used for the title of a new log)
+        entries: List of (message type, content) tuples
+        today: Date of the section as YYYY-MM-DD (defaults to today)
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    path = log_path(agent_dir)
+
+    with agent_mailbox.mailbox_lock(agent_dir, "session_log"):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        header = None
+
+        if size >= MAX_SEGMENT_BYTES:
+            # Today's section carries on in a fresh segment
+            rotate_segment(agent_dir)
+            size = 0
+            header = f"## Session: {today} (continued)"
+        elif size and not _has_section(agent_dir, path, today):
+            # Only start a new segment if this one already holds an earlier day
+            if find_last_section(path)[0] is not None:
+                rotate_segment(agent_dir)
+                size = 0
+            header = f"## Session: {today}"
+
+        text = "" if size else f"# {agent_name.title()}'s Session Log\n\n"
+        if not size and header is None:
+            header = f"## Session: {today}"
+
+        header_offset = None
+        if header is not None:
+            # The header starts after the leading newline
+            header_offset = size + len(text.encode("utf-8")) + 1
+            text += f"\n{header}\n"
+
+        text += "".join(format_entry(t, c) for t, c in entries)
+
+        agent_durable.append(path, text.encode("utf-8"))
+
+        if header_offset is not None:
+            _write_state(agent_dir, today, header_offset)
+
+def rotate_segment(agent_dir):
+    """
+    Archive the active session log segment as a gzip file
+
+    Archives are named <sequence>-<day>.md.gz, where day is the last
+    section day in the segment, so that they sort in rotation order.
+    The archive reaches the disk before the active segment is removed, so
+    a crash cannot lose the day's log. The caller holds the session log
+    lock.
+
+    Args:
+        agent_dir: Path of the agent directory
+
+    Returns:
+        Path of the archived segment, or None if there was nothing to archive
+    """
+    path = log_path(agent_dir)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+
+    day = find_last_section(path)[0]
+    day = day[:10] if day else datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d")
+
+    if not os.path.isdir(archive_dir(agent_dir)):
+        os.makedirs(archive_dir(agent_dir), exist_ok=True)
+        agent_durable.sync_dir(agent_dir)
+    sequence = sum(1 for name in os.listdir(archive_dir(agent_dir)) if name.endswith(".md.gz"))
+    archive_path = os.path.join(archive_dir(agent_dir), f"{sequence + 1:05d}-{day}.md.gz")
+
+    with open(path, 'rb') as f:
+        agent_durable.atomic_write(archive_path, gzip.compress(f.read()))
+    os.remove(path)
+    return archive_path
+
+def segment_paths(agent_dir):
+    """
+    List the session log segments from oldest to newest
+
+    Args:
+        agent_dir: Path of the agent directory
+
+    Returns:
+        List of archived segment paths followed by the active segment
+    """
+    paths = []
+    if os.path.isdir(archive_dir(agent_dir)):
+        paths = [os.path.join(archive_dir(agent_dir), name)
+                 for name in sorted(os.listdir(archive_dir(agent_dir)))
+                 if name.endswith(".md.gz")]
+    if os.path.exists(log_path(agent_dir)):
+        paths.append(log_path(agent_dir))
+    return paths
+
+def iter_entries(agent_dir):
+    """
+    Stream session log entries across all segments in order
+
+    Args:
+        agent_dir: Path of the agent directory
+
+    Yields:
+        Dictionaries with "session" (the section header after "Session: "),
+        "type" (the entry heading) and "content" keys
+    """
+    for path in segment_paths(agent_dir):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rt', encoding="utf-8") as f:
+            yield from parse_entries(f)
+
+def parse_entries(lines):
+    """
+    Parse "## Session:" sections and "### <type>" entries from log lines
+
+    Headings inside ``` code fences, such as markdown in a logged
+    response, are part of the entry body.
+    """
+    session = None
+    entry_type = None
+    body = []
+    in_fence = False
+
+    def finish():
+        content = "\n".join(body).strip("\n")
+        fenced = re.fullmatch(r"```[^\n]*\n(.*)\n```", content, re.DOTALL)
+        return {"session": session, "type": entry_type, "content": fenced.group(1) if fenced else content}
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("```"):
+            in_fence = not in_fence
+        elif not in_fence and line.startswith(("# ", "## ", "### ")):
+            if entry_type is not None:
+                yield finish()
+            entry_type = None
+            body = []
+            if line.startswith("## Session: "):
+                session = line[len("## Session: "):].strip()
+            elif line.startswith("### "):
+                entry_type = line[4:].strip()
+            continue
+        if entry_type is not None:
+            body.append(line)
+    if entry_type is not None:
+        yield finish()
+
+def _has_section(agent_dir, path, today):
+    """Check whether the log already has a section for today"""
+    marker = SECTION_MARKER + today.encode("utf-8")
+
+    # Fast path: confirm the remembered header is still where we left it
+    try:
+        with open(state_path(agent_dir), 'r') as f:
+            state = json.load(f)
+        if state.get("day") == today:
+            with open(path, 'rb') as f:
+                f.seek(state["offset"])
+                if f.read(len(marker)) == marker:
+                    return True
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    day, offset = find_last_section(path)
+    if day is None or not day.startswith(today):
+        return False
+    _write_state(agent_dir, today, offset)
+    return True
+
+def find_last_section(path):
+    """
+    Find the last "## Session:" header by scanning backwards from the end
+
+    Args:
+        path: Path of the session log
+
+    Returns:
+        Tuple of (rest of the header line, byte offset of the header),
+        or (None, None) if the log has no section
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        overlap = b""
+        while end > 0:
+            start = max(0, end - SCAN_CHUNK_SIZE)
+            f.seek(start)
+            chunk = f.read(end - start) + overlap
+
+            pos = chunk.rfind(b"\n" + SECTION_MARKER)
+            if pos != -1:
+                pos += 1
+            elif start == 0 and chunk.startswith(SECTION_MARKER):
+                pos = 0
+            if pos != -1:
+                line = chunk[pos + len(SECTION_MARKER):].split(b"\n", 1)[0]
+                return line.decode("utf-8", "replace").strip(), start + pos
+
+            # Keep enough of this chunk to match a header split across chunks
+            overlap = chunk[:len(SECTION_MARKER) + 32]
+            end = start
+    return None, None
+
+def _write_state(agent_dir, day, offset):
+    """Remember the offset of the current section header"""
+    agent_mailbox.atomic_write(state_path(agent_dir), json.dumps({"day": day, "offset": offset}).encode("utf-8"))
@@ -0,0 +1,1425 @@
+#!/usr/bin/env python3
+"""
+Mailbox Storage for AI Agents
+
+This module implements the append-only mailbox format shared by
+coordinator.py and agent_state.py:
+- Each agent has an inbox.jsonl and outbox.jsonl with one JSON message per line
+- Sending a message is a single append, independent of mailbox size
+- Legacy inbox.json/outbox.json files are still readable and can be migrated
+- Concurrent writers are coordinated with advisory locks on <box>.lock;
+  appends share the lock while rewrites hold it exclusively and replace
+  files atomically via a temporary file and rename
+- Messages may carry an "expires_at" time after which readers skip them,
+  and a "key" that a hashed <box>.keys/ index uses to reject duplicates
+  until the message expires or is compacted away
+- Every message gets a stable "id" when it is appended; a hashed <box>.ids/
+  index maps ids to log offsets, so ack_ids acknowledges k messages with
+  k lookups instead of a pass over the log. Buckets of the index split as
+  they fill, so a lookup reads a bounded number of entries
+- Compaction moves read messages out of the log into gzip archives under
+  mailbox_archive/<box>/, one per day, so the live log only holds what is
+  still unread; it runs automatically once COMPACT_THRESHOLD bytes have
+  been read, or COMPACT_ACKED messages were acknowledged out of order.
+  Offsets handed to readers count the removed bytes too, so they stay
+  valid across compactions
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import uuid
+import shutil
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+
+import agent_durable
+import agent_watch
+
+try:
+    import fcntl
+except ImportError:  # Advisory locks are unavailable (e.g. on Windows)
+    fcntl = None
+
+MAILBOXES = ("inbox", "outbox")
+
+BACKEND_ENV = "AGENT_MAILBOX_BACKEND"
+
+# Message types from most to least urgent; unknown types come last
+PRIORITY_ORDER = ("system", "task", "question", "feedback", "general")
+
+ARCHIVE_DIR = "mailbox_archive"
+
+# Concurrent senders may append slightly out of timestamp order; searches
+# by time start this many seconds early and filter exactly from there
+TIMESTAMP_SKEW = 60
+REVERSE_CHUNK_SIZE = 64 * 1024
+SCAN_CHUNK_SIZE = 16 * 1024
+
+# Bytes of read messages at the head of a log that trigger compaction
+COMPACT_THRESHOLD = 1024 * 1024
+# Messages acknowledged out of order past the cursor that trigger compaction
+COMPACT_ACKED = 1024
+
+# Entries of an id index bucket above which a lookup splits it
+ID_BUCKET_SIZE = 64
+
+def load_backend(name=None):
+    """
+    Get the mailbox backend module
+
+    Backends provide the mailbox functions coordinator.py and
+    agent_state.py use: mailbox_exists, append_message(s), read_messages,
+    read_unread, get_unread, iter_unread, wait_for_unread,
+    mailbox_signature, mark_read_until, mark_all_read, ack_offsets,
+    ack_ids, ack_until, pop_next, sweep_expired, compact_mailbox and migrate_mailbox.
+
+    Args:
+        name: "jsonl" (this module) or "sqlite"; defaults to
+            $AGENT_MAILBOX_BACKEND, then "jsonl"
+
+    Returns:
+        The backend module
+
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    name = name or os.environ.get(BACKEND_ENV) or "jsonl"
+    if name == "jsonl":
+        return sys.modules[__name__]
+    if name == "sqlite":
+        import agent_mailbox_sqlite
+        return agent_mailbox_sqlite
+    raise ValueError(f"Unknown mailbox backend: {name}")
+
+def mailbox_path(agent_dir, box):
+    """Path of the JSONL log for a mailbox ("inbox" or "outbox")"""
+    return os.path.join(agent_dir, f"{box}.jsonl")
+
+def legacy_mailbox_path(agent_dir, box):
+    """Path of the legacy single-document JSON mailbox"""
+    return os.path.join(agent_dir, f"{box}.json")
+
+def mailbox_exists(agent_dir, box):
+    """Check whether a mailbox exists in either format"""
+    return (os.path.exists(mailbox_path(agent_dir, box)) or
+            os.path.exists(legacy_mailbox_path(agent_dir, box)))
+
+def lock_path(agent_dir, box):
+    """Path of the advisory lock file for a mailbox"""
+    return os.path.join(agent_dir, f"{box}.lock")
+
+@contextmanager
+def mailbox_lock(agent_dir, box, exclusive=True):
+    """
+    Hold the advisory lock of a mailbox
+
+    Appends take the lock shared, since O_APPEND writes of a whole line
+    never overwrite each other; anything that rewrites the log or moves
+    the read cursor takes it exclusively.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        exclusive: Whether to take an exclusive lock
+    """
+    fd = os.open(lock_path(agent_dir, box), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+def append_message(agent_dir, box, message):
+    """
+    Append a single message to a mailbox
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        message: Message dictionary
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox that needs migrating is corrupt
+    """
+    append_messages(agent_dir, box, [message])
+
+def append_messages(agent_dir, box, messages):
+    """
+    Append several messages to a mailbox with a single write
+
+    Messages with a "key" are dropped if a live message with the same key
+    was already sent; the check and the append happen under the exclusive
+    lock so that concurrent retries cannot both get through. Messages
+    without an "id" are given one.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        messages: List of message dictionaries
+
+    Returns:
+        List of the messages that were appended
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox that needs migrating is corrupt
+    """
+    if not messages:
+        return []
+
+    # Legacy mailboxes are converted on first write so that old
+    # messages keep their position ahead of the new ones
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+
+    keyed = any(m.get("key") for m in messages)
+    with mailbox_lock(agent_dir, box, exclusive=keyed):
+        if keyed:
+            messages = _drop_duplicates(agent_dir, box, messages)
+            if not messages:
+                return []
+
+        for m in messages:
+            if not m.get("id"):
+                m["id"] = new_message_id()
+        lines = [(json.dumps(m) + "\n").encode("utf-8") for m in messages]
+        data = b"".join(lines)
+        end = agent_durable.append(mailbox_path(agent_dir, box), data)
+
+        # Compaction needs the exclusive lock, so the layout cannot change under us
+        layout = load_cursor(agent_dir, box)[2]
+        position = end - len(data)
+        entries = []
+        for m, line in zip(messages, lines):
+            entries.append((m["id"], offset_of(layout, position)))
+            position += len(line)
+        _add_ids(agent_dir, box, entries)
+
+        if keyed:
+            _add_keys(agent_dir, box, messages, [offset for _, offset in entries])
+    return messages
+
+def new_message_id():
+    """Stable id for a new message (the string form of a random UUID)"""
+    return str(uuid.uuid4())
+
+def message_key(message):
+    """Content hash of a message over its sender, subject and content"""
+    data = json.dumps([message.get("from"), message.get("subject"), message.get("content")])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+def idempotency_key(key):
+    """Index key for a caller-supplied idempotency key"""
+    return hashlib.sha256(f"idempotency:{key}".encode("utf-8")).hexdigest()[:32]
+
+def is_expired(message, now=None):
+    """Check whether a message has passed its "expires_at" time"""
+    expires_at = message.get("expires_at")
+    return expires_at is not None and expires_at <= (time.time() if now is None else now)
+
+def keys_dir(agent_dir, box):
+    """Path of the directory holding the duplicate-key index of a mailbox"""
+    return os.path.join(agent_dir, f"{box}.keys")
+
+def _key_bucket(agent_dir, box, key):
+    """Bucket file of the key index that holds a key"""
+    return os.path.join(keys_dir(agent_dir, box), key[:2])
+
+def _read_bucket(path):
+    """
+    Read a key index bucket
+
+    Returns:
+        Dictionary of key to (expiry time or 0 for never, offset of the
+        message that carried it)
+    """
+    entries = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    entries[parts[0]] = (int(parts[1]), int(parts[2]))
+                elif len(parts) == 2:
+                    # Written without an offset by earlier versions
+                    entries[parts[0]] = (int(parts[1]), -1)
+    except (OSError, ValueError):
+        pass
+    return entries
+
+def _drop_duplicates(agent_dir, box, messages):
+    """Filter out messages whose key is already live (caller holds the exclusive lock)"""
+    now = time.time()
+    buckets = {}
+    seen = set()
+    unique = []
+    for m in messages:
+        key = m.get("key")
+        if key:
+            if key in seen:
+                continue
+            bucket = _key_bucket(agent_dir, box, key)
+            if bucket not in buckets:
+                buckets[bucket] = _read_bucket(bucket)
+            expires_at = buckets[bucket].get(key, (None,))[0]
+            if expires_at is not None and (expires_at == 0 or expires_at > now):
+                continue
+            seen.add(key)
+        unique.append(m)
+    return unique
+
+def _add_keys(agent_dir, box, messages, offsets):
+    """Record the keys of appended messages with their offsets (caller holds the exclusive lock)"""
+    lines = {}
+    for m, offset in zip(messages, offsets):
+        if m.get("key"):
+            bucket = _key_bucket(agent_dir, box, m["key"])
+            lines.setdefault(bucket, []).append(f"{m['key']} {int(m.get('expires_at') or 0)} {offset}\n")
+
+    os.makedirs(keys_dir(agent_dir, box), exist_ok=True)
+    for bucket, bucket_lines in lines.items():
+        with open(bucket, 'a') as f:
+            f.write("".join(bucket_lines))
+
+def ids_dir(agent_dir, box):
+    """Path of the directory holding the message id index of a mailbox"""
+    return os.path.join(agent_dir, f"{box}.ids")
+
+def _id_digest(message_id):
+    """Hash of a message id that places it in the id index"""
+    return hashlib.sha256(message_id.encode("utf-8")).hexdigest()
+
+def _id_bucket(agent_dir, box, message_id):
+    """
+    Bucket file of the id index that holds a message id
+
+    Buckets are named by the first two hex digits of the id's hash; a
+    bucket that grew past ID_BUCKET_SIZE entries is split into a directory
+    of buckets named by the next digit, and so on.
+
+    Returns:
+        Tuple of (path of the bucket file, position of the hash digit that
+        would split it)
+    """
+    digest = _id_digest(message_id)
+    path = os.path.join(ids_dir(agent_dir, box), digest[:2])
+    depth = 2
+    while os.path.isdir(path) and depth < len(digest):
+        path = os.path.join(path, digest[depth])
+        depth += 1
+    return path, depth
+
+def _read_id_bucket(path):
+    """Read an id index bucket as a dictionary of message id to absolute log offset"""
+    entries = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.rsplit(" ", 1)
+                if len(parts) == 2:
+                    entries[parts[0]] = int(parts[1])
+    except (OSError, ValueError):
+        pass
+    return entries
+
+def _add_ids(agent_dir, box, entries):
+    """Record (message id, absolute offset) pairs in the id index (caller holds the lock)"""
+    lines = {}
+    for message_id, offset in entries:
+        # Other ids are still found by ack_ids, through a scan of the log
+        if isinstance(message_id, str) and "\n" not in message_id:
+            lines.setdefault(_id_bucket(agent_dir, box, message_id)[0], []).append(f"{message_id} {offset}\n")
+
+    os.makedirs(ids_dir(agent_dir, box), exist_ok=True)
+    for bucket, bucket_lines in lines.items():
+        with open(bucket, 'a') as f:
+            f.write("".join(bucket_lines))
+
+def _split_id_bucket(path, depth):
+    """Replace a bucket file with a directory of buckets keyed by the next hash digit (caller holds the exclusive lock)"""
+    children = {}
+    for message_id, offset in _read_id_bucket(path).items():
+        children.setdefault(_id_digest(message_id)[depth], []).append(f"{message_id} {offset}\n")
+
+    split_path = path + ".split"
+    shutil.rmtree(split_path, ignore_errors=True)
+    os.makedirs(split_path)
+    for digit, lines in children.items():
+        with open(os.path.join(split_path, digit), 'w') as f:
+            f.write("".join(lines))
+    # A crash in between drops these entries, and ack_ids falls back to a scan for them
+    os.remove(path)
+    os.rename(split_path, path)
+
+def _lookup_id(agent_dir, box, message_id, buckets):
+    """
+    Log offset of a message id from the id index (caller holds the exclusive lock)
+
+    Oversized buckets on the way are split first, so a lookup reads at
+    most ID_BUCKET_SIZE entries once the index has settled.
+
+    Args:
+        buckets: Dictionary caching bucket contents by path between lookups
+    """
+    while True:
+        bucket, depth = _id_bucket(agent_dir, box, message_id)
+        if bucket not in buckets:
+            buckets[bucket] = _read_id_bucket(bucket)
+        if len(buckets[bucket]) <= ID_BUCKET_SIZE or depth >= 64:
+            return buckets[bucket].get(message_id)
+        _split_id_bucket(bucket, depth)
+        del buckets[bucket]
+
+def _prune_ids(agent_dir, box, layout, message_ids):
+    """Remove compacted messages from the id index buckets of their ids (caller holds the exclusive lock)"""
+    buckets = set()
+    for message_id in message_ids:
+        if isinstance(message_id, str) and "\n" not in message_id:
+            buckets.add(_id_bucket(agent_dir, box, message_id)[0])
+    for bucket in buckets:
+        entries = _read_id_bucket(bucket)
+        live = {i: o for i, o in entries.items() if _kept(layout, o)}
+        if len(live) == len(entries):
+            continue
+        if live:
+            atomic_write(bucket, "".join(f"{i} {o}\n" for i, o in live.items()).encode("utf-8"))
+        elif os.path.exists(bucket):
+            os.remove(bucket)
+
+def _find_ids(agent_dir, box, path, message_ids, cursor, layout):
+    """
+    Find the log offsets of messages by id (caller holds the lock)
+
+    Offsets from the index are checked against the message at that
+    offset; ids the index does not know, e.g. after a crash between the
+    log and index writes, are looked up by scanning the log from the
+    cursor.
+
+    Returns:
+        Dictionary of message id to start offset in the current log file,
+        for the ids of messages past the cursor
+    """
+    found = {}
+    missing = set()
+    buckets = {}
+    with open(path, 'rb') as f:
+        for message_id in message_ids:
+            offset = _lookup_id(agent_dir, box, message_id, buckets)
+            if offset is None:
+                missing.add(message_id)
+                continue
+            # Already read, and possibly compacted away
+            position = position_of(layout, offset)
+            if position < cursor or not _kept(layout, offset):
+                continue
+            f.seek(position)
+            try:
+                if json.loads(f.readline()).get("id") == message_id:
+                    found[message_id] = position
+                    continue
+            except (json.JSONDecodeError, AttributeError):
+                pass
+            missing.add(message_id)
+
+    if missing:
+        for start, _, message in iter_log(path, cursor):
+            if message.get("id") in missing:
+                found[message["id"]] = start
+                missing.discard(message["id"])
+                if not missing:
+                    break
+    return found
+
+def cursor_path(agent_dir, box):
+    """Path of the read-cursor sidecar for a mailbox"""
+    return os.path.join(agent_dir, f"{box}.cursor")
+
+def read_cursor(agent_dir, box):
+    """
+    Get the read cursor of a mailbox
+
+    The cursor is the byte offset in the JSONL log up to which every
+    message has been acknowledged.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Byte offset of the first unacknowledged message
+    """
+    return read_cursor_state(agent_dir, box)[0]
+
+def read_cursor_state(agent_dir, box):
+    """
+    Get the read cursor and the messages acknowledged out of order
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Tuple of (cursor offset, set of start offsets of acknowledged
+        messages past the cursor)
+    """
+    return load_cursor(agent_dir, box)[:2]
+
+def load_cursor(agent_dir, box):
+    """
+    Get the full read cursor state of a mailbox
+
+    Offsets inside the agent directory are positions in the current log
+    file. Offsets returned by read_unread and iter_unread are positions in
+    the log as if compaction had never removed anything, so they stay valid
+    across compactions; the layout maps between the two (see offset_of and
+    position_of).
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Tuple of (cursor offset, set of acknowledged start offsets past
+        the cursor, layout)
+    """
+    try:
+        with open(cursor_path(agent_dir, box), 'r') as f:
+            state = json.load(f)
+        offset = int(state.get("offset", 0))
+        acked = set(state.get("acked", []))
+        layout = (int(state.get("base", 0)), [(int(p), int(n)) for p, n in state.get("gaps", [])])
+    except (OSError, ValueError, AttributeError, TypeError):
+        return 0, set(), (0, [])
+
+    # A cursor past the end means the log was rewritten underneath it
+    try:
+        if offset > os.path.getsize(mailbox_path(agent_dir, box)):
+            return 0, set(), layout
+    except OSError:
+        return 0, set(), layout
+    return offset, acked, layout
+
+def write_cursor(agent_dir, box, offset, acked=(), layout=None):
+    """Store the read cursor of a mailbox, keeping the layout unless given (caller holds the exclusive lock)"""
+    if layout is None:
+        layout = load_cursor(agent_dir, box)[2]
+    base, gaps = layout
+    state = {"offset": offset}
+    acked = sorted(a for a in acked if a >= offset)
+    if acked:
+        state["acked"] = acked
+    if base:
+        state["base"] = base
+    if gaps:
+        state["gaps"] = [list(gap) for gap in gaps]
+    agent_durable.atomic_write(cursor_path(agent_dir, box), json.dumps(state).encode("utf-8"))
+
+def offset_of(layout, position):
+    """
+    Offset of a position in the current log file
+
+    The layout is (base, gaps): base is the number of bytes compaction
+    removed from the head of the log, and each (position, size) gap is a
+    run of acknowledged messages it removed from further in, ending just
+    before that position.
+    """
+    base, gaps = layout
+    return base + position + sum(size for gap_start, size in gaps if gap_start <= position)
+
+def position_of(layout, offset):
+    """Position in the current log file of an offset; removed messages map to where they used to be"""
+    base, gaps = layout
+    position = offset - base
+    for gap_start, size in gaps:
+        if position < gap_start:
+            break
+        position = max(gap_start, position - size)
+    return max(position, 0)
+
+def _kept(layout, offset):
+    """Whether the message starting at an offset is still in the log file"""
+    return offset_of(layout, position_of(layout, offset)) == offset
+
+def ack_offsets(agent_dir, box, offsets):
+    """
+    Acknowledge individual messages by their start offset
+
+    The cursor is moved past any run of acknowledged messages it reaches,
+    so the set of out-of-order acknowledgements stays small when messages
+    are mostly consumed in order.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offsets: Start offsets of the messages as yielded by iter_unread
+    """
+    with mailbox_lock(agent_dir, box):
+        layout = load_cursor(agent_dir, box)[2]
+        # Messages no longer in the log were acknowledged before compaction removed them
+        _ack_offsets(agent_dir, box, [position_of(layout, o) for o in offsets if _kept(layout, o)])
+        _compact_if_needed(agent_dir, box)
+
+def _ack_offsets(agent_dir, box, offsets, floor=0):
+    """Acknowledge messages by start offset, and everything before floor (caller holds the exclusive lock)"""
+    cursor, acked = read_cursor_state(agent_dir, box)
+    cursor = max(cursor, floor)
+    acked.update(o for o in offsets if o >= cursor)
+    if acked:
+        with open(mailbox_path(agent_dir, box), 'rb') as f:
+            while cursor in acked:
+                acked.discard(cursor)
+                f.seek(cursor)
+                cursor += len(f.readline())
+    write_cursor(agent_dir, box, cursor, acked)
+
+def iter_log(path, offset=0):
+    """
+    Iterate over the messages of a JSONL log starting at a byte offset
+
+    Args:
+        path: Path of the JSONL log
+        offset: Byte offset to start reading from
+
+    Yields:
+        Tuples of (start offset, end offset, message)
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            start = offset
+            offset += len(line)
+            if not line.endswith(b"\n"):
+                # A torn line from an interrupted append; stop before it
+                return
+            if not line.strip():
+                continue
+            try:
+                yield start, offset, json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def iter_log_reverse(path, stop=0):
+    """
+    Iterate over the messages of a JSONL log from the end backwards
+
+    Reads the log in REVERSE_CHUNK_SIZE blocks, so only the tail that is
+    actually consumed is read.
+
+    Args:
+        path: Path of the JSONL log
+        stop: Byte offset of a message start at which to stop
+
+    Yields:
+        Tuples of (start offset, end offset, message), newest first
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        buffer = b""
+        while position > stop:
+            start = max(stop, position - REVERSE_CHUNK_SIZE)
+            f.seek(start)
+            buffer = f.read(position - start) + buffer
+            position = start
+
+            # Before the first newline is the end of a line from an earlier block
+            cut = buffer.find(b"\n") + 1 if start > stop else 0
+            if start > stop and not cut:
+                continue
+            head, body = buffer[:cut], buffer[cut:]
+            buffer = head
+
+            lines = body.split(b"\n")
+            # Empty when the block ends at a newline; otherwise a torn
+            # line from an interrupted append, which is not a message yet
+            lines.pop()
+            line_start = start + cut
+            spans = []
+            for line in lines:
+                spans.append((line_start, line))
+                line_start += len(line) + 1
+            for line_start, line in reversed(spans):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_start, line_start + len(line) + 1, json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+def read_messages(agent_dir, box):
+    """
+    Read all messages from a mailbox
+
+    Messages before the read cursor are returned with "read" set.
+    Expired messages are skipped.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        List of message dictionaries in the order they were added
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox file is corrupt
+    """
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        return _read_legacy(agent_dir, box)
+
+    cursor, acked = read_cursor_state(agent_dir, box)
+    now = time.time()
+    messages = []
+    for start, end, message in iter_log(path):
+        if is_expired(message, now):
+            continue
+        if end <= cursor or start in acked:
+            message["read"] = True
+        messages.append(message)
+    return messages
+
+def read_unread(agent_dir, box, offset=None):
+    """
+    Read unread messages, skipping everything before the read cursor
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional byte offset to skip to if it is past the cursor
+
+    Returns:
+        Tuple of (list of unread messages, offset to pass to mark_read_until)
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox file is corrupt
+    """
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        unread = [m for m in _read_legacy(agent_dir, box) if not m.get("read", False) and not is_expired(m)]
+        return unread, None
+
+    cursor, acked, layout = load_cursor(agent_dir, box)
+    end = max(cursor, position_of(layout, offset or 0))
+    now = time.time()
+    unread = []
+    for start, end, message in iter_log(path, end):
+        if not message.get("read", False) and start not in acked and not is_expired(message, now):
+            unread.append(message)
+    return unread, offset_of(layout, end)
+
+def mailbox_signature(agent_dir, box):
+    """
+    Signature of the read state of a mailbox
+
+    The signature changes whenever messages are marked read or the log is
+    rewritten, but not when messages are appended, so a caller holding the
+    same signature can pick up new messages with read_unread from the
+    offset it returned last time.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        JSON-serializable signature
+    """
+    def stat_key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    log_key = stat_key(mailbox_path(agent_dir, box))
+    if log_key is None:
+        # Legacy mailboxes are rewritten on every change
+        return ["legacy", stat_key(legacy_mailbox_path(agent_dir, box))]
+    # Appends keep the inode of the log; compaction and migration replace it
+    return [log_key[0], stat_key(cursor_path(agent_dir, box))]
+
+def iter_unread(agent_dir, box, offset=None, since=None, sender=None, reverse=False):
+    """
+    Stream unread messages lazily
+
+    Only the part of the log that is consumed gets read: with since, the
+    first candidate message is found by binary search on the timestamps
+    instead of reading from the cursor, and with reverse the log is read
+    from the end.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional offset from read_unread to skip to
+        since: Only messages with a timestamp at or after this epoch time
+        sender: Only messages whose "from" matches
+        reverse: Newest messages first
+
+    Yields:
+        Tuples of (start offset, end offset, message); the offsets can be
+        passed to ack_offsets and mark_read_until
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox that needs migrating is corrupt
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        return
+
+    cursor, acked, layout = load_cursor(agent_dir, box)
+    start = max(cursor, position_of(layout, offset or 0))
+    if since is not None:
+        start = _seek_timestamp(path, start, since - TIMESTAMP_SKEW)
+
+    now = time.time()
+    messages = iter_log_reverse(path, start) if reverse else iter_log(path, start)
+    for message_start, message_end, message in messages:
+        if message.get("read", False) or message_start in acked or is_expired(message, now):
+            continue
+        if since is not None and message_time(message) < since:
+            continue
+        if sender is not None and message.get("from") != sender:
+            continue
+        # An end right before a removed run is reported as it was before the removal
+        yield offset_of(layout, message_start), offset_of(layout, message_end - 1) + 1, message
+
+def message_time(message):
+    """Timestamp of a message as epoch seconds, accepting legacy ISO strings"""
+    timestamp = message.get("timestamp", 0)
+    if isinstance(timestamp, str):
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            return 0
+    return timestamp or 0
+
+def _seek_timestamp(path, start, timestamp):
+    """
+    Find the first message at or after start with a timestamp of at least timestamp
+
+    The log is in append order, so timestamps are non-decreasing apart from
+    small skews between concurrent senders.
+
+    Returns:
+        Byte offset of a message start, at or before the first match
+    """
+    with open(path, 'rb') as f:
+        low = start
+        high = f.seek(0, os.SEEK_END)
+        # Invariant: low is a message start with every message before it too old
+        while high - low > SCAN_CHUNK_SIZE:
+            middle = (low + high) // 2
+            f.seek(middle)
+            f.readline()
+            line_start = f.tell()
+            line = f.readline()
+            if line_start >= high or not line.endswith(b"\n"):
+                high = middle
+                continue
+            try:
+                too_old = message_time(json.loads(line)) < timestamp
+            except (json.JSONDecodeError, AttributeError):
+                too_old = True
+            if too_old:
+                low = line_start + len(line)
+            else:
+                high = middle
+    return low
+
+def wait_for_unread(agent_dir, box, offset=None, timeout=None):
+    """
+    Block until unread messages are available
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional byte offset to skip to, e.g. the offset returned by
+            the previous call when following a mailbox without marking it read
+        timeout: Maximum number of seconds to wait, or None to wait forever
+
+    Returns:
+        Tuple of (list of unread messages, offset to pass to mark_read_until),
+        with an empty list if the timeout expired
+    """
+    # Offsets only exist in the JSONL format
+    migrate_mailbox(agent_dir, box)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    paths = [mailbox_path(agent_dir, box), cursor_path(agent_dir, box)]
+    with agent_watch.DirectoryWatcher(agent_dir, paths) as watcher:
+        while True:
+            unread, end = read_unread(agent_dir, box, offset)
+            if unread:
+                return unread, end
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], end
+            watcher.wait(remaining)
+
+def get_unread(agent_dir, box):
+    """
+    Get unread messages from a mailbox
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        List of unread message dictionaries
+    """
+    return read_unread(agent_dir, box)[0]
+
+def mark_read_until(agent_dir, box, offset):
+    """
+    Acknowledge every message before a byte offset
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Offset returned by read_unread, or None for the whole mailbox
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    with mailbox_lock(agent_dir, box):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        cursor, acked, layout = load_cursor(agent_dir, box)
+        offset = size if offset is None else min(position_of(layout, offset), size)
+        # The cursor only ever moves forward, whatever order readers finish in
+        if offset > cursor:
+            write_cursor(agent_dir, box, offset, acked)
+            _compact_if_needed(agent_dir, box)
+
+def ack_ids(agent_dir, box, message_ids):
+    """
+    Acknowledge individual messages by their "id"
+
+    Each id costs one index lookup and one read of its message, however
+    long the mailbox is.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        message_ids: Ids of the messages
+
+    Returns:
+        List of the ids that were unread and are now acknowledged
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids or not os.path.exists(path):
+        return []
+
+    with mailbox_lock(agent_dir, box):
+        cursor, acked, layout = load_cursor(agent_dir, box)
+        found = _find_ids(agent_dir, box, path, message_ids, cursor, layout)
+        acknowledged = [i for i in message_ids if i in found and found[i] not in acked]
+        if acknowledged:
+            _ack_offsets(agent_dir, box, [found[i] for i in acknowledged])
+            _compact_if_needed(agent_dir, box)
+    return acknowledged
+
+def ack_until(agent_dir, box, until):
+    """
+    Acknowledge every message with a timestamp at or before a time
+
+    The messages more than TIMESTAMP_SKEW older than the time are found by
+    binary search and skipped with the cursor; only the ones around the
+    time are read.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        until: Epoch seconds
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        return
+
+    with mailbox_lock(agent_dir, box):
+        cursor = read_cursor(agent_dir, box)
+        floor = _seek_timestamp(path, cursor, until - TIMESTAMP_SKEW)
+        offsets = []
+        for start, _, message in iter_log(path, floor):
+            timestamp = message_time(message)
+            if timestamp > until + TIMESTAMP_SKEW:
+                break
+            if timestamp <= until:
+                offsets.append(start)
+        if offsets or floor > cursor:
+            _ack_offsets(agent_dir, box, offsets, floor)
+            _compact_if_needed(agent_dir, box)
+
+def mark_all_read(agent_dir, box):
+    """
+    Mark every message in a mailbox as read
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+    """
+    mark_read_until(agent_dir, box, None)
+
+def priority_rank(message_type):
+    """Rank of a message type; lower ranks are handled first"""
+    try:
+        return PRIORITY_ORDER.index(message_type)
+    except ValueError:
+        return len(PRIORITY_ORDER)
+
+def sort_by_priority(messages):
+    """Order messages by type priority, keeping arrival order within a type"""
+    return sorted(messages, key=lambda m: priority_rank(m.get("type", "general")))
+
+def priority_index_path(agent_dir, box):
+    """Path of the directory holding the per-type queues of a mailbox"""
+    return os.path.join(agent_dir, f"{box}.priority")
+
+def pop_next(agent_dir, box, n=1, peek=False):
+    """
+    Take the highest-priority unread messages from a mailbox
+
+    Unread messages are kept in per-type FIFO queues of log offsets under
+    <box>.priority/, one append-only file per priority rank, with the
+    position of each queue's head in a small "heads" file. Messages
+    appended since the last call are queued first; only the queued
+    messages that are returned are read from the log, and taking them
+    only moves the heads.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        n: Maximum number of messages to return
+        peek: Return the messages without acknowledging them
+
+    Returns:
+        List of up to n unread messages, highest priority first
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        return []
+
+    with mailbox_lock(agent_dir, box):
+        cursor, acked, layout = load_cursor(agent_dir, box)
+        index = _update_priority_index(agent_dir, box, path, cursor, layout)
+        directory = priority_index_path(agent_dir, box)
+
+        now = time.time()
+        taken = []
+        seen = set()
+        with open(path, 'rb') as f:
+            for rank in range(len(PRIORITY_ORDER) + 1):
+                queue_path = os.path.join(directory, str(rank))
+                if len(taken) >= n or not os.path.exists(queue_path):
+                    continue
+                head = index["heads"].get(str(rank), 0)
+                with open(queue_path, 'rb') as queue:
+                    queue.seek(head)
+                    while len(taken) < n:
+                        line = queue.readline()
+                        if not line.endswith(b"\n"):
+                            break
+                        head += len(line)
+                        offset = int(line)
+                        start = position_of(layout, offset)
+                        # Skip messages acknowledged through other paths,
+                        # and entries queued twice by an interrupted update
+                        if (start < cursor or start in acked or offset in seen
+                                or not _kept(layout, offset)):
+                            continue
+                        f.seek(start)
+                        message = json.loads(f.readline())
+                        if is_expired(message, now):
+                            continue
+                        seen.add(offset)
+                        taken.append((start, message))
+                if not peek:
+                    index["heads"][str(rank)] = head
+
+        if not peek:
+            _ack_offsets(agent_dir, box, [start for start, _ in taken])
+        atomic_write(os.path.join(directory, "heads"), json.dumps(index).encode("utf-8"))
+        if not peek:
+            _compact_if_needed(agent_dir, box)
+
+    return [message for _, message in taken]
+
+def _read_priority_index(agent_dir, box):
+    """Read the queue heads of the priority index, or None if it has to be rebuilt"""
+    directory = priority_index_path(agent_dir, box)
+    try:
+        with open(os.path.join(directory, "heads"), 'r') as f:
+            index = json.load(f)
+        if isinstance(index.get("end"), int) and isinstance(index.get("heads"), dict):
+            return index
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+def _reset_priority_index(agent_dir, box):
+    """Remove the priority index so that it is rebuilt from the cursor (caller holds the exclusive lock)"""
+    directory = priority_index_path(agent_dir, box)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+    elif os.path.exists(directory):
+        # A single-file index written by earlier versions
+        os.remove(directory)
+
+def _update_priority_index(agent_dir, box, path, cursor, layout):
+    """Queue messages appended since the index was last updated (caller holds the exclusive lock)"""
+    index = _read_priority_index(agent_dir, box)
+    size = os.path.getsize(path)
+    if index is None or position_of(layout, index["end"]) > size:
+        _reset_priority_index(agent_dir, box)
+        index = {"end": offset_of(layout, cursor), "heads": {}}
+    directory = priority_index_path(agent_dir, box)
+    os.makedirs(directory, exist_ok=True)
+
+    start = max(cursor, position_of(layout, index["end"]))
+    if start >= size:
+        return index
+
+    lines = {}
+    for message_start, message_end, message in iter_log(path, start):
+        if not message.get("read", False):
+            rank = priority_rank(message.get("type", "general"))
+            lines.setdefault(rank, []).append(f"{offset_of(layout, message_start)}\n")
+        index["end"] = offset_of(layout, message_end)
+
+    for rank, rank_lines in lines.items():
+        with open(os.path.join(directory, str(rank)), 'a') as f:
+            f.write("".join(rank_lines))
+    return index
+
+def _prune_priority_index(agent_dir, box, layout):
+    """Rewrite the priority queues without taken or compacted entries (caller holds the exclusive lock)"""
+    index = _read_priority_index(agent_dir, box)
+    if index is None:
+        return
+    directory = priority_index_path(agent_dir, box)
+    for rank in range(len(PRIORITY_ORDER) + 1):
+        queue_path = os.path.join(directory, str(rank))
+        if not os.path.exists(queue_path):
+            continue
+        with open(queue_path, 'rb') as f:
+            f.seek(index["heads"].get(str(rank), 0))
+            live = [line for line in f if line.endswith(b"\n") and _kept(layout, int(line))]
+        atomic_write(queue_path, b"".join(live))
+    index["heads"] = {}
+    atomic_write(os.path.join(directory, "heads"), json.dumps(index).encode("utf-8"))
+
+def sweep_expired(agent_dir, box):
+    """
+    Drop expired messages from a mailbox and prune expired index keys
+
+    Expired messages are acknowledged, then the mailbox is compacted, which
+    removes them from the log even when older messages are still unread.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Number of expired messages removed from the log
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    path = mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        return 0
+
+    now = time.time()
+    with mailbox_lock(agent_dir, box):
+        cursor = read_cursor(agent_dir, box)
+        expired = [start for start, _, message in iter_log(path, cursor) if is_expired(message, now)]
+        if expired:
+            _ack_offsets(agent_dir, box, expired)
+        return _compact(agent_dir, box)[1]
+
+def _drop_acknowledged(agent_dir, box, now):
+    """
+    Archive and remove acknowledged messages from a JSONL mailbox
+
+    Both the messages before the read cursor and those acknowledged out of
+    order past it are removed, and the acknowledged set is cleared. The
+    removed runs are recorded in the cursor's layout, so offsets handed out
+    by read_unread and iter_unread stay valid after the log shrinks. The
+    caller holds the exclusive lock.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        now: Time before which messages count as expired and are not archived
+
+    Returns:
+        List of the removed messages
+    """
+    path = mailbox_path(agent_dir, box)
+    cursor, acked, layout = load_cursor(agent_dir, box)
+    if not cursor and not acked:
+        return []
+
+    removed = []
+    kept = []
+    base = None
+    gaps = []
+    # Offset minus position of the messages kept so far
+    shift = None
+    position = 0
+    old_position = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            start = old_position
+            old_position += len(line)
+            # A torn line from an interrupted append is kept as it is
+            if line.endswith(b"\n") and (start < cursor or start in acked):
+                try:
+                    removed.append(json.loads(line))
+                except ValueError:
+                    pass
+                continue
+            offset = offset_of(layout, start)
+            if shift is None:
+                base = shift = offset - position
+            elif offset - position != shift:
+                gaps.append((position, offset - position - shift))
+                shift = offset - position
+            kept.append(line)
+            position += len(line)
+
+    # Messages appended later continue from the old end of the log
+    end = offset_of(layout, old_position)
+    if shift is None:
+        base = end
+    elif end - position != shift:
+        gaps.append((position, end - position - shift))
+
+    # The archive is on disk before the log drops the messages; a crash in
+    # between leaves them in both places rather than losing them
+    archive_messages(agent_dir, box, [m for m in removed if not is_expired(m, now)])
+    agent_durable.atomic_write(path, b"".join(kept))
+    write_cursor(agent_dir, box, 0, (), (base, gaps))
+    return removed
+
+def archive_dir(agent_dir, box):
+    """Path of the directory holding the compacted messages of a mailbox"""
+    return os.path.join(agent_dir, ARCHIVE_DIR, box)
+
+def compact_mailbox(agent_dir, box):
+    """
+    Move read messages into the mailbox archive and drop expired ones
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Tuple of (number of messages archived, number of expired messages dropped)
+    """
+    if os.path.exists(legacy_mailbox_path(agent_dir, box)):
+        migrate_mailbox(agent_dir, box)
+    if not os.path.exists(mailbox_path(agent_dir, box)):
+        return 0, 0
+
+    with mailbox_lock(agent_dir, box):
+        return _compact(agent_dir, box)
+
+def _compact(agent_dir, box):
+    """Compact a mailbox (caller holds the exclusive lock)"""
+    now = time.time()
+    removed = _drop_acknowledged(agent_dir, box, now)
+    archived = sum(1 for m in removed if not is_expired(m, now))
+    layout = load_cursor(agent_dir, box)[2]
+    _prune_keys(agent_dir, box, now, layout)
+    if removed:
+        _prune_ids(agent_dir, box, layout, [m.get("id") for m in removed])
+        _prune_priority_index(agent_dir, box, layout)
+    return archived, len(removed) - archived
+
+def archive_messages(agent_dir, box, messages):
+    """
+    Append read messages to the day buckets of the mailbox archive
+
+    The messages are on disk when this returns.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        messages: List of message dictionaries
+    """
+    buckets = {}
+    for message in messages:
+        message["read"] = True
+        buckets.setdefault(_archive_day(message), []).append(message)
+    directory = archive_dir(agent_dir, box)
+    if buckets and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        agent_durable.sync_dir(os.path.dirname(directory))
+        agent_durable.sync_dir(agent_dir)
+    for day, bucket in buckets.items():
+        # Each call adds a gzip member; readers see one stream
+        data = "".join(json.dumps(m) + "\n" for m in bucket).encode("utf-8")
+        agent_durable.append(os.path.join(directory, f"{day}.jsonl.gz"), gzip.compress(data))
+
+def _compact_if_needed(agent_dir, box):
+    """Compact once enough read messages have built up in the log (caller holds the exclusive lock)"""
+    cursor, acked = read_cursor_state(agent_dir, box)
+    if cursor >= COMPACT_THRESHOLD or len(acked) >= COMPACT_ACKED:
+        _compact(agent_dir, box)
+
+def _archive_day(message):
+    """Day bucket of a message from its timestamp"""
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    return "undated"
+
+def iter_archived(agent_dir, box, since=None, until=None):
+    """
+    Stream archived messages, oldest day first
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        since: First day to include as YYYY-MM-DD, or None
+        until: Last day to include as YYYY-MM-DD, or None
+
+    Yields:
+        Archived message dictionaries
+    """
+    directory = archive_dir(agent_dir, box)
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        # Buckets outside the range are skipped without being opened
+        day = name[:-len(".jsonl.gz")]
+        if (since and day < since) or (until and day > until):
+            continue
+        with gzip.open(os.path.join(directory, name), 'rt', encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _prune_keys(agent_dir, box, now, layout):
+    """
+    Rewrite key index buckets without dead keys (caller holds the exclusive lock)
+
+    A key is dead once it has expired or its message has been compacted
+    out of the log, so keys without a TTL do not pile up.
+    """
+    directory = keys_dir(agent_dir, box)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        bucket = os.path.join(directory, name)
+        if len(name) != 2 or not os.path.isfile(bucket):
+            continue
+        entries = _read_bucket(bucket)
+        live = {k: (e, o) for k, (e, o) in entries.items() if (e == 0 or e > now) and _kept(layout, o)}
+        if len(live) == len(entries):
+            continue
+        if live:
+            atomic_write(bucket, "".join(f"{k} {e} {o}\n" for k, (e, o) in live.items()).encode("utf-8"))
+        else:
+            os.remove(bucket)
+
+def migrate_mailbox(agent_dir, box):
+    """
+    Convert a legacy inbox.json/outbox.json file to the JSONL format
+
+    Messages from the legacy file are placed ahead of anything already in
+    the JSONL log, and the read cursor is moved past the leading run of
+    read messages. The legacy file is kept as <box>.json.bak.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Number of messages migrated
+
+    Raises:
+        json.JSONDecodeError: If the legacy file is corrupt
+    """
+    legacy_path = legacy_mailbox_path(agent_dir, box)
+    if not os.path.exists(legacy_path):
+        return 0
+
+    with mailbox_lock(agent_dir, box):
+        # Another writer may have migrated while we waited for the lock
+        if not os.path.exists(legacy_path):
+            return 0
+
+        legacy_messages = _read_legacy(agent_dir, box)
+        existing = read_messages(agent_dir, box) if os.path.exists(mailbox_path(agent_dir, box)) else []
+        messages = legacy_messages + existing
+        for m in messages:
+            if not m.get("id"):
+                m["id"] = new_message_id()
+
+        cursor = _write_messages(mailbox_path(agent_dir, box), messages)
+        write_cursor(agent_dir, box, cursor)
+        # Every message moved, so the indexes are rebuilt
+        layout = load_cursor(agent_dir, box)[2]
+        shutil.rmtree(ids_dir(agent_dir, box), ignore_errors=True)
+        shutil.rmtree(keys_dir(agent_dir, box), ignore_errors=True)
+        _reset_priority_index(agent_dir, box)
+        logged = [(m, offset_of(layout, start)) for start, _, m in iter_log(mailbox_path(agent_dir, box))]
+        _add_ids(agent_dir, box, [(m.get("id"), offset) for m, offset in logged])
+        keyed = [(m, offset) for m, offset in logged if m.get("key")]
+        if keyed:
+            _add_keys(agent_dir, box, [m for m, _ in keyed], [offset for _, offset in keyed])
+        os.replace(legacy_path, legacy_path + ".bak")
+    return len(legacy_messages)
+
+def _read_legacy(agent_dir, box):
+    """Read the messages of a legacy JSON mailbox"""
+    legacy_path = legacy_mailbox_path(agent_dir, box)
+    if not os.path.exists(legacy_path):
+        return []
+    with open(legacy_path, 'r') as f:
+        return json.load(f).get("messages", [])
+
+def atomic_write(path, data):
+    """Replace a sidecar file so readers never see a partial write, without waiting for the disk"""
+    agent_durable.atomic_write(path, data, durable=False)
+
+def _write_messages(path, messages):
+    """
+    Rewrite a JSONL mailbox atomically (caller holds the exclusive lock)
+
+    Returns:
+        Byte offset just past the leading run of read messages
+    """
+    lines = []
+    offset = 0
+    cursor = 0
+    for m in messages:
+        line = (json.dumps(m) + "\n").encode("utf-8")
+        lines.append(line)
+        offset += len(line)
+        if m.get("read", False) and cursor == offset - len(line):
+            cursor = offset
+    agent_durable.atomic_write(path, b"".join(lines))
+    return cursor
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+SQLite Mailbox Backend for AI Agents
+
+This module keeps every agent's mailboxes in one SQLite database instead of
+per-agent JSONL files, with the same functions as agent_mailbox:
+- The database runs in WAL mode (as in prototypes/cra-46), so readers
+  never block the writer and each other
+- Unread queries use an index on (agent, box, read, id), queries by
+  time one on (agent, box, read, timestamp), and ack_ids one on the
+  "id" field of the message data
+- Offsets are message ids: read_unread returns one past the last id it
+  saw, and mark_read_until marks everything below that read in one
+  transaction
+- migrate_mailbox imports an agent's inbox.json/outbox.json or JSONL
+  mailbox in one transaction and keeps the source file as .bak
+
+Select it with AGENT_MAILBOX_BACKEND=sqlite. The database is
+AGENTS_DIR/.mailboxes/mailboxes.db unless AGENT_MAILBOX_DB is set; it has
+a directory of its own so that its journal files do not change the
+agents directory, whose mtime tells agent_registry when to rescan.
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import agent_durable
+import agent_mailbox
+import agent_watch
+
+DB_ENV = "AGENT_MAILBOX_DB"
+DB_DIR = ".mailboxes"
+DB_NAME = "mailboxes.db"
+
+# Where older versions kept the database, moved into DB_DIR when first opened
+LEGACY_DB_NAME = ".mailboxes.db"
+
+# Rows per UPDATE when acknowledging many messages by id
+ACK_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent TEXT NOT NULL,
+    box TEXT NOT NULL,
+    timestamp REAL NOT NULL DEFAULT 0,
+    type TEXT,
+    sender TEXT,
+    read INTEGER NOT NULL DEFAULT 0,
+    expires_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (agent, box, read, id);
+CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (agent, box, read, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_message_id ON messages (agent, box, json_extract(data, '$.id'));
+CREATE TABLE IF NOT EXISTS message_keys (
+    agent TEXT NOT NULL,
+    box TEXT NOT NULL,
+    key TEXT NOT NULL,
+    expires_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (agent, box, key)
+);
+"""
+
+# Open connections per thread, dropped in forked children
+_local = threading.local()
+
+def database_path(agent_dir):
+    """Path of the mailbox database serving an agent directory"""
+    return _agents_database_path(os.path.dirname(os.path.abspath(agent_dir)))
+
+def _agents_database_path(agents_dir):
+    """Path of the mailbox database of an agents directory"""
+    return os.environ.get(DB_ENV) or os.path.join(agents_dir, DB_DIR, DB_NAME)
+
+def _create_database_dir(path):
+    """
+    Create the directory of a new database
+
+    A database in the old location directly inside the agents directory
+    is checkpointed and moved there.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    legacy_path = os.path.join(os.path.dirname(directory), LEGACY_DB_NAME)
+    if os.environ.get(DB_ENV) or not os.path.exists(legacy_path):
+        return
+    legacy = sqlite3.connect(legacy_path, timeout=30, isolation_level=None)
+    try:
+        # Fold the write-ahead log into the database file before moving it
+        legacy.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        legacy.close()
+    try:
+        os.replace(legacy_path, path)
+    except FileNotFoundError:
+        # Moved by another process in the meantime
+        return
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(legacy_path + suffix):
+            os.remove(legacy_path + suffix)
+    agent_durable.sync_dir(directory)
+
+def connect(path):
+    """
+    Get this thread's connection to a mailbox database, creating the schema
+
+    Args:
+        path: Path of the database file
+
+    Returns:
+        sqlite3.Connection in autocommit mode
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+
+    db = _local.connections.get(path)
+    if db is None:
+        if not os.path.exists(path):
+            _create_database_dir(path)
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the WAL on every commit, NORMAL only at checkpoints
+        db.execute("PRAGMA synchronous=" + ("NORMAL" if agent_durable.durability() == "none" else "FULL"))
+        db.executescript(SCHEMA)
+        _local.connections[path] = db
+    return db
+
+def _open(agent_dir):
+    """Connection and agent name for an agent directory"""
+    return connect(database_path(agent_dir)), os.path.basename(os.path.normpath(agent_dir))
+
+@contextmanager
+def _transaction(db):
+    """Run statements in a write transaction"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+def _row_message(data, read):
+    """Message dictionary of a row"""
+    message = json.loads(data)
+    message["read"] = bool(read)
+    return message
+
+def mailbox_exists(agent_dir, box):
+    """Check whether a mailbox has any messages"""
+    db, agent = _open(agent_dir)
+    row = db.execute("SELECT 1 FROM messages WHERE agent = ? AND box = ? LIMIT 1", (agent, box)).fetchone()
+    return row is not None
+
+def append_message(agent_dir, box, message):
+    """
+    Append a message to a mailbox
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        message: Message dictionary
+    """
+    append_messages(agent_dir, box, [message])
+
+def append_messages(agent_dir, box, messages):
+    """
+    Append several messages to a mailbox in one transaction
+
+    Messages with a "key" are dropped if a live message with the same key
+    was already sent. Messages without an "id" are given one.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        messages: List of message dictionaries
+
+    Returns:
+        List of the messages that were appended
+    """
+    if not messages:
+        return []
+
+    db, agent = _open(agent_dir)
+    now = time.time()
+    with _transaction(db):
+        appended = []
+        seen = set()
+        for m in messages:
+            key = m.get("key")
+            if key:
+                row = db.execute("SELECT expires_at FROM message_keys WHERE agent = ? AND box = ? AND key = ?",
+                                 (agent, box, key)).fetchone()
+                if key in seen or (row is not None and (row[0] == 0 or row[0] > now)):
+                    continue
+                seen.add(key)
+                db.execute("INSERT OR REPLACE INTO message_keys (agent, box, key, expires_at) VALUES (?, ?, ?, ?)",
+                           (agent, box, key, m.get("expires_at") or 0))
+            if not m.get("id"):
+                m["id"] = agent_mailbox.new_message_id()
+            appended.append(m)
+
+        db.executemany(
+            "INSERT INTO messages (agent, box, timestamp, type, sender, read, expires_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(agent, box, agent_mailbox.message_time(m), m.get("type"), m.get("from"),
+              1 if m.get("read", False) else 0, m.get("expires_at"), json.dumps(m)) for m in appended])
+    return appended
+
+def read_messages(agent_dir, box):
+    """
+    Read all messages from a mailbox
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        List of unexpired message dictionaries in the order they were added
+    """
+    db, agent = _open(agent_dir)
+    rows = db.execute("SELECT data, read FROM messages WHERE agent = ? AND box = ? "
+                      "AND (expires_at IS NULL OR expires_at > ?) ORDER BY id",
+                      (agent, box, time.time()))
+    return [_row_message(data, read) for data, read in rows]
+
+def iter_messages(agent_dir, box, after=0):
+    """
+    Stream every message of a mailbox, read or not, in id order
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        after: Only messages with a larger id
+
+    Yields:
+        Tuples of (id, message)
+    """
+    db, agent = _open(agent_dir)
+    rows = db.execute("SELECT id, data, read FROM messages WHERE agent = ? AND box = ? AND id > ? ORDER BY id",
+                      (agent, box, after)).fetchall()
+    for message_id, data, read in rows:
+        yield message_id, _row_message(data, read)
+
+def message_id_range(agent_dir, box):
+    """Ids of the oldest and newest message in a mailbox, or (None, None) if it is empty"""
+    db, agent = _open(agent_dir)
+    return db.execute("SELECT MIN(id), MAX(id) FROM messages WHERE agent = ? AND box = ?", (agent, box)).fetchone()
+
+def read_unread(agent_dir, box, offset=None):
+    """
+    Read unread messages
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional message id to start from
+
+    Returns:
+        Tuple of (list of unread messages, offset to pass to mark_read_until)
+    """
+    unread = []
+    end = offset or 0
+    for _, end, message in iter_unread(agent_dir, box, offset):
+        unread.append(message)
+    return unread, end
+
+def get_unread(agent_dir, box):
+    """Get unread messages from a mailbox"""
+    return read_unread(agent_dir, box)[0]
+
+def iter_unread(agent_dir, box, offset=None, since=None, sender=None, reverse=False):
+    """
+    Stream unread messages lazily
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional message id to start from
+        since: Only messages with a timestamp at or after this epoch time
+        sender: Only messages whose "from" matches
+        reverse: Newest messages first
+
+    Yields:
+        Tuples of (id, id + 1, message); these can be passed to
+        ack_offsets and mark_read_until like JSONL offsets
+    """
+    db, agent = _open(agent_dir)
+    query = ("SELECT id, data FROM messages WHERE agent = ? AND box = ? AND read = 0 AND id >= ? "
+             "AND (expires_at IS NULL OR expires_at > ?)")
+    params = [agent, box, offset or 0, time.time()]
+    if since is not None:
+        query += " AND timestamp >= ?"
+        params.append(since)
+    if sender is not None:
+        query += " AND sender = ?"
+        params.append(sender)
+    query += " ORDER BY id DESC" if reverse else " ORDER BY id"
+
+    rows = db.execute(query, params)
+    try:
+        for message_id, data in rows:
+            yield message_id, message_id + 1, _row_message(data, False)
+    finally:
+        rows.close()
+
+def mailbox_signature(agent_dir, box):
+    """
+    Signature of the read state of a mailbox
+
+    Changes when messages are marked read or removed, but not when
+    messages are appended (see agent_mailbox.mailbox_signature).
+    """
+    db, agent = _open(agent_dir)
+    row = db.execute("SELECT COUNT(*), COALESCE(SUM(id), 0) FROM messages "
+                     "WHERE agent = ? AND box = ? AND read = 1", (agent, box)).fetchone()
+    return list(row)
+
+def wait_for_unread(agent_dir, box, offset=None, timeout=None):
+    """
+    Block until unread messages are available
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Optional message id to start from
+        timeout: Maximum number of seconds to wait, or None to wait forever
+
+    Returns:
+        Tuple of (list of unread messages, offset to pass to mark_read_until),
+        with an empty list if the timeout expired
+    """
+    path = database_path(agent_dir)
+    _open(agent_dir)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    # Commits land in the write-ahead log next to the database
+    paths = [path, path + "-wal"]
+    with agent_watch.DirectoryWatcher(os.path.dirname(path), paths) as watcher:
+        while True:
+            unread, end = read_unread(agent_dir, box, offset)
+            if unread:
+                return unread, end
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], end
+            watcher.wait(remaining)
+
+def mark_read_until(agent_dir, box, offset):
+    """
+    Mark every message before an offset as read
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offset: Offset returned by read_unread, or None for the whole mailbox
+    """
+    db, agent = _open(agent_dir)
+    with _transaction(db):
+        if offset is None:
+            db.execute("UPDATE messages SET read = 1 WHERE agent = ? AND box = ? AND read = 0", (agent, box))
+        else:
+            db.execute("UPDATE messages SET read = 1 WHERE agent = ? AND box = ? AND read = 0 AND id < ?",
+                       (agent, box, offset))
+
+def mark_all_read(agent_dir, box):
+    """Mark every message in a mailbox as read"""
+    mark_read_until(agent_dir, box, None)
+
+def ack_offsets(agent_dir, box, offsets):
+    """
+    Mark individual messages as read
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        offsets: Message ids as yielded by iter_unread
+    """
+    db, agent = _open(agent_dir)
+    offsets = list(offsets)
+    with _transaction(db):
+        for i in range(0, len(offsets), ACK_BATCH_SIZE):
+            batch = offsets[i:i + ACK_BATCH_SIZE]
+            db.execute(f"UPDATE messages SET read = 1 WHERE agent = ? AND box = ? "
+                       f"AND id IN ({', '.join('?' * len(batch))})", [agent, box] + batch)
+
+def ack_ids(agent_dir, box, message_ids):
+    """
+    Mark individual messages as read by their "id"
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        message_ids: Ids of the messages
+
+    Returns:
+        List of the ids that were unread and are now marked read
+    """
+    db, agent = _open(agent_dir)
+    message_ids = list(dict.fromkeys(message_ids))
+    acknowledged = set()
+    with _transaction(db):
+        for i in range(0, len(message_ids), ACK_BATCH_SIZE):
+            batch = message_ids[i:i + ACK_BATCH_SIZE]
+            # Without statistics the planner prefers the unread index, which scans every unread message
+            table = "messages INDEXED BY idx_messages_message_id"
+            where = (f"WHERE agent = ? AND box = ? AND json_extract(data, '$.id') "
+                     f"IN ({', '.join('?' * len(batch))}) AND read = 0")
+            acknowledged.update(row[0] for row in db.execute(
+                f"SELECT json_extract(data, '$.id') FROM {table} {where}", [agent, box] + batch))
+            db.execute(f"UPDATE {table} SET read = 1 {where}", [agent, box] + batch)
+    return [i for i in message_ids if i in acknowledged]
+
+def ack_until(agent_dir, box, until):
+    """
+    Mark every message with a timestamp at or before a time as read
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        until: Epoch seconds
+    """
+    db, agent = _open(agent_dir)
+    with _transaction(db):
+        db.execute("UPDATE messages SET read = 1 WHERE agent = ? AND box = ? AND read = 0 AND timestamp <= ?",
+                   (agent, box, until))
+
+def pop_next(agent_dir, box, n=1, peek=False):
+    """
+    Take the highest-priority unread messages from a mailbox
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+        n: Maximum number of messages to return
+        peek: Return the messages without marking them read
+
+    Returns:
+        List of up to n unread messages, highest priority first
+    """
+    db, agent = _open(agent_dir)
+    rank = "CASE COALESCE(type, 'general') {} ELSE {} END".format(
+        " ".join(f"WHEN '{t}' THEN {i}" for i, t in enumerate(agent_mailbox.PRIORITY_ORDER)),
+        len(agent_mailbox.PRIORITY_ORDER))
+    with _transaction(db):
+        rows = db.execute(f"SELECT id, data FROM messages WHERE agent = ? AND box = ? AND read = 0 "
+                          f"AND (expires_at IS NULL OR expires_at > ?) ORDER BY {rank}, id LIMIT ?",
+                          (agent, box, time.time(), min(n, 2 ** 62))).fetchall()
+        if not peek and rows:
+            ids = [message_id for message_id, _ in rows]
+            for i in range(0, len(ids), ACK_BATCH_SIZE):
+                batch = ids[i:i + ACK_BATCH_SIZE]
+                db.execute(f"UPDATE messages SET read = 1 WHERE id IN ({', '.join('?' * len(batch))})", batch)
+    return [_row_message(data, False) for _, data in rows]
+
+def sweep_expired(agent_dir, box):
+    """
+    Delete expired messages from a mailbox and prune expired keys
+
+    Returns:
+        Number of messages deleted
+    """
+    db, agent = _open(agent_dir)
+    now = time.time()
+    with _transaction(db):
+        deleted = db.execute("DELETE FROM messages WHERE agent = ? AND box = ? AND expires_at <= ?",
+                             (agent, box, now)).rowcount
+        db.execute("DELETE FROM message_keys WHERE agent = ? AND box = ? AND expires_at != 0 AND expires_at <= ?",
+                   (agent, box, now))
+    return deleted
+
+def compact_mailbox(agent_dir, box):
+    """
+    Move read messages into the mailbox archive and delete expired ones
+
+    Uses the same gzip day buckets as the JSONL backend, so
+    agent_mailbox.iter_archived reads them.
+
+    Returns:
+        Tuple of (number of messages archived, number of expired messages deleted)
+    """
+    expired = sweep_expired(agent_dir, box)
+    db, agent = _open(agent_dir)
+    with _transaction(db):
+        rows = db.execute("SELECT data FROM messages WHERE agent = ? AND box = ? AND read = 1 ORDER BY id",
+                          (agent, box)).fetchall()
+        # Archived before the delete commits; a crash in between can only
+        # leave messages in both places
+        messages = [_row_message(data, True) for data, in rows]
+        agent_mailbox.archive_messages(agent_dir, box, messages)
+        db.execute("DELETE FROM messages WHERE agent = ? AND box = ? AND read = 1", (agent, box))
+        # Keys of archived messages no longer reject duplicates, with or without a TTL
+        db.executemany("DELETE FROM message_keys WHERE agent = ? AND box = ? AND key = ?",
+                       [(agent, box, m["key"]) for m in messages if m.get("key")])
+    return len(rows), expired
+
+def migrate_mailbox(agent_dir, box):
+    """
+    Import an agent's file mailbox into the database
+
+    Reads a legacy inbox.json/outbox.json or a JSONL mailbox with its read
+    cursor, inserts the messages in one transaction and keeps the source
+    file as <name>.bak.
+
+    Args:
+        agent_dir: Path of the agent directory
+        box: Mailbox name ("inbox" or "outbox")
+
+    Returns:
+        Number of messages imported
+
+    Raises:
+        json.JSONDecodeError: If a legacy mailbox file is corrupt
+    """
+    sources = [path for path in (agent_mailbox.legacy_mailbox_path(agent_dir, box),
+                                 agent_mailbox.mailbox_path(agent_dir, box))
+               if os.path.exists(path) and os.path.getsize(path)]
+    if not sources:
+        return 0
+
+    # Keep file-based writers out until the sources are renamed
+    with agent_mailbox.mailbox_lock(agent_dir, box):
+        messages = []
+        if os.path.exists(agent_mailbox.legacy_mailbox_path(agent_dir, box)):
+            messages = agent_mailbox._read_legacy(agent_dir, box)
+        if os.path.exists(agent_mailbox.mailbox_path(agent_dir, box)):
+            cursor, acked = agent_mailbox.read_cursor_state(agent_dir, box)
+            for start, end, message in agent_mailbox.iter_log(agent_mailbox.mailbox_path(agent_dir, box)):
+                if end <= cursor or start in acked:
+                    message["read"] = True
+                messages.append(message)
+
+        for m in messages:
+            if not m.get("id"):
+                m["id"] = agent_mailbox.new_message_id()
+
+        db, agent = _open(agent_dir)
+        with _transaction(db):
+            db.executemany(
+                "INSERT INTO messages (agent, box, timestamp, type, sender, read, expires_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(agent, box, agent_mailbox.message_time(m), m.get("type"), m.get("from"),
+                  1 if m.get("read", False) else 0, m.get("expires_at"), json.dumps(m)) for m in messages])
+            db.executemany(
+                "INSERT OR REPLACE INTO message_keys (agent, box, key, expires_at) VALUES (?, ?, ?, ?)",
+                [(agent, box, m["key"], m.get("expires_at") or 0) for m in messages if m.get("key")])
+        for path in sources:
+            os.replace(path, path + ".bak")
+        shutil.rmtree(agent_mailbox.ids_dir(agent_dir, box), ignore_errors=True)
+    return len(messages)
+
+def agent_counts(agents_dir):
+    """
+    Count messages of every agent in one query
+
+    Args:
+        agents_dir: Path of the agents directory
+
+    Returns:
+        Dictionary of agent name to {"inbox", "outbox"} entries with
+        "messages", "unread" and "size" (bytes of message data)
+    """
+    db = connect(_agents_database_path(agents_dir))
+    counts = {}
+    rows = db.execute("SELECT agent, box, COUNT(*), "
+                      "SUM(read = 0 AND (expires_at IS NULL OR expires_at > ?)), SUM(LENGTH(data)) "
+                      "FROM messages GROUP BY agent, box", (time.time(),))
+    for agent, box, messages, unread, size in rows:
+        counts.setdefault(agent, {})[box] = {"messages": messages, "unread": unread or 0, "size": size or 0}
+    return counts
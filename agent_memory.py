@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Memory File Model for AI Agents
+
+This module edits an agent's memory.md through a parsed section model, so
+that a batch of updates costs one parse and one write however many
+sections it touches:
+- parse_memory splits the file once into a preamble and its "## " sections,
+  keeping every line as written, with an index from section title to section
+- add_entries, remove_entry and move_entry edit sections in place without
+  rescanning the text
+- render_memory serializes the model once; untouched sections come back
+  byte for byte
+"""
+
+import os
+
+import agent_durable
+
+MEMORY_NAME = "memory.md"
+SECTION_PREFIX = "## "
+ENTRY_PREFIX = "- "
+
+def memory_path(agent_dir):
+    """Path of the agent's memory file"""
+    return os.path.join(agent_dir, MEMORY_NAME)
+
+def parse_memory(text):
+    """
+    Parse memory.md into sections
+
+    Lines starting with "## " outside code fences start a section; deeper
+    headings such as "### " stay inside the section they appear in.
+
+    Args:
+        text: Contents of memory.md
+
+    Returns:
+        Memory dictionary with "preamble" (lines before the first section),
+        "sections" (list of {"title", "lines"} in file order, where lines
+        start with the heading) and "index" (title to section)
+    """
+    memory = {"preamble": [], "sections": [], "index": {}}
+    current = memory["preamble"]
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        if line.startswith("```"):
+            in_fence = not in_fence
+        elif not in_fence and line.startswith(SECTION_PREFIX):
+            section = {"title": line[len(SECTION_PREFIX):].strip(), "lines": []}
+            memory["sections"].append(section)
+            # The first of several sections with one title receives updates
+            memory["index"].setdefault(section["title"], section)
+            current = section["lines"]
+        current.append(line)
+    return memory
+
+def load_memory(agent_dir, title=None):
+    """
+    Read and parse an agent's memory.md
+
+    Args:
+        agent_dir: Path of the agent directory
+        title: Title line for a memory file that does not exist yet
+
+    Returns:
+        Memory dictionary (see parse_memory)
+    """
+    try:
+        with open(memory_path(agent_dir), 'r') as f:
+            text = f.read()
+    except OSError:
+        text = f"# {title}\n\n" if title else ""
+    return parse_memory(text)
+
+def render_memory(memory):
+    """
+    Serialize the memory model
+
+    Args:
+        memory: Memory dictionary
+
+    Returns:
+        Memory file text
+    """
+    parts = memory["preamble"][:]
+    for section in memory["sections"]:
+        parts.extend(section["lines"])
+    return "".join(parts)
+
+def save_memory(agent_dir, memory):
+    """Write the memory model back to memory.md atomically and durably"""
+    agent_durable.atomic_write(memory_path(agent_dir), render_memory(memory).encode("utf-8"))
+
+def add_entries(memory, title, entries):
+    """
+    Add entries at the end of a section, creating the section if needed
+
+    Args:
+        memory: Memory dictionary
+        title: Section title
+        entries: Entry texts (without the "- " prefix)
+    """
+    section = memory["index"].get(title)
+    if section is None:
+        section = _new_section(memory, title)
+    lines = section["lines"]
+
+    # Entries go after the last non-blank line, before the gap to the next section
+    end = len(lines)
+    while end > 1 and not lines[end - 1].strip():
+        end -= 1
+    if not lines[end - 1].endswith("\n"):
+        lines[end - 1] += "\n"
+    lines[end:end] = [f"{ENTRY_PREFIX}{entry}\n" for entry in entries]
+
+def remove_entry(memory, title, entry):
+    """
+    Remove the first entry of a section with the given text
+
+    Returns:
+        True if the entry was found
+    """
+    section = memory["index"].get(title)
+    if section is None:
+        return False
+    lines = section["lines"]
+    for i in range(1, len(lines)):
+        if lines[i].startswith(ENTRY_PREFIX) and lines[i][len(ENTRY_PREFIX):].rstrip("\n") == entry:
+            del lines[i]
+            return True
+    return False
+
+def move_entry(memory, entry, source, target):
+    """
+    Move an entry from one section to the end of another
+
+    Returns:
+        True if the entry was found in the source section
+    """
+    if not remove_entry(memory, source, entry):
+        return False
+    add_entries(memory, target, [entry])
+    return True
+
+def _new_section(memory, title):
+    """Append an empty section, separated from the previous one by a blank line"""
+    previous = memory["sections"][-1]["lines"] if memory["sections"] else memory["preamble"]
+    if previous:
+        if not previous[-1].endswith("\n"):
+            previous[-1] += "\n"
+        if previous[-1].strip():
+            previous.append("\n")
+    section = {"title": title, "lines": [f"{SECTION_PREFIX}{title}\n"]}
+    memory["sections"].append(section)
+    memory["index"][title] = section
+    return section
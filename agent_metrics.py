@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Command Metrics for AI Agents
+
+This module records where the time of a coordinator.py or agent_state.py
+command goes:
+- phase() times a block under a phase name (import, path_resolution,
+  json_parse, file_write, log_append, ...); it does nothing unless a
+  command is being recorded; phases timed on worker threads are kept
+  apart as threads.<name>, since they overlap the command's own phases
+- add_size() records payload sizes such as bytes written or messages read
+- finish() appends one JSON line per command to the file named by
+  $AGENT_METRICS_FILE, and prints the breakdown to stderr for --timings
+- summarize() aggregates a metrics file into per-command and per-phase
+  percentiles for the stats subcommand
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_ENV = "AGENT_METRICS_FILE"
+
+# Phases timed inside other phases, which already include their time
+NESTED_PHASES = ("fsync",)
+
+# Prefix of phases timed on threads other than the one recording the command
+THREAD_PREFIX = "threads."
+
+# Set when this module is imported, which the CLIs do before their other imports
+_import_start = time.perf_counter()
+_import_s = None
+
+# Record of the command being measured, or None when metrics are off
+_record = None
+_timings = False
+
+# Guards the phases and sizes of the record, which worker threads add to
+_lock = threading.Lock()
+
+def imported():
+    """Note that the CLI has finished importing its modules"""
+    global _import_s
+    _import_s = time.perf_counter() - _import_start
+
+def metrics_path():
+    """Path of the metrics sink from $AGENT_METRICS_FILE, or None"""
+    return os.environ.get(METRICS_ENV) or None
+
+def begin(tool, command, timings=False):
+    """
+    Start recording a command
+
+    Recording only happens with timings set or $AGENT_METRICS_FILE set.
+
+    Args:
+        tool: Name of the CLI ("coordinator" or "agent_state")
+        command: Subcommand being run
+        timings: Print the breakdown to stderr when the command finishes
+    """
+    global _record, _timings
+    _timings = timings
+    if not timings and not metrics_path():
+        _record = None
+        return
+    _record = {
+        "timestamp": time.time(),
+        "tool": tool,
+        "command": command,
+        "start": time.perf_counter(),
+        "thread": threading.get_ident(),
+        "phases": {},
+        "sizes": {},
+    }
+    if _import_s is not None:
+        _record["phases"]["import"] = _import_s
+
+@contextmanager
+def phase(name):
+    """
+    Time a block of work under a phase name
+
+    Time spent on worker threads goes to threads.<name>, so concurrent
+    blocks do not add up to more than the command took.
+    """
+    record = _record
+    if record is None:
+        yield
+        return
+    if threading.get_ident() != record["thread"]:
+        name = THREAD_PREFIX + name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            record["phases"][name] = record["phases"].get(name, 0) + seconds
+
+def add_size(name, value):
+    """Add to a payload size counter of the current command"""
+    record = _record
+    if record is not None:
+        with _lock:
+            record["sizes"][name] = record["sizes"].get(name, 0) + value
+
+def finish():
+    """
+    Stop recording the current command
+
+    Appends the record to the metrics file if one is configured and prints
+    the breakdown to stderr for --timings.
+    """
+    global _record
+    record = _record
+    _record = None
+    if record is None:
+        return
+
+    total = time.perf_counter() - record.pop("start")
+    record.pop("thread")
+    line = {
+        "timestamp": round(record["timestamp"], 3),
+        "tool": record["tool"],
+        "command": record["command"],
+        "total_ms": round((total + record["phases"].get("import", 0)) * 1000, 3),
+        "phases": {name: round(seconds * 1000, 3) for name, seconds in record["phases"].items()},
+        "sizes": record["sizes"],
+    }
+
+    path = metrics_path()
+    if path:
+        # One O_APPEND write per record keeps concurrent commands from interleaving
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(line) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    if _timings:
+        print(f"Timings for {line['tool']} {line['command']}: {line['total_ms']:.3f} ms total", file=sys.stderr)
+        for name, ms in line["phases"].items():
+            print(f"  {name:<16} {ms:10.3f} ms", file=sys.stderr)
+        accounted = sum(ms for name, ms in line["phases"].items() if name not in NESTED_PHASES and not name.startswith(THREAD_PREFIX))
+        print(f"  {'other':<16} {max(0.0, line['total_ms'] - accounted):10.3f} ms", file=sys.stderr)
+        for name, value in line["sizes"].items():
+            print(f"  {name:<16} {value:>10}", file=sys.stderr)
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list of samples"""
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+def summarize(path, command=None, since=None):
+    """
+    Aggregate a metrics file into percentiles
+
+    Args:
+        path: Path of the metrics JSONL file
+        command: Only include records of this command
+        since: Only include records at or after this epoch time
+
+    Returns:
+        Dictionary of "<tool> <command>" to {"count", "total", "phases",
+        "sizes"}, where total and each phase have p50/p95/p99/max in
+        milliseconds and sizes have the mean per command
+    """
+    samples = {}
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if command and record.get("command") != command:
+                continue
+            if since and record.get("timestamp", 0) < since:
+                continue
+            entry = samples.setdefault(f"{record.get('tool')} {record.get('command')}",
+                                       {"total": [], "phases": {}, "sizes": {}})
+            entry["total"].append(record.get("total_ms", 0))
+            for name, ms in record.get("phases", {}).items():
+                entry["phases"].setdefault(name, []).append(ms)
+            for name, value in record.get("sizes", {}).items():
+                entry["sizes"].setdefault(name, []).append(value)
+
+    def stats(values):
+        values = sorted(values)
+        return {"p50": percentile(values, 0.50), "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99), "max": values[-1]}
+
+    return {name: {"count": len(entry["total"]),
+                   "total": stats(entry["total"]),
+                   "phases": {phase_name: stats(values) for phase_name, values in sorted(entry["phases"].items())},
+                   "sizes": {size: round(sum(values) / len(values), 1) for size, values in sorted(entry["sizes"].items())}}
+            for name, entry in sorted(samples.items())}
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Agent Registry for AI Agents
+
+This module keeps an index of the agents directory in .registry/index.json:
+- Agent names and creation times, so listing agents and checking that one
+  exists do not scan the agents directory
+- The index is revalidated against the mtime of the agents directory, which
+  changes whenever an agent directory is added or removed
+- Mailbox message and unread counts, refreshed from file sizes and read
+  cursors so that unchanged mailboxes are never opened, and changed ones
+  are only read where they changed
+"""
+
+import os
+import json
+import time
+
+import agent_mailbox
+
+REGISTRY_DIR = ".registry"
+
+# Parsed registries by agents directory, reused while the index is unchanged
+_cache = {}
+
+def registry_path(agents_dir):
+    """Path of the registry index"""
+    return os.path.join(agents_dir, REGISTRY_DIR, "index.json")
+
+def load_registry(agents_dir):
+    """
+    Load the registry, rescanning the agents directory if it has changed
+
+    Args:
+        agents_dir: Path of the agents directory
+
+    Returns:
+        Registry dictionary with an "agents" mapping of name to entry
+    """
+    registry = _read(agents_dir)
+    try:
+        mtime = os.stat(agents_dir).st_mtime_ns
+    except OSError:
+        return {"mtime_ns": None, "agents": {}}
+
+    if registry.get("mtime_ns") != mtime:
+        with _lock(agents_dir):
+            registry = _read(agents_dir)
+            mtime = os.stat(agents_dir).st_mtime_ns
+            if registry.get("mtime_ns") != mtime:
+                registry = _rescan(agents_dir, registry, mtime)
+                _save(agents_dir, registry)
+    return registry
+
+def register_agent(agents_dir, agent_name):
+    """Add a newly created agent to the registry"""
+    register_agents(agents_dir, [agent_name])
+
+def register_agents(agents_dir, agent_names):
+    """
+    Add newly created agents to the registry with a single update
+
+    Called right after the agent directories are created, so that the
+    mtime change caused by those mkdirs does not trigger a rescan.
+
+    Args:
+        agents_dir: Path of the agents directory
+        agent_names: Names of the agents
+    """
+    with _lock(agents_dir):
+        registry = _read(agents_dir)
+        mtime = os.stat(agents_dir).st_mtime_ns
+        if registry.get("mtime_ns") is None:
+            registry = _rescan(agents_dir, registry, mtime)
+        else:
+            created = int(time.time())
+            for agent_name in agent_names:
+                registry["agents"].setdefault(agent_name, {"created": created})
+            registry["mtime_ns"] = mtime
+        _save(agents_dir, registry)
+
+def list_agents(agents_dir):
+    """List the names of all registered agents"""
+    return sorted(load_registry(agents_dir)["agents"])
+
+def agent_exists(agents_dir, agent_name):
+    """Check whether an agent is registered"""
+    return agent_name in load_registry(agents_dir)["agents"]
+
+def agent_stats(agents_dir, counts=None):
+    """
+    Get creation time and mailbox counts for every agent
+
+    Args:
+        agents_dir: Path of the agents directory
+        counts: Mailbox counts by agent name from a backend that keeps its
+            own (see agent_mailbox_sqlite.agent_counts), instead of the
+            counts of the mailbox files
+
+    Returns:
+        Dictionary of agent name to {"created", "inbox", "outbox"}, where each
+        mailbox entry has "messages", "unread" and "size" (bytes)
+    """
+    registry = load_registry(agents_dir)
+    if counts is not None:
+        empty = {"messages": 0, "unread": 0, "size": 0}
+        return {name: {"created": entry.get("created"),
+                       **{box: counts.get(name, {}).get(box, empty) for box in agent_mailbox.MAILBOXES}}
+                for name, entry in sorted(registry["agents"].items())}
+
+    changed = False
+    for name, entry in registry["agents"].items():
+        agent_dir = os.path.join(agents_dir, name)
+        for box in agent_mailbox.MAILBOXES:
+            stats = _refresh_counts(agent_dir, box, entry.get(box, {}))
+            if stats != entry.get(box):
+                entry[box] = stats
+                changed = True
+
+    if changed:
+        with _lock(agents_dir):
+            current = _read(agents_dir)
+            for name, entry in registry["agents"].items():
+                if name in current.get("agents", {}):
+                    current["agents"][name].update({box: entry[box] for box in agent_mailbox.MAILBOXES})
+            _save(agents_dir, current)
+
+    return {name: {"created": entry.get("created"),
+                   **{box: {"messages": entry[box]["messages"],
+                            "unread": entry[box]["unread"] - len(entry[box].get("acked", [])),
+                            "size": entry[box]["size"]} for box in agent_mailbox.MAILBOXES}}
+            for name, entry in sorted(registry["agents"].items())}
+
+def _refresh_counts(agent_dir, box, stats):
+    """
+    Bring the counts of one mailbox up to date
+
+    Only messages appended since the last refresh, and messages the read
+    cursor moved past, are read.
+    """
+    path = agent_mailbox.mailbox_path(agent_dir, box)
+    if not os.path.exists(path):
+        legacy_path = agent_mailbox.legacy_mailbox_path(agent_dir, box)
+        if not os.path.exists(legacy_path):
+            return {"messages": 0, "unread": 0, "size": 0}
+        st = os.stat(legacy_path)
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        if stats.get("legacy") != key:
+            try:
+                messages = agent_mailbox.read_messages(agent_dir, box)
+            except json.JSONDecodeError:
+                messages = []
+            stats = {"legacy": key, "size": st.st_size, "messages": len(messages),
+                     "unread": sum(1 for m in messages if not m.get("read", False))}
+        return stats
+
+    st = os.stat(path)
+    cursor, acked = agent_mailbox.read_cursor_state(agent_dir, box)
+    if (stats.get("ino") != st.st_ino or st.st_size < stats.get("size", 0)
+            or cursor < stats.get("cursor", 0)):
+        stats = {"ino": st.st_ino, "size": 0, "cursor": 0, "messages": 0, "unread": 0}
+    else:
+        stats = dict(stats)
+
+    # Messages counted earlier that the cursor has since moved past
+    if cursor > stats["cursor"]:
+        counted_end = min(cursor, stats["size"])
+        for start, _, message in agent_mailbox.iter_log(path, stats["cursor"]):
+            if start >= counted_end:
+                break
+            if not message.get("read", False):
+                stats["unread"] -= 1
+        stats["cursor"] = cursor
+
+    # Messages appended since the last refresh
+    if st.st_size > stats["size"]:
+        for _, end, message in agent_mailbox.iter_log(path, stats["size"]):
+            stats["messages"] += 1
+            if end > cursor and not message.get("read", False):
+                stats["unread"] += 1
+            stats["size"] = end
+
+    # Messages acknowledged out of order are still counted as unread above
+    counted_acked = sorted(a for a in acked if a < stats["size"])
+    if counted_acked:
+        stats["acked"] = counted_acked
+    else:
+        stats.pop("acked", None)
+    return stats
+
+def _rescan(agents_dir, registry, mtime):
+    """Rebuild the agent list from the agents directory, keeping known entries"""
+    known = registry.get("agents", {})
+    agents = {}
+    for name in os.listdir(agents_dir):
+        if name.startswith(".") or not os.path.isdir(os.path.join(agents_dir, name)):
+            continue
+        agents[name] = known.get(name) or {
+            "created": int(os.stat(os.path.join(agents_dir, name)).st_ctime)
+        }
+    return {"mtime_ns": mtime, "agents": agents}
+
+def _read(agents_dir):
+    """Read the registry index, reusing the parsed copy if it is unchanged"""
+    path = registry_path(agents_dir)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {"mtime_ns": None, "agents": {}}
+
+    cached = _cache.get(agents_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, 'r') as f:
+            registry = json.load(f)
+    except (OSError, ValueError):
+        return {"mtime_ns": None, "agents": {}}
+    _cache[agents_dir] = (mtime, registry)
+    return registry
+
+def _save(agents_dir, registry):
+    """Write the registry index atomically"""
+    path = registry_path(agents_dir)
+    agent_mailbox.atomic_write(path, json.dumps(registry).encode("utf-8"))
+    _cache[agents_dir] = (os.stat(path).st_mtime_ns, registry)
+
+def _lock(agents_dir):
+    """Lock serializing registry updates"""
+    os.makedirs(os.path.join(agents_dir, REGISTRY_DIR), exist_ok=True)
+    return agent_mailbox.mailbox_lock(os.path.join(agents_dir, REGISTRY_DIR), "index")
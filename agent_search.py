@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Full-Text Search for AI Agents
+
+This module keeps a per-agent search index over memory.md, procedures.md,
+the session log and mailbox messages in search_index.db:
+- Files are split into documents (markdown sections, session log entries,
+  messages) stored in an SQLite FTS5 table, which ranks matches with BM25
+- refresh_index only re-reads sources whose inode, size or mtime changed;
+  append-only sources (the active session log and JSONL mailboxes) are
+  read from where the last refresh stopped, and gzip archives are indexed
+  once. A new file can reuse the inode of the one it replaced, so these
+  are also keyed by how many segments were rotated out or how many bytes
+  compaction removed, and one that shrank is read again from the start
+- search returns the best-ranked documents with highlighted snippets, for
+  the search command and for pulling relevant context into prompts
+"""
+
+import os
+import gzip
+import json
+import sqlite3
+from datetime import datetime
+
+import agent_log
+import agent_mailbox
+
+INDEX_NAME = "search_index.db"
+
+# Markdown files indexed by section
+MARKDOWN_SOURCES = ("memory.md", "procedures.md")
+
+# BM25 weights of the title and body columns
+TITLE_WEIGHT = 2.0
+BODY_WEIGHT = 1.0
+
+# Approximate number of words in a snippet
+SNIPPET_WORDS = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_documents_source ON documents (source);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title, body, content='documents', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+"""
+
+def index_path(agent_dir):
+    """Path of the agent's search index"""
+    return os.path.join(agent_dir, INDEX_NAME)
+
+def connect(agent_dir):
+    """
+    Open the search index, creating the schema
+
+    Raises:
+        sqlite3.OperationalError: If SQLite was built without FTS5
+    """
+    db = sqlite3.connect(index_path(agent_dir), timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+def refresh_index(agent_dir, backend=agent_mailbox, db=None):
+    """
+    Bring the search index up to date with the agent's files
+
+    Args:
+        agent_dir: Path of the agent directory
+        backend: Mailbox backend module holding the agent's messages
+        db: Open index connection, or None to open one
+
+    Returns:
+        Number of documents added
+    """
+    db = db or connect(agent_dir)
+    added = 0
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        indexed = {source: (key, position) for source, key, position in
+                   db.execute("SELECT source, key, position FROM sources")}
+        seen = set()
+        for source, kind, key, reader in _sources(agent_dir, backend):
+            seen.add(source)
+            previous_key, position = indexed.get(source, (None, 0))
+            if previous_key == key[0] and position == key[1]:
+                continue
+            if previous_key != key[0] or key[1] < position:
+                # Replaced or rewritten: index it again from the start
+                db.execute("DELETE FROM documents WHERE source = ?", (source,))
+                position = 0
+            documents, position = reader(position)
+            db.executemany("INSERT INTO documents (source, kind, title, body, timestamp) VALUES (?, ?, ?, ?, ?)",
+                           [(source, kind, title, body, timestamp) for title, body, timestamp in documents])
+            db.execute("INSERT OR REPLACE INTO sources (source, key, position) VALUES (?, ?, ?)",
+                       (source, key[0], position))
+            added += len(documents)
+
+        # Sources that are gone, e.g. a session log segment that was archived
+        for source in set(indexed) - seen:
+            db.execute("DELETE FROM documents WHERE source = ?", (source,))
+            db.execute("DELETE FROM sources WHERE source = ?", (source,))
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+    return added
+
+def search(agent_dir, query, limit=10, kinds=None, backend=agent_mailbox, refresh=True):
+    """
+    Search an agent's memory, procedures, session log and messages
+
+    Args:
+        agent_dir: Path of the agent directory
+        query: Words to search for; documents matching more of them, and
+            rarer ones, rank higher
+        limit: Maximum number of results
+        kinds: Optional document kinds to search ("memory", "procedures",
+            "session_log", "inbox", "outbox")
+        backend: Mailbox backend module holding the agent's messages
+        refresh: Update the index first
+
+    Returns:
+        List of dictionaries with "kind", "source", "title", "timestamp",
+        "snippet" and "score" (lower is better), best first
+    """
+    # Quoted terms keep FTS5 query syntax in the input from being interpreted
+    terms = "".join(c if c.isalnum() else " " for c in query).split()
+    if not terms:
+        return []
+
+    db = connect(agent_dir)
+    try:
+        if refresh:
+            refresh_index(agent_dir, backend, db)
+        match = " OR ".join('"' + term + '"' for term in terms)
+        sql = (f"SELECT d.kind, d.source, d.title, d.timestamp, "
+               f"snippet(documents_fts, 1, '[', ']', '...', {SNIPPET_WORDS}), "
+               f"bm25(documents_fts, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS score "
+               f"FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+               f"WHERE documents_fts MATCH ?")
+        params = [match]
+        if kinds:
+            sql += f" AND d.kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        return [{"kind": kind, "source": source, "title": title, "timestamp": timestamp,
+                 "snippet": snippet, "score": round(score, 4)}
+                for kind, source, title, timestamp, snippet, score in db.execute(sql, params)]
+    finally:
+        db.close()
+
+def _sources(agent_dir, backend):
+    """
+    List the indexable sources of an agent
+
+    Yields:
+        Tuples of (source name, kind, (key, end position), reader), where
+        reader(position) returns (list of (title, body, timestamp), new
+        position). A source whose key is unchanged but whose end position
+        moved forward has only been appended to.
+    """
+    for name in MARKDOWN_SOURCES:
+        path = os.path.join(agent_dir, name)
+        key = _file_key(path)
+        if key:
+            yield name, name[:-len(".md")], (key, 0), lambda position, path=path: (_read_markdown(path), 0)
+
+    segments = agent_log.segment_paths(agent_dir)
+    for path in segments:
+        source = os.path.relpath(path, agent_dir)
+        if path.endswith(".gz"):
+            yield source, "session_log", (_file_key(path), 0), lambda position, path=path: (_read_log(path), 0)
+        else:
+            st = os.stat(path)
+            # A segment started by rotation follows one more archived segment
+            yield (source, "session_log", (f"{st.st_ino}:{len(segments) - 1}", st.st_size),
+                   lambda position, path=path: _read_log_tail(path, position))
+
+    for box in agent_mailbox.MAILBOXES:
+        directory = agent_mailbox.archive_dir(agent_dir, box)
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        for name in names:
+            if name.endswith(".jsonl.gz"):
+                path = os.path.join(directory, name)
+                yield (os.path.relpath(path, agent_dir), box, (_file_key(path), 0),
+                       lambda position, path=path: (_read_archive(path), 0))
+
+        if backend is not agent_mailbox:
+            first, last = backend.message_id_range(agent_dir, box)
+            if first is not None:
+                # Compaction removes the oldest messages, which changes the first id
+                yield (f"db:{box}", box, (str(first), last),
+                       lambda position, box=box: _read_backend(agent_dir, backend, box, position))
+            continue
+
+        path = agent_mailbox.mailbox_path(agent_dir, box)
+        legacy_path = agent_mailbox.legacy_mailbox_path(agent_dir, box)
+        if os.path.exists(path):
+            st = os.stat(path)
+            # Every compaction that rewrites the log removes more bytes
+            removed = agent_mailbox.offset_of(agent_mailbox.load_cursor(agent_dir, box)[2], st.st_size) - st.st_size
+            yield (os.path.basename(path), box, (f"{st.st_ino}:{removed}", st.st_size),
+                   lambda position, path=path: _read_mailbox_tail(path, position))
+        elif os.path.exists(legacy_path):
+            yield (os.path.basename(legacy_path), box, (_file_key(legacy_path), 0),
+                   lambda position, box=box: (_read_legacy(agent_dir, box), 0))
+
+def _file_key(path):
+    """Key of a file that is rewritten rather than appended to"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+def _read_markdown(path):
+    """Split a markdown file into one document per heading"""
+    documents = []
+    title, body, parent = "", [], ""
+    in_fence = False
+    with open(path, 'r', encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("```"):
+                in_fence = not in_fence
+            elif not in_fence and line.startswith("#"):
+                if "".join(body).strip():
+                    documents.append((title, "".join(body), None))
+                heading = line.lstrip("#").strip()
+                level = len(line) - len(line.lstrip("#"))
+                # Subsections carry the title of their "## " section
+                if level <= 2:
+                    parent = heading
+                    title = heading
+                else:
+                    title = f"{parent} / {heading}" if parent else heading
+                body = []
+                continue
+            body.append(line)
+    if "".join(body).strip():
+        documents.append((title, "".join(body), None))
+    return documents
+
+def _log_documents(entries):
+    """Documents of parsed session log entries"""
+    return [(entry["type"], entry["content"], entry["session"]) for entry in entries]
+
+def _read_log(path):
+    """Index a whole (archived) session log segment"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding="utf-8", errors="replace") as f:
+        return _log_documents(agent_log.parse_entries(f))
+
+def _read_log_tail(path, position):
+    """Index session log entries appended after a byte position"""
+    with open(path, 'rb') as f:
+        f.seek(position)
+        data = f.read()
+    # Stop after the last complete line
+    data = data[:data.rfind(b"\n") + 1]
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    # The active segment holds one day, so its last header is the one the tail belongs to
+    session, offset = agent_log.find_last_section(path)
+    if session is not None and offset < position:
+        lines.insert(0, f"## Session: {session}\n")
+    return _log_documents(agent_log.parse_entries(lines)), position + len(data)
+
+def _message_document(message):
+    """Document of a mailbox message"""
+    title = f"{message.get('subject', 'No subject')} (from {message.get('from', 'Unknown')})"
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, (int, float)):
+        timestamp = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+    return title, str(message.get("content", "")), timestamp
+
+def _read_mailbox_tail(path, position):
+    """Index JSONL mailbox messages appended after a byte position"""
+    documents = []
+    for _, position, message in agent_mailbox.iter_log(path, position):
+        documents.append(_message_document(message))
+    return documents, position
+
+def _read_legacy(agent_dir, box):
+    """Index a legacy JSON mailbox"""
+    try:
+        return [_message_document(m) for m in agent_mailbox.read_messages(agent_dir, box)]
+    except json.JSONDecodeError:
+        return []
+
+def _read_archive(path):
+    """Index a day bucket of the mailbox archive"""
+    with gzip.open(path, 'rt', encoding="utf-8") as f:
+        return [_message_document(json.loads(line)) for line in f if line.strip()]
+
+def _read_backend(agent_dir, backend, box, position):
+    """Index messages of a database backend with ids above position"""
+    documents = []
+    for position, message in backend.iter_messages(agent_dir, box, after=position):
+        documents.append(_message_document(message))
+    return documents, position
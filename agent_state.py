@@ -14,23 +14,61 @@ import json
 import time
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
 import sys
 
+import agent_metrics
+import agent_mailbox
+import agent_registry
+import agent_journal
+import agent_memory
+import agent_search
+
+agent_metrics.imported()
+
 AGENTS_DIR = os.path.expanduser("~/_projects/ai-agents/agents")
 
+# Mailbox storage, chosen with $AGENT_MAILBOX_BACKEND ("jsonl" or "sqlite")
+mailbox = agent_mailbox.load_backend()
+
+# Bumped when the layout of prompt_cache.json changes
+PROMPT_CACHE_VERSION = 4
+
+# Characters per token for estimate_tokens; close enough for English text
+CHARS_PER_TOKEN = 4
+
+# Under --max-tokens, the current state may take this share of the budget,
+# and this share is held back for session_state.md while messages are added
+STATE_SHARE = 0.25
+SESSION_STATE_SHARE = 0.25
+
+# Under --max-tokens, longer unread messages are cut to this many tokens
+MESSAGE_MAX_TOKENS = 500
+
+# Search results pulled into the prompt by generate-prompt --relevant
+RELEVANT_SNIPPETS = 5
+
+def _agent_dir_exists(agent_dir):
+    """Check that an agent directory exists (timed as path resolution)"""
+    with agent_metrics.phase("path_resolution"):
+        return os.path.exists(agent_dir)
+
 def save_agent_state(agent_name, state_data):
     """
     Save agent's current state
     
+    state.json is rewritten, and the change against the previous version
+    is appended to state.journal.
+    
     Args:
         agent_name: Name of the agent
         state_data: Dictionary of state information
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    state_path = os.path.join(agent_dir, "state.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return False
         
@@ -38,92 +76,87 @@ def save_agent_state(agent_name, state_data):
     state_data["last_updated"] = int(time.time())
     
     try:
-        with open(state_path, 'w') as f:
-            json.dump(state_data, f, indent=2)
+        with agent_metrics.phase("file_write"):
+            agent_journal.save_state(agent_dir, state_data, time.time())
         return True
     except Exception as e:
         print(f"Error saving state: {e}")
         return False
 
-def load_agent_state(agent_name):
+def load_agent_state(agent_name, at=None):
     """
     Load agent's current state
     
     Args:
         agent_name: Name of the agent
+        at: Optional epoch seconds to load the state as it was saved at
+            that time
         
     Returns:
         Dictionary of state information or empty dict if not found
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    state_path = os.path.join(agent_dir, "state.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return {}
         
-    # Check if state file exists
-    if not os.path.exists(state_path):
-        print(f"No saved state found for {agent_name}")
-        return {}
-        
     try:
-        with open(state_path, 'r') as f:
-            return json.load(f)
+        with agent_metrics.phase("json_parse"):
+            state = agent_journal.load_state(agent_dir, at)
     except Exception as e:
         print(f"Error loading state: {e}")
         return {}
+    
+    # Check if any state was saved
+    if state is None:
+        if at is None:
+            print(f"No saved state found for {agent_name}")
+        else:
+            print(f"No saved state found for {agent_name} at {datetime.fromtimestamp(at).strftime('%Y-%m-%d %H:%M:%S')}")
+        return {}
+    return state
 
-def update_memory(agent_name, new_memories):
+def update_memory(agent_name, new_memories, remove=None, move=None):
     """
     Update agent's memory.md file with new memories
     
+    memory.md is parsed once, every change is applied to the parsed
+    sections (additions, then moves, then removals), and the file is
+    written once at the end.
+    
     Args:
         agent_name: Name of the agent
         new_memories: Dictionary of memory sections and content to add
+            (a string or a list of entries per section)
+        remove: Optional dictionary of sections and entries to remove
+        move: Optional list of (entry, from section, to section) tuples
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    memory_path = os.path.join(agent_dir, "memory.md")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return False
         
     # Read existing memory
-    try:
-        with open(memory_path, 'r') as f:
-            memory_content = f.read()
-    except:
-        memory_content = f"# {agent_name.title()}'s Memory Database\n\n"
+    with agent_metrics.phase("file_read"):
+        memory = agent_memory.load_memory(agent_dir, f"{agent_name.title()}'s Memory Database")
     
     # Update memory sections
     for section, content in new_memories.items():
-        # Check if section exists
-        section_header = f"## {section}"
-        if section_header in memory_content:
-            # Find the end of the section
-            section_start = memory_content.find(section_header)
-            next_section = memory_content.find("## ", section_start + len(section_header))
-            if next_section == -1:
-                # This is the last section, append to the end
-                memory_content += f"\n- {content}"
-            else:
-                # Insert before the next section
-                memory_content = (
-                    memory_content[:next_section] + 
-                    f"- {content}\n\n" + 
-                    memory_content[next_section:]
-                )
-        else:
-            # Add new section
-            memory_content += f"\n## {section}\n- {content}\n"
+        agent_memory.add_entries(memory, section, [content] if isinstance(content, str) else content)
+    for entry, source, target in (move or []):
+        agent_memory.move_entry(memory, entry, source, target)
+    for section, entries in (remove or {}).items():
+        for entry in ([entries] if isinstance(entries, str) else entries):
+            agent_memory.remove_entry(memory, section, entry)
     
     # Write updated memory
     try:
-        with open(memory_path, 'w') as f:
-            f.write(memory_content)
+        with agent_metrics.phase("file_write"):
+            agent_memory.save_memory(agent_dir, memory)
         return True
     except Exception as e:
         print(f"Error updating memory: {e}")
@@ -140,64 +173,108 @@ def get_unread_messages(agent_name):
         List of unread messages
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    inbox_path = os.path.join(agent_dir, "inbox.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return []
         
-    # Check if inbox file exists
-    if not os.path.exists(inbox_path):
+    try:
+        with agent_metrics.phase("json_parse"):
+            return mailbox.get_unread(agent_dir, "inbox")
+    except Exception as e:
+        print(f"Error getting unread messages: {e}")
+        return []
+
+def pop_next(agent_name, n=1):
+    """
+    Take the highest-priority unread messages from agent's inbox
+    
+    Messages are returned by type (system, task, question, feedback, then
+    general) and oldest first within a type, and are marked as read.
+    
+    Args:
+        agent_name: Name of the agent
+        n: Maximum number of messages to take
+        
+    Returns:
+        List of up to n messages
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    # Ensure agent directory exists
+    if not _agent_dir_exists(agent_dir):
+        print(f"Error: Agent '{agent_name}' does not exist")
         return []
         
     try:
-        with open(inbox_path, 'r') as f:
-            inbox = json.load(f)
-        
-        # Get unread messages
-        unread = [m for m in inbox.get("messages", []) if not m.get("read", False)]
-        return unread
+        with agent_metrics.phase("json_parse"):
+            return mailbox.pop_next(agent_dir, "inbox", n)
     except Exception as e:
-        print(f"Error getting unread messages: {e}")
+        print(f"Error taking next messages: {e}")
         return []
 
-def mark_messages_read(agent_name):
+def mark_messages_read(agent_name, until=None):
     """
     Mark all messages in agent's inbox as read
     
     Args:
         agent_name: Name of the agent
+        until: Optional epoch seconds; only messages with a timestamp at or
+            before this time are marked read
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    inbox_path = os.path.join(agent_dir, "inbox.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return False
         
-    # Check if inbox file exists
-    if not os.path.exists(inbox_path):
+    # Check if inbox exists
+    if not mailbox.mailbox_exists(agent_dir, "inbox"):
         return False
         
     try:
-        with open(inbox_path, 'r') as f:
-            inbox = json.load(f)
-        
-        # Mark all messages as read
-        for m in inbox.get("messages", []):
-            m["read"] = True
-        
-        # Write updated inbox
-        with open(inbox_path, 'w') as f:
-            json.dump(inbox, f, indent=2)
-        
+        with agent_metrics.phase("file_write"):
+            if until is None:
+                mailbox.mark_all_read(agent_dir, "inbox")
+            else:
+                mailbox.ack_until(agent_dir, "inbox", until)
         return True
     except Exception as e:
         print(f"Error marking messages read: {e}")
         return False
 
+def mark_read_by_id(agent_name, message_ids):
+    """
+    Mark individual messages in agent's inbox as read
+    
+    Messages are looked up by their "id" through the mailbox's id index,
+    so the cost grows with the number of ids, not with the inbox.
+    
+    Args:
+        agent_name: Name of the agent
+        message_ids: Ids of the processed messages
+        
+    Returns:
+        List of the ids that were unread and are now marked read
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    # Ensure agent directory exists
+    if not _agent_dir_exists(agent_dir):
+        print(f"Error: Agent '{agent_name}' does not exist")
+        return []
+        
+    try:
+        with agent_metrics.phase("file_write"):
+            acknowledged = mailbox.ack_ids(agent_dir, "inbox", message_ids)
+        agent_metrics.add_size("messages", len(acknowledged))
+        return acknowledged
+    except Exception as e:
+        print(f"Error marking messages read: {e}")
+        return []
+
 def add_response(agent_name, response):
     """
     Add a response to agent's outbox
@@ -207,45 +284,64 @@ def add_response(agent_name, response):
         response: Response content
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    outbox_path = os.path.join(agent_dir, "outbox.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_dir_exists(agent_dir):
         print(f"Error: Agent '{agent_name}' does not exist")
         return False
         
-    # Create or update outbox
-    if os.path.exists(outbox_path):
-        try:
-            with open(outbox_path, 'r') as f:
-                outbox = json.load(f)
-        except:
-            outbox = {"messages": []}
-    else:
-        outbox = {"messages": []}
-    
-    # Add new response
-    outbox["messages"].append({
-        "timestamp": int(time.time()),
-        "content": response,
-        "read": False
-    })
-    
-    # Save updated outbox
+    # Append new response
     try:
-        with open(outbox_path, 'w') as f:
-            json.dump(outbox, f, indent=2)
+        with agent_metrics.phase("file_write"):
+            mailbox.append_message(agent_dir, "outbox", {
+                "from": agent_name,
+                "timestamp": int(time.time()),
+                "content": response,
+                "read": False
+            })
         return True
     except Exception as e:
         print(f"Error adding response: {e}")
         return False
 
-def generate_state_prompt(agent_name):
+def search_agent(agent_name, query, limit=10, kinds=None):
+    """
+    Search an agent's memory, procedures, session log and messages
+    
+    The search index is brought up to date first, which only reads files
+    that changed since the last search.
+    
+    Args:
+        agent_name: Name of the agent
+        query: Words to search for
+        limit: Maximum number of results
+        kinds: Optional list of document kinds ("memory", "procedures",
+            "session_log", "inbox", "outbox")
+        
+    Returns:
+        List of results (see agent_search.search), best first
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    if not _agent_dir_exists(agent_dir):
+        print(f"Error: Agent '{agent_name}' does not exist")
+        return []
+    
+    try:
+        with agent_metrics.phase("search"):
+            return agent_search.search(agent_dir, query, limit, kinds, backend=mailbox)
+    except Exception as e:
+        print(f"Error searching {agent_name}: {e}")
+        return []
+
+def generate_state_prompt(agent_name, max_tokens=None, query=None):
     """
     Generate a comprehensive state prompt for the agent
     
     Args:
         agent_name: Name of the agent
+        max_tokens: Optional token budget the prompt must fit in
+        query: Optional search query whose best matches in the agent's
+            memory, procedures, log and messages are included
         
     Returns:
         String with complete state information
@@ -253,88 +349,466 @@ def generate_state_prompt(agent_name):
     # Load agent state
     state = load_agent_state(agent_name)
     
-    # Get unread messages
-    unread = get_unread_messages(agent_name)
+    # Get unread messages, most urgent types first
+    unread = agent_mailbox.sort_by_priority(get_unread_messages(agent_name))
     
     # Get agent directory
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
     
     # Build state prompt
-    prompt = f"# {agent_name.title()} State Initialization\n\n"
+    blocks = [_message_block(msg) for msg in unread]
+    prompt = _assemble_prompt(agent_name, _session_state_section(agent_dir), _state_section(state),
+                              blocks, max_tokens, _relevant_section(agent_name, query))
     
-    # Add session state if available
-    session_state_path = os.path.join(agent_dir, "session_state.md")
-    if os.path.exists(session_state_path):
-        try:
-            with open(session_state_path, 'r') as f:
-                session_state = f.read()
-            prompt += "## Session State\n"
-            prompt += session_state + "\n\n"
-        except Exception as e:
-            print(f"Error reading session state: {e}")
-    
-    # Add state information
-    if state:
-        prompt += "## Current State\n"
-        prompt += f"- Last active: {datetime.fromtimestamp(state.get('last_updated', 0)).strftime('%Y-%m-%d %H:%M:%S')}\n"
-        
-        # Add current project
-        if "current_project" in state:
-            prompt += f"- Current project: {state.get('current_project')}\n"
+    agent_metrics.add_size("messages", len(unread))
+    agent_metrics.add_size("prompt_bytes", len(prompt))
+    return prompt
+
+def generate_prompts(agent_names, max_tokens=None, query=None, cached=False, max_workers=16):
+    """
+    Generate state prompts for many agents in parallel
+    
+    One process with a thread pool replaces a process per agent, so the
+    imports and mailbox backend setup are paid once for the whole batch.
+    
+    Args:
+        agent_names: Names of the agents
+        max_tokens: Optional token budget each prompt must fit in
+        query: Optional search query for relevant context
+        cached: Reuse unchanged sections from each agent's prompt cache
+        max_workers: Number of threads generating prompts
         
-        # Add emotional state if available
-        if "emotional_state" in state:
-            prompt += f"- Emotional state: {state.get('emotional_state')}\n"
+    Yields:
+        Tuples of (agent name, prompt or None if the agent does not exist,
+        seconds taken), in the order the prompts finish
+    """
+    def generate(agent_name):
+        start = time.perf_counter()
+        if not _agent_dir_exists(os.path.join(AGENTS_DIR, agent_name)):
+            prompt = None
+        elif cached:
+            prompt = generate_state_prompt_cached(agent_name, max_tokens, query)[0]
+        else:
+            prompt = generate_state_prompt(agent_name, max_tokens, query)
+        return agent_name, prompt, time.perf_counter() - start
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in as_completed([executor.submit(generate, name) for name in agent_names]):
+            yield future.result()
+
+def _session_state_section(agent_dir):
+    """Prompt section with the contents of session_state.md"""
+    session_state_path = os.path.join(agent_dir, "session_state.md")
+    if not os.path.exists(session_state_path):
+        return ""
+    try:
+        with agent_metrics.phase("file_read"), open(session_state_path, 'r') as f:
+            session_state = f.read()
+        return "## Session State\n" + session_state + "\n\n"
+    except Exception as e:
+        print(f"Error reading session state: {e}")
+        return ""
+
+def _state_section(state):
+    """Prompt section describing the saved state"""
+    if not state:
+        return "## Current State\n- No previous state information available\n"
+    
+    section = "## Current State\n"
+    section += f"- Last active: {datetime.fromtimestamp(state.get('last_updated', 0)).strftime('%Y-%m-%d %H:%M:%S')}\n"
+    
+    # Add current project
+    if "current_project" in state:
+        section += f"- Current project: {state.get('current_project')}\n"
+    
+    # Add emotional state if available
+    if "emotional_state" in state:
+        section += f"- Emotional state: {state.get('emotional_state')}\n"
+    
+    # Add current tasks
+    if "active_tasks" in state and state["active_tasks"]:
+        section += "- Active tasks:\n"
+        for task in state["active_tasks"]:
+            section += f"  * {task}\n"
+    
+    # Add any other state information
+    for key, value in state.items():
+        if key not in ["last_updated", "current_project", "emotional_state", "active_tasks"]:
+            section += f"- {key}: {value}\n"
+    return section
+
+def _relevant_section(agent_name, query):
+    """Prompt section with the search results for a query"""
+    if not query:
+        return ""
+    results = search_agent(agent_name, query, RELEVANT_SNIPPETS)
+    if not results:
+        return ""
+    section = "\n## Relevant Context\n"
+    for result in results:
+        snippet = " ".join(result["snippet"].split())
+        section += f"- [{result['kind']}] {result['title']}: {snippet}\n"
+    return section
+
+def _format_message(msg):
+    """Prompt block for one unread message"""
+    sender = msg.get("from", "Unknown")
+    timestamp = datetime.fromtimestamp(msg.get("timestamp", 0)).strftime("%Y-%m-%d %H:%M:%S")
+    subject = msg.get("subject", "No subject")
+    message_type = msg.get("type", "general")
+    content = msg.get("content", "")
+    
+    block = f"### Message from {sender} at {timestamp}\n"
+    block += f"**Subject:** {subject}\n"
+    block += f"**Type:** {message_type}\n"
+    if msg.get("id"):
+        block += f"**Id:** {msg['id']}\n"
+    block += f"**Content:**\n{content}\n\n"
+    return block
+
+def _message_block(msg):
+    """Priority rank, prompt block and one-line summary of an unread message"""
+    message_type = msg.get("type", "general")
+    summary = f"- {msg.get('subject', 'No subject')} (from {msg.get('from', 'Unknown')}, {message_type})\n"
+    return [agent_mailbox.priority_rank(message_type), _format_message(msg), summary]
+
+def estimate_tokens(text):
+    """Estimate the token count of text without a tokenizer"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _truncate(text, max_tokens, marker="\n[... truncated ...]\n"):
+    """Cut text to at most max_tokens, ending with marker if anything was cut"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max_tokens * CHARS_PER_TOKEN - len(marker)
+    if keep <= 0:
+        return ""
+    # Prefer cutting at a line break, unless that would drop much of what fits
+    line_end = text.rfind("\n", 0, keep)
+    if line_end >= keep * 3 // 4:
+        keep = line_end
+    return text[:keep] + marker
+
+def _assemble_prompt(agent_name, session_text, state_text, blocks, max_tokens=None, relevant_text=""):
+    """
+    Put the prompt sections together, within a token budget if given
+    
+    Over budget, sections are filled in priority order: the current state
+    (up to STATE_SHARE of the budget, with long lines cut) and relevant
+    context (up to the same share), then unread
+    messages by priority (each cut to MESSAGE_MAX_TOKENS; once one does
+    not fit, the rest are summarized as counts and subjects), then
+    session_state.md with whatever is left, of which SESSION_STATE_SHARE
+    was held back from the messages.
+    
+    Args:
+        agent_name: Name of the agent
+        session_text: Session state section
+        state_text: Current state section
+        blocks: [rank, text, summary] of unread messages in priority order
+        max_tokens: Optional token budget
+        relevant_text: Relevant context section
         
-        # Add current tasks
-        if "active_tasks" in state and state["active_tasks"]:
-            prompt += "- Active tasks:\n"
-            for task in state["active_tasks"]:
-                prompt += f"  * {task}\n"
+    Returns:
+        Prompt string
+    """
+    header = f"# {agent_name.title()} State Initialization\n\n"
+    unread_heading = "\n## Unread Messages\n" if blocks else ""
+    prompt = (header + session_text + state_text + relevant_text + unread_heading
+              + "".join(block[1] for block in blocks))
+    if max_tokens is None or estimate_tokens(prompt) <= max_tokens:
+        return prompt
+    
+    # Current state, one line per key
+    state_budget = int(max_tokens * STATE_SHARE)
+    line_budget = max(1, state_budget // 4)
+    state_lines = [_truncate(line, line_budget, " [...]") if line else line
+                   for line in state_text.split("\n")]
+    state_text = _truncate("\n".join(state_lines), state_budget)
+    relevant_text = _truncate(relevant_text, state_budget)
+    
+    # Unread messages, in priority order until the budget runs out
+    remaining = (max_tokens - estimate_tokens(header) - estimate_tokens(state_text)
+                 - estimate_tokens(relevant_text))
+    session_reserve = min(estimate_tokens(session_text), int(max_tokens * SESSION_STATE_SHARE))
+    message_budget = remaining - session_reserve - estimate_tokens(unread_heading)
+    kept = []
+    overflow = []
+    for block in blocks:
+        text = _truncate(block[1], MESSAGE_MAX_TOKENS, "\n[... message truncated ...]\n\n")
+        # Leave room for the count line if later messages have to be summarized
+        reserve = 0 if block is blocks[-1] else 20
+        if not overflow and estimate_tokens(text) + reserve <= message_budget:
+            kept.append(text)
+            message_budget -= estimate_tokens(text)
+        else:
+            overflow.append(block)
+    unread_text = unread_heading + "".join(kept)
+    if overflow:
+        counts = {}
+        for rank, _, _ in overflow:
+            name = agent_mailbox.PRIORITY_ORDER[rank] if rank < len(agent_mailbox.PRIORITY_ORDER) else "other"
+            counts[name] = counts.get(name, 0) + 1
+        summary = f"### {len(overflow)} more unread messages ("
+        summary += ", ".join(f"{count} {name}" for name, count in counts.items()) + ")\n"
+        message_budget -= estimate_tokens(summary)
+        listed = 0
+        for _, _, line in overflow:
+            if estimate_tokens(line) + 8 > message_budget:
+                break
+            summary += line
+            message_budget -= estimate_tokens(line)
+            listed += 1
+        if listed < len(overflow):
+            summary += f"- ... and {len(overflow) - listed} more\n"
+        unread_text += summary
+    
+    # Session state gets what is left
+    remaining -= estimate_tokens(unread_text)
+    session_text = _truncate(session_text, max(0, remaining), "\n[... session state truncated ...]\n\n")
+    
+    prompt = header + session_text + state_text + relevant_text + unread_text
+    # Budgets too small for the headings are still honoured
+    return _truncate(prompt, max_tokens)
+
+def prompt_cache_path(agent_dir):
+    """Path of the cached state prompt sections"""
+    return os.path.join(agent_dir, "prompt_cache.json")
+
+def _file_key(path):
+    """Cache key of an input file: inode, size and mtime, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+def generate_state_prompt_cached(agent_name, max_tokens=None, query=None):
+    """
+    Generate the state prompt, reusing sections whose inputs are unchanged
+    
+    Sections are cached in prompt_cache.json, keyed on the inode, size and
+    mtime of session_state.md, state.json and state.journal. Unread messages are cached
+    as formatted blocks; when messages were only appended since the last
+    call, just the new ones are read and formatted.
+    
+    Args:
+        agent_name: Name of the agent
+        max_tokens: Optional token budget the prompt must fit in
+        query: Optional search query (see generate_state_prompt); search
+            results are not cached
         
-        # Add any other state information
-        for key, value in state.items():
-            if key not in ["last_updated", "current_project", "emotional_state", "active_tasks"]:
-                prompt += f"- {key}: {value}\n"
-    else:
-        prompt += "## Current State\n"
-        prompt += "- No previous state information available\n"
-    
-    # Add unread messages
-    if unread:
-        prompt += "\n## Unread Messages\n"
-        for msg in unread:
-            sender = msg.get("from", "Unknown")
-            timestamp = datetime.fromtimestamp(msg.get("timestamp", 0)).strftime("%Y-%m-%d %H:%M:%S")
-            subject = msg.get("subject", "No subject")
-            message_type = msg.get("type", "general")
-            content = msg.get("content", "")
-            
-            prompt += f"### Message from {sender} at {timestamp}\n"
-            prompt += f"**Subject:** {subject}\n"
-            prompt += f"**Type:** {message_type}\n"
-            prompt += f"**Content:**\n{content}\n\n"
+    Returns:
+        Tuple of (prompt, dictionary of section name to "hit", "miss" or
+        "updated")
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    if not _agent_dir_exists(agent_dir):
+        print(f"Error: Agent '{agent_name}' does not exist")
+        return "", {}
     
-    return prompt
+    cache_path = prompt_cache_path(agent_dir)
+    try:
+        with agent_metrics.phase("json_parse"), open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache.get("version") != PROMPT_CACHE_VERSION or not isinstance(cache.get("sections"), dict):
+            raise ValueError("outdated cache")
+    except (OSError, ValueError):
+        cache = {"version": PROMPT_CACHE_VERSION, "sections": {}, "totals": {}}
+    sections = cache["sections"]
+    results = {}
+    
+    # Sections derived from files
+    builders = {
+        "session_state": (["session_state.md"], lambda: _session_state_section(agent_dir)),
+        "state": ([agent_journal.STATE_NAME, agent_journal.JOURNAL_NAME],
+                  lambda: _state_section(load_agent_state(agent_name))),
+    }
+    for name, (filenames, build) in builders.items():
+        key = [_file_key(os.path.join(agent_dir, filename)) for filename in filenames]
+        cached = sections.get(name)
+        if cached and cached.get("key") == key:
+            results[name] = "hit"
+        else:
+            sections[name] = {"key": key, "text": build()}
+            results[name] = "miss"
+    
+    results["unread"] = _refresh_unread_section(agent_dir, sections)
+    
+    unread_blocks = sections["unread"]["blocks"]
+    prompt = _assemble_prompt(agent_name, sections["session_state"]["text"], sections["state"]["text"],
+                              unread_blocks, max_tokens, _relevant_section(agent_name, query))
+    
+    if any(result != "hit" for result in results.values()):
+        totals = cache.setdefault("totals", {})
+        for result in results.values():
+            totals[result] = totals.get(result, 0) + 1
+        with agent_metrics.phase("file_write"):
+            agent_mailbox.atomic_write(cache_path, json.dumps(cache).encode("utf-8"))
+    
+    for result in ("hit", "miss", "updated"):
+        agent_metrics.add_size(f"cache_{result}", sum(1 for r in results.values() if r == result))
+    agent_metrics.add_size("messages", len(unread_blocks))
+    agent_metrics.add_size("prompt_bytes", len(prompt))
+    return prompt, results
+
+def _refresh_unread_section(agent_dir, sections):
+    """
+    Bring the cached unread message blocks up to date
+    
+    Returns:
+        "hit", "updated" (only new messages were read) or "miss"
+    """
+    signature = mailbox.mailbox_signature(agent_dir, "inbox")
+    cached = sections.get("unread")
+    now = time.time()
+    
+    reusable = (cached and cached.get("signature") == signature
+                and (cached.get("valid_until") is None or now < cached["valid_until"]))
+    try:
+        with agent_metrics.phase("json_parse"):
+            if reusable:
+                new, end = mailbox.read_unread(agent_dir, "inbox", cached["end"])
+                blocks = cached["blocks"]
+            else:
+                new, end = mailbox.read_unread(agent_dir, "inbox")
+                blocks = []
+    except Exception as e:
+        print(f"Error getting unread messages: {e}")
+        new, end, blocks = [], None, []
+    
+    if reusable and not new:
+        return "hit"
+    
+    # New blocks go after cached ones of the same priority, as in sort_by_priority
+    blocks = blocks + [_message_block(m) for m in new]
+    blocks.sort(key=lambda block: block[0])
+    
+    expiries = [m["expires_at"] for m in new if m.get("expires_at") is not None]
+    if reusable and cached.get("valid_until") is not None:
+        expiries.append(cached["valid_until"])
+    sections["unread"] = {
+        "signature": signature,
+        # Legacy mailboxes have no offsets, so they are always read in full
+        "end": end,
+        "valid_until": min(expiries) if expiries else None,
+        "blocks": blocks,
+    }
+    if end is None:
+        sections["unread"]["signature"] = None
+    return "updated" if reusable else "miss"
 
 def main():
+    timings = "--timings" in sys.argv
+    if timings:
+        sys.argv.remove("--timings")
+    
     if len(sys.argv) < 2:
         print("Usage: python agent_state.py <command> [agent_name] [args]")
         print("Commands:")
-        print("  generate-prompt <agent_name> - Generate state prompt for agent")
+        print("  generate-prompt <agent_name> [--cached] [--max-tokens N] - Generate state prompt for agent")
+        print("      --cached reuses unchanged sections from prompt_cache.json")
+        print("      --max-tokens fits the prompt in an estimated N tokens")
+        print("      [--relevant QUERY] adds the best search matches for QUERY")
+        print("  generate-prompt --all | --agents a,b,c [--output-dir DIR] [--workers N] [options]")
+        print("      Generate prompts for many agents in parallel, as JSON lines on stdout")
+        print("      or as DIR/<agent>.md; per-agent timings go to stderr")
+        print("  search <agent_name> <query> [--limit N] [--in kinds] [--json] - Search memory,")
+        print("      procedures, session log and messages (kinds: memory,procedures,session_log,inbox,outbox)")
         print("  save-state <agent_name> - Save agent state")
-        print("  mark-read <agent_name> - Mark all messages as read")
+        print("  show-state <agent_name> [--at TIME] - Print the state, as of TIME if given")
+        print("  state-history <agent_name> - List saved state versions, newest first")
+        print("  update-memory <agent_name> - Update memory.md from JSON on stdin:")
+        print('      {"add": {section: entries}, "remove": {section: entries}, "move": [[entry, from, to]]}')
+        print("  mark-read <agent_name> [--ids a,b,c | --until TIME] - Mark all messages as read,")
+        print("      or only the messages with these ids, or with timestamps up to TIME")
+        print("  pop-next <agent_name> [n] - Take the n highest-priority unread messages")
+        print("Options:")
+        print("  --timings - Print where the command spent its time (to stderr)")
         return
     
     command = sys.argv[1]
     
+    agent_metrics.begin("agent_state", command, timings)
+    try:
+        run_command(command)
+    finally:
+        agent_metrics.finish()
+
+def _option(name, convert=str):
+    """
+    Value following an option on the command line
+    
+    Returns:
+        The converted value, or None if the option is not given
+        
+    Raises:
+        ValueError: If the value is missing or cannot be converted
+    """
+    if name not in sys.argv[3:]:
+        return None
+    index = sys.argv.index(name, 3)
+    if index + 1 >= len(sys.argv):
+        raise ValueError(f"{name} requires a value")
+    try:
+        return convert(sys.argv[index + 1])
+    except ValueError:
+        raise ValueError(f"Invalid value for {name}: {sys.argv[index + 1]}")
+
+def _parse_time(value):
+    """Parse epoch seconds or an ISO date/time"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def run_command(command):
+    """Run the command given on the command line"""
     if command == "generate-prompt":
         if len(sys.argv) < 3:
             print("Error: Agent name required")
             return
+        if sys.argv[2] in ("--all", "--agents"):
+            _generate_prompts_command()
+            return
+        agent_name = sys.argv[2]
+        try:
+            max_tokens = _option("--max-tokens", int)
+            query = _option("--relevant")
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if "--cached" in sys.argv[3:]:
+            prompt, results = generate_state_prompt_cached(agent_name, max_tokens, query)
+            print(prompt)
+            summary = ", ".join(f"{name} {result}" for name, result in results.items())
+            print(f"Prompt cache: {summary}", file=sys.stderr)
+        else:
+            prompt = generate_state_prompt(agent_name, max_tokens, query)
+            print(prompt)
+    
+    elif command == "search":
+        if len(sys.argv) < 4:
+            print("Error: Agent name and query required")
+            return
         agent_name = sys.argv[2]
-        prompt = generate_state_prompt(agent_name)
-        print(prompt)
+        try:
+            limit = _option("--limit", int) or 10
+            kinds = _option("--in")
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        results = search_agent(agent_name, sys.argv[3], limit, kinds.split(",") if kinds else None)
+        if "--json" in sys.argv[4:]:
+            for result in results:
+                print(json.dumps(result))
+        elif not results:
+            print(f"No matches for '{sys.argv[3]}'")
+        else:
+            for result in results:
+                when = f" ({result['timestamp']})" if result["timestamp"] else ""
+                print(f"[{result['kind']}] {result['title']}{when}")
+                print(f"    {' '.join(result['snippet'].split())}")
     
     elif command == "save-state":
         if len(sys.argv) < 3:
@@ -353,19 +827,142 @@ def main():
         except json.JSONDecodeError:
             print("Error: Invalid JSON state data")
     
+    elif command == "show-state":
+        if len(sys.argv) < 3:
+            print("Error: Agent name required")
+            return
+        agent_name = sys.argv[2]
+        try:
+            at = _option("--at", _parse_time)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        state = load_agent_state(agent_name, at)
+        if state:
+            print(json.dumps(state, indent=2))
+    
+    elif command == "state-history":
+        if len(sys.argv) < 3:
+            print("Error: Agent name required")
+            return
+        agent_dir = os.path.join(AGENTS_DIR, sys.argv[2])
+        if not _agent_dir_exists(agent_dir):
+            print(f"Error: Agent '{sys.argv[2]}' does not exist")
+            return
+        for timestamp, kind, paths in agent_journal.iter_versions(agent_dir):
+            timestamp = timestamp or 0
+            when = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            changed = f" {', '.join(paths)}" if paths else ""
+            print(f"{when} ({timestamp:.3f}) {kind}{changed}")
+    
+    elif command == "update-memory":
+        if len(sys.argv) < 3:
+            print("Error: Agent name required")
+            return
+        agent_name = sys.argv[2]
+        
+        # Get the changes from stdin
+        try:
+            changes = json.loads(sys.stdin.read())
+            success = update_memory(agent_name, changes.get("add", {}),
+                                    changes.get("remove"), changes.get("move"))
+            if success:
+                print(f"Memory updated for {agent_name}")
+            else:
+                print(f"Failed to update memory for {agent_name}")
+        except (json.JSONDecodeError, AttributeError, ValueError):
+            print("Error: Invalid JSON memory changes")
+    
     elif command == "mark-read":
         if len(sys.argv) < 3:
             print("Error: Agent name required")
             return
         agent_name = sys.argv[2]
-        success = mark_messages_read(agent_name)
-        if success:
-            print(f"Marked all messages as read for {agent_name}")
-        else:
+        try:
+            ids = _option("--ids")
+            until = _option("--until", _parse_time)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if ids is not None and until is not None:
+            print("Error: Use either --ids or --until")
+            return
+        if ids is not None:
+            message_ids = [i for i in ids.split(",") if i]
+            acknowledged = mark_read_by_id(agent_name, message_ids)
+            print(f"Marked {len(acknowledged)} of {len(message_ids)} messages as read for {agent_name}")
+            return
+        success = mark_messages_read(agent_name, until)
+        if not success:
             print(f"Failed to mark messages as read for {agent_name}")
+        elif until is not None:
+            when = datetime.fromtimestamp(until).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"Marked messages up to {when} as read for {agent_name}")
+        else:
+            print(f"Marked all messages as read for {agent_name}")
+    
+    elif command == "pop-next":
+        if len(sys.argv) < 3:
+            print("Error: Agent name required")
+            return
+        agent_name = sys.argv[2]
+        try:
+            n = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        except ValueError:
+            n = 0
+        if n < 1:
+            print(f"Error: Invalid number of messages: {sys.argv[3]}")
+            return
+        for msg in pop_next(agent_name, n):
+            print(json.dumps(msg))
     
     else:
         print(f"Unknown command: {command}")
 
+def _generate_prompts_command():
+    """Run generate-prompt --all / --agents"""
+    if sys.argv[2] == "--all":
+        agent_names = agent_registry.list_agents(AGENTS_DIR)
+    elif len(sys.argv) > 3:
+        agent_names = [name for name in sys.argv[3].split(",") if name]
+    else:
+        print("Error: --agents requires a comma-separated list of agents")
+        return
+    try:
+        max_tokens = _option("--max-tokens", int)
+        query = _option("--relevant")
+        output_dir = _option("--output-dir")
+        workers = _option("--workers", int) or 16
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if workers < 1:
+        print(f"Error: Invalid value for --workers: {workers}")
+        return
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    # Warnings printed while generating must not end up in the JSON lines
+    out = sys.stdout
+    failed = 0
+    start = time.perf_counter()
+    with redirect_stdout(sys.stderr):
+        for agent_name, prompt, seconds in generate_prompts(
+                agent_names, max_tokens, query, "--cached" in sys.argv[3:], workers):
+            if prompt is None:
+                failed += 1
+                print(f"{agent_name}: error: agent does not exist", file=sys.stderr)
+                if not output_dir:
+                    out.write(json.dumps({"agent": agent_name, "error": "Agent does not exist"}) + "\n")
+                continue
+            print(f"{agent_name}: {seconds * 1000:.3f} ms, {len(prompt)} bytes", file=sys.stderr)
+            if output_dir:
+                agent_mailbox.atomic_write(os.path.join(output_dir, f"{agent_name}.md"), prompt.encode("utf-8"))
+            else:
+                out.write(json.dumps({"agent": agent_name, "prompt": prompt, "ms": round(seconds * 1000, 3)}) + "\n")
+    agent_metrics.add_size("agents", len(agent_names))
+    print(f"Generated {len(agent_names) - failed} prompts in {time.perf_counter() - start:.3f} s"
+          + (f" ({failed} failed)" if failed else ""), file=sys.stderr)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Directory Change Notifications for AI Agents
+
+This module lets callers block until something in an agent directory changes:
+- On Linux it uses inotify through ctypes, so waiting costs no CPU and wakes
+  up as soon as a file is written, created or renamed into place
+- Elsewhere it falls back to polling file mtimes and sizes, backing off from
+  POLL_MIN_INTERVAL to POLL_MAX_INTERVAL while nothing changes
+"""
+
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+POLL_MIN_INTERVAL = 0.01
+POLL_MAX_INTERVAL = 0.25
+
+def _load_libc():
+    """Load libc if it provides inotify, otherwise return None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+class DirectoryWatcher:
+    """
+    Wait for changes to files in a directory
+
+    Create the watcher before checking the state you are waiting on, so that
+    a change landing between the check and wait() is not missed.
+
+    Args:
+        directory: Directory to watch
+        paths: Files whose mtime and size are compared when polling
+    """
+
+    def __init__(self, directory, paths):
+        self.directory = directory
+        self.paths = paths
+        self.fd = None
+        self.interval = POLL_MIN_INTERVAL
+        if _libc is not None:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+                if _libc.inotify_add_watch(fd, os.fsencode(directory), mask) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+        self.snapshot = self._stat()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release the inotify descriptor"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wait(self, timeout=None):
+        """
+        Block until a change is seen or the timeout expires
+
+        Args:
+            timeout: Maximum number of seconds to wait, or None to wait forever
+
+        Returns:
+            True if a change was seen, False on timeout
+        """
+        if self.fd is not None:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return False
+            # Drain the queued events; callers re-check the state themselves
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._stat()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                self.interval = POLL_MIN_INTERVAL
+                return True
+            delay = self.interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            self.interval = min(self.interval * 2, POLL_MAX_INTERVAL)
+
+    def _stat(self):
+        """Snapshot the mtime and size of the polled files"""
+        snapshot = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                snapshot.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except OSError:
+                snapshot.append(None)
+        return snapshot
@@ -30,8 +30,8 @@ check_file_exists "$AGENT_DIR/session_state.md" "Session state file exists" || T
 check_file_exists "$AGENT_DIR/session_log.md" "Session log file exists" || TEST_FAILED=1
 
 # Check message files
-check_file_exists "$AGENT_DIR/inbox.json" "Inbox file exists" || TEST_FAILED=1
-check_file_exists "$AGENT_DIR/outbox.json" "Outbox file exists" || TEST_FAILED=1
+check_file_exists "$AGENT_DIR/inbox.jsonl" "Inbox file exists" || TEST_FAILED=1
+check_file_exists "$AGENT_DIR/outbox.jsonl" "Outbox file exists" || TEST_FAILED=1
 
 # Check rules directory
 check_dir_exists "$AGENT_DIR/rules" "Rules directory exists" || TEST_FAILED=1
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Coordinator Benchmark Suite
+
+This script measures how coordinator.py and agent_state.py operations scale:
+- A synthetic agent tree is generated in a temporary AGENTS_DIR at the
+  requested scale (agents x messages per mailbox x session log size)
+- Each operation is run against randomly chosen agents and timed
+- Throughput and p50/p95/p99 latencies are reported as JSON, so runs
+  with different storage backends or commits can be compared
+
+Usage:
+    python benchmarks/bench_coordinator.py --agents 100 --messages 1000 --log-kb 256
+    python benchmarks/bench_coordinator.py --backend sqlite --output sqlite.json
+    python benchmarks/bench_coordinator.py --baseline sqlite.json --max-slowdown 1.5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agent_durable
+import agent_log
+import agent_mailbox
+import agent_state
+import coordinator
+from agent_metrics import percentile
+
+# Messages written per append while generating mailboxes
+GENERATE_BATCH_SIZE = 1000
+
+def summarize(samples):
+    """
+    Summarize the latencies of one operation
+
+    Args:
+        samples: Latencies in seconds
+
+    Returns:
+        Dictionary with the operation count, throughput and latency
+        percentiles in milliseconds
+    """
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "total_s": round(total, 6),
+        "ops_per_s": round(len(samples) / total, 2) if total else None,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 4),
+        "max_ms": round(samples[-1] * 1000, 4),
+    }
+
+def use_agents_dir(agents_dir, backend):
+    """Point the coordinator and agent_state modules at a synthetic tree"""
+    mailbox = agent_mailbox.load_backend(backend)
+    for module in (coordinator, agent_state):
+        module.AGENTS_DIR = agents_dir
+        module.mailbox = mailbox
+
+def generate_tree(agents_dir, agents, messages, log_kb, seed):
+    """
+    Create synthetic agents with filled mailboxes and session logs
+
+    Args:
+        agents_dir: Path of the (empty) agents directory
+        agents: Number of agents
+        messages: Messages per inbox and per outbox, half of them read
+        log_kb: Approximate session log size per agent in KiB
+        seed: Random seed for message contents
+
+    Returns:
+        List of agent names
+    """
+    rng = random.Random(seed)
+    width = len(str(agents))
+    names = [f"bench-{i:0{width}d}" for i in range(1, agents + 1)]
+    coordinator.create_agents(names)
+
+    now = int(time.time())
+    for name in names:
+        agent_dir = os.path.join(agents_dir, name)
+        for box in agent_mailbox.MAILBOXES:
+            for start in range(0, messages, GENERATE_BATCH_SIZE):
+                batch = [{
+                    "from": "user" if box == "inbox" else name,
+                    "timestamp": now - messages + i,
+                    "content": f"Synthetic message {i} " + "x" * rng.randint(20, 400),
+                    "subject": f"Subject {i}",
+                    "type": rng.choice(agent_mailbox.PRIORITY_ORDER),
+                    "read": False
+                } for i in range(start, min(messages, start + GENERATE_BATCH_SIZE))]
+                coordinator.mailbox.append_messages(agent_dir, box, batch)
+            # The older half has been read already
+            if messages:
+                unread = list(coordinator.mailbox.iter_unread(agent_dir, box))
+                coordinator.mailbox.mark_read_until(agent_dir, box, unread[messages // 2][0])
+
+        entry = agent_log.format_entry("Input", "y" * 200)
+        count = log_kb * 1024 // len(entry)
+        if count:
+            agent_log.append_entries(agent_dir, name, [("Input", "y" * 200)] * count)
+
+        with open(os.path.join(agent_dir, "state.json"), 'w') as f:
+            json.dump({"last_updated": now, "current_project": "benchmark"}, f)
+    return names
+
+def operations(names, rng):
+    """
+    Operations to benchmark
+
+    Returns:
+        Dictionary of operation name to a callable taking no arguments
+    """
+    pick = lambda: rng.choice(names)
+    return {
+        "send_message": lambda: coordinator.send_message(pick(), "Benchmark message", subject="Bench"),
+        "send_messages_x10": lambda: coordinator.send_messages(
+            pick(), [{"content": f"Batch message {i}"} for i in range(10)]),
+        "respond_to_message": lambda: coordinator.respond_to_message(pick(), "Benchmark response"),
+        "get_responses_keep_unread": lambda: coordinator.get_responses(pick(), mark_as_read=False),
+        "get_responses_latest_10": lambda: list(coordinator.iter_responses(
+            pick(), mark_as_read=False, limit=10, latest=True)),
+        "log_message": lambda: coordinator.log_message(pick(), "Input", "Benchmark log entry"),
+        "list_agents": coordinator.list_agents,
+        "agent_stats": coordinator.agent_stats,
+        "get_unread_messages": lambda: agent_state.get_unread_messages(pick()),
+        "save_agent_state": lambda: agent_state.save_agent_state(
+            pick(), {"last_updated": time.time(), "current_project": "benchmark", "step": rng.random()}),
+        "update_memory": lambda: agent_state.update_memory(pick(), {"Benchmark Notes": "Benchmark memory entry"}),
+        # One new message per run, so that every run has something to mark read
+        "mark_messages_read": lambda: mark_messages_read(pick()),
+        "add_response": lambda: agent_state.add_response(pick(), "Benchmark response"),
+        "pop_next_peek": lambda: coordinator.mailbox.pop_next(
+            os.path.join(coordinator.AGENTS_DIR, pick()), "inbox", 10, peek=True),
+        "generate_state_prompt": lambda: agent_state.generate_state_prompt(pick()),
+        "generate_state_prompt_cached": lambda: agent_state.generate_state_prompt_cached(pick()),
+        "generate_prompts_all": lambda: list(agent_state.generate_prompts(names, cached=True)),
+        "search_agent": lambda: agent_state.search_agent(pick(), "synthetic subject"),
+    }
+
+def mark_messages_read(name):
+    """Send one message to an agent, then mark its whole inbox read"""
+    coordinator.send_message(name, "Benchmark message to mark read")
+    agent_state.mark_messages_read(name)
+
+def run_benchmarks(names, iterations, selected, seed):
+    """
+    Time every selected operation
+
+    Args:
+        names: Agent names to run operations against
+        iterations: Runs per operation
+        selected: Operation names to run, or None for all
+        seed: Random seed for choosing agents
+
+    Returns:
+        Dictionary of operation name to summary
+    """
+    rng = random.Random(seed)
+    results = {}
+    for name, operation in operations(names, rng).items():
+        if selected and name not in selected:
+            continue
+        samples = []
+        # Some operations print errors; keep the JSON report clean
+        with contextlib.redirect_stdout(sys.stderr):
+            operation()  # Warm caches so the first sample is not an outlier
+            for _ in range(iterations):
+                start = time.perf_counter()
+                operation()
+                samples.append(time.perf_counter() - start)
+        results[name] = summarize(samples)
+    return results
+
+def compare(report, baseline, max_slowdown):
+    """
+    Compare p95 latencies with an earlier report
+
+    Args:
+        report: Report of this run
+        baseline: Report to compare with
+        max_slowdown: p95 ratio above which an operation counts as a regression
+
+    Returns:
+        Dictionary of operation name to {"baseline_p95_ms", "p95_ms",
+        "ratio", "regression"} for operations present in both reports
+    """
+    comparison = {}
+    for name, summary in report["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if not previous or not previous.get("p95_ms"):
+            continue
+        ratio = summary["p95_ms"] / previous["p95_ms"]
+        comparison[name] = {
+            "baseline_p95_ms": previous["p95_ms"],
+            "p95_ms": summary["p95_ms"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > max_slowdown,
+        }
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark coordinator and agent_state operations")
+    parser.add_argument("--agents", type=int, default=50, help="Number of synthetic agents")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages per inbox and outbox")
+    parser.add_argument("--log-kb", type=int, default=128, help="Session log size per agent in KiB")
+    parser.add_argument("--iterations", type=int, default=200, help="Runs per operation")
+    parser.add_argument("--backend", choices=["jsonl", "sqlite"], default="jsonl", help="Mailbox backend")
+    parser.add_argument("--durability", choices=agent_durable.DURABILITY_MODES, default="group",
+                        help="When writes reach the disk")
+    parser.add_argument("--operations", help="Comma-separated operations to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated agents directory")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare p95 latencies with")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="With --baseline, exit with status 1 if a p95 grows by more than this factor")
+    args = parser.parse_args()
+
+    os.environ[agent_durable.DURABILITY_ENV] = args.durability
+    agents_dir = tempfile.mkdtemp(prefix="bench-agents-")
+    try:
+        use_agents_dir(agents_dir, args.backend)
+
+        start = time.perf_counter()
+        names = generate_tree(agents_dir, args.agents, args.messages, args.log_kb, args.seed)
+        setup_s = time.perf_counter() - start
+
+        selected = set(args.operations.split(",")) if args.operations else None
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "durability": args.durability,
+            "scale": {"agents": args.agents, "messages": args.messages, "log_kb": args.log_kb},
+            "iterations": args.iterations,
+            "setup_s": round(setup_s, 3),
+            "operations": run_benchmarks(names, args.iterations, selected, args.seed),
+        }
+    finally:
+        if args.keep:
+            print(f"Agents directory kept at {agents_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(agents_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report["comparison"] = compare(report, json.load(f), args.max_slowdown)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if any(c["regression"] for c in report.get("comparison", {}).values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -7,16 +7,37 @@ by managing message passing through inbox/outbox files.
 """
 
 import os
+import re
 import json
 import time
 import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import agent_metrics
+import agent_daemon
+import agent_durable
+import agent_log
+import agent_mailbox
+import agent_registry
+
+agent_metrics.imported()
+
 # Base directory for agent files
 AGENTS_DIR = os.path.expanduser("~/_projects/ai-agents/agents")
 
-def send_message(agent_name, message, from_user="user", subject=None, message_type=None):
+# Mailbox storage, chosen with $AGENT_MAILBOX_BACKEND ("jsonl" or "sqlite")
+mailbox = agent_mailbox.load_backend()
+
+def _agent_exists(agent_name):
+    """Check the registry for an agent (timed as path resolution)"""
+    with agent_metrics.phase("path_resolution"):
+        return agent_registry.agent_exists(AGENTS_DIR, agent_name)
+
+def send_message(agent_name, message, from_user="user", subject=None, message_type=None,
+                 ttl=None, idempotency_key=None, dedupe=False):
     """
     Send a message to an agent's inbox
     
@@ -26,162 +47,392 @@ def send_message(agent_name, message, from_user="user", subject=None, message_ty
         from_user: Identifier of the sender
         subject: Subject line for the message
         message_type: Type of message (task, question, feedback)
+        ttl: Seconds after which the message expires unread
+        idempotency_key: Key under which the message is only sent once
+        dedupe: Skip the message if the same sender, subject and content
+            were already sent
+        
+    Returns:
+        Status message
+    """
+    result = send_messages(agent_name, [{
+        "content": message,
+        "from": from_user,
+        "subject": subject,
+        "type": message_type,
+        "ttl": ttl,
+        "idempotency_key": idempotency_key
+    }], dedupe)
+    if result.startswith("Error"):
+        return result
+    if result.startswith("0 "):
+        return f"Duplicate message not sent to {agent_name}"
+    
+    return f"Message sent to {agent_name}"
+
+def send_messages(agent_name, messages, dedupe=False):
+    """
+    Send several messages to an agent's inbox with a single append
+    
+    Args:
+        agent_name: Name of the agent (directory name)
+        messages: List of dictionaries with "content" and optional
+            "from", "subject", "type", "ttl" and "idempotency_key" keys
+        dedupe: Skip messages whose sender, subject and content were
+            already sent
         
     Returns:
         Status message
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    inbox_path = os.path.join(agent_dir, "inbox.json")
     
     # Ensure agent directory exists
-    if not os.path.exists(agent_dir):
+    if not _agent_exists(agent_name):
         return f"Error: Agent '{agent_name}' does not exist"
     
-    # Create or update inbox
-    if os.path.exists(inbox_path):
-        with open(inbox_path, 'r') as f:
-            try:
-                inbox = json.load(f)
-            except json.JSONDecodeError:
-                inbox = {"messages": []}
-    else:
-        inbox = {"messages": []}
+    timestamp = int(time.time())
+    records = []
+    for m in messages:
+        record = {
+            "from": m.get("from") or "user",
+            "timestamp": timestamp,
+            "content": m.get("content", ""),
+            "subject": m.get("subject") or "No subject",
+            "type": m.get("type") or "general",
+            "read": False
+        }
+        if m.get("ttl"):
+            record["expires_at"] = timestamp + int(m["ttl"])
+        if m.get("idempotency_key"):
+            record["key"] = agent_mailbox.idempotency_key(m["idempotency_key"])
+        elif dedupe:
+            record["key"] = agent_mailbox.message_key(record)
+        records.append(record)
     
-    # Add new message
-    inbox["messages"].append({
-        "from": from_user,
-        "timestamp": int(time.time()),
-        "content": message,
-        "subject": subject or "No subject",
-        "type": message_type or "general",
-        "read": False
-    })
+    # Append new messages
+    try:
+        with agent_metrics.phase("file_write"):
+            sent = mailbox.append_messages(agent_dir, "inbox", records)
+    except json.JSONDecodeError:
+        return f"Error: inbox.json for '{agent_name}' is corrupt; fix it and run migrate"
     
-    # Save updated inbox
-    with open(inbox_path, 'w') as f:
-        json.dump(inbox, f, indent=2)
+    agent_metrics.add_size("messages", len(sent))
+    agent_metrics.add_size("content_bytes", sum(len(r["content"]) for r in sent))
     
-    # Log the message in the session log
-    log_message(agent_name, "Input", message)
+    # Log the messages in the session log
+    if sent:
+        log_messages(agent_name, [("Input", r["content"]) for r in sent])
     
-    return f"Message sent to {agent_name}"
+    result = f"{len(sent)} messages sent to {agent_name}"
+    if len(sent) < len(records):
+        result += f" ({len(records) - len(sent)} duplicates skipped)"
+    return result
+
+def load_batch(batch_path):
+    """
+    Load messages for send_messages from a JSONL file
+    
+    Each line is either a JSON object with "content" and optional
+    "subject", "type" and "from" keys, or a bare JSON string.
+    
+    Args:
+        batch_path: Path of the JSONL file
+        
+    Returns:
+        List of message dictionaries
+        
+    Raises:
+        ValueError: If a line is not valid JSON, or is neither an object
+            nor a string
+    """
+    messages = []
+    with open(batch_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {line_number}: {e}")
+            if isinstance(message, str):
+                message = {"content": message}
+            elif not isinstance(message, dict):
+                raise ValueError(f"line {line_number}: expected a JSON object or string")
+            messages.append(message)
+    return messages
+
+def broadcast_message(message, agent_names=None, from_user="user", subject=None,
+                      message_type=None, max_workers=8, ttl=None):
+    """
+    Send the same message to many agents in parallel
+    
+    Args:
+        message: Content of the message
+        agent_names: Names of the agents, or None for every agent
+        from_user: Identifier of the sender
+        subject: Subject line for the message
+        message_type: Type of message (task, question, feedback)
+        max_workers: Number of threads used to deliver the message
+        ttl: Seconds after which the message expires unread
+        
+    Returns:
+        Dictionary of agent name to status message, or status message
+    """
+    if agent_names is None:
+        agent_names = list_agents()
+        if not isinstance(agent_names, list):
+            return agent_names
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda agent: send_message(agent, message, from_user, subject, message_type, ttl),
+            agent_names)
+        return dict(zip(agent_names, results))
 
-def get_responses(agent_name, mark_as_read=True):
+def get_responses(agent_name, mark_as_read=True, cache=None, priority=False):
     """
     Check if agent has responded
     
     Args:
         agent_name: Name of the agent
         mark_as_read: Whether to mark messages as read
+        cache: Optional agent_daemon.MailboxCache to read the outbox from
+        priority: Return responses by type priority instead of arrival order
         
     Returns:
         List of unread messages or status message
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    outbox_path = os.path.join(agent_dir, "outbox.json")
     
-    if not os.path.exists(agent_dir):
+    if not _agent_exists(agent_name):
         return f"Error: Agent '{agent_name}' does not exist"
     
-    if not os.path.exists(outbox_path):
+    if not mailbox.mailbox_exists(agent_dir, "outbox"):
         return "No responses yet"
     
-    with open(outbox_path, 'r') as f:
-        try:
-            outbox = json.load(f)
-        except json.JSONDecodeError:
-            return "Error reading outbox"
+    if priority:
+        with agent_metrics.phase("json_parse"):
+            unread = mailbox.pop_next(agent_dir, "outbox", sys.maxsize, peek=not mark_as_read)
+        agent_metrics.add_size("messages", len(unread))
+        return format_responses(unread) if unread else "No unread responses"
     
-    # Get unread messages
-    unread = [m for m in outbox.get("messages", []) if not m.get("read", False)]
+    # Get unread messages past the read cursor
+    reader = cache.read_unread if cache else mailbox.read_unread
+    try:
+        with agent_metrics.phase("json_parse"):
+            unread, read_offset = reader(agent_dir, "outbox")
+    except json.JSONDecodeError:
+        return "Error reading outbox"
+    agent_metrics.add_size("messages", len(unread))
     
-    # Mark as read if requested
+    # Mark as read if requested by advancing the cursor
     if mark_as_read and unread:
-        for m in outbox["messages"]:
-            if not m.get("read", False):
-                m["read"] = True
-        
-        with open(outbox_path, 'w') as f:
-            json.dump(outbox, f, indent=2)
+        with agent_metrics.phase("file_write"):
+            mailbox.mark_read_until(agent_dir, "outbox", read_offset)
     
     if not unread:
         return "No unread responses"
     
-    # Format the responses
+    return format_responses(unread)
+
+def iter_responses(agent_name, mark_as_read=True, limit=None, since=None, sender=None, latest=False):
+    """
+    Stream an agent's unread responses without loading the whole outbox
+    
+    Responses are read lazily and reading stops after limit responses.
+    The responses that were yielded are marked as read once the stream
+    ends or is closed.
+    
+    Args:
+        agent_name: Name of the agent
+        mark_as_read: Whether to mark the yielded responses as read
+        limit: Maximum number of responses, or None for all
+        since: Only responses at or after this epoch time
+        sender: Only responses whose "from" matches
+        latest: Take the newest responses first instead of the oldest
+        
+    Returns:
+        Generator of outbox message dictionaries, or status message
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist"
+    
+    if not mailbox.mailbox_exists(agent_dir, "outbox"):
+        return "No responses yet"
+    
+    return _stream_responses(agent_dir, mark_as_read, limit, since, sender, latest)
+
+def _stream_responses(agent_dir, mark_as_read, limit, since, sender, latest):
+    """Generator behind iter_responses"""
+    messages = mailbox.iter_unread(agent_dir, "outbox", since=since, sender=sender, reverse=latest)
+    taken = []
+    try:
+        while limit is None or len(taken) < limit:
+            with agent_metrics.phase("json_parse"):
+                item = next(messages, None)
+            if item is None:
+                break
+            start, end, message = item
+            taken.append((start, end))
+            yield message
+    finally:
+        messages.close()
+        agent_metrics.add_size("messages", len(taken))
+        if mark_as_read and taken:
+            with agent_metrics.phase("file_write"):
+                if since is None and sender is None and not latest:
+                    # Everything before the last response was read in order
+                    mailbox.mark_read_until(agent_dir, "outbox", taken[-1][1])
+                else:
+                    mailbox.ack_offsets(agent_dir, "outbox", [start for start, _ in taken])
+
+def parse_time(value):
+    """
+    Parse a --since value as epoch seconds or an ISO date/time
+    
+    Args:
+        value: Epoch seconds, or YYYY-MM-DD[THH:MM[:SS]]
+        
+    Returns:
+        Epoch seconds
+    
+    Raises:
+        ValueError: If the value is neither
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def format_responses(messages):
+    """
+    Format outbox messages for display
+    
+    Args:
+        messages: List of outbox messages
+        
+    Returns:
+        List of formatted responses
+    """
     formatted_responses = []
-    for msg in unread:
+    for msg in messages:
         timestamp = datetime.fromtimestamp(msg.get("timestamp", 0)).strftime("%Y-%m-%d %H:%M:%S")
         formatted_responses.append(f"[{timestamp}] {msg.get('content', '')}")
     
     return formatted_responses
 
-def log_message(agent_name, message_type, content):
+def wait_for_response(agent_name, timeout=None, mark_as_read=True, offset=None):
     """
-    Log a message in the agent's session log
+    Block until the agent has unread responses
+    
+    Waits on filesystem change notifications rather than re-reading the
+    outbox in a loop, so new responses are returned as soon as they land.
     
     Args:
         agent_name: Name of the agent
-        message_type: Type of message (Input/Response)
-        content: Message content
+        timeout: Maximum number of seconds to wait, or None to wait forever
+        mark_as_read: Whether to mark messages as read
+        offset: Outbox offset to continue from (see follow_responses)
+        
+    Returns:
+        Tuple of (list of formatted responses or status message, outbox offset)
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    log_path = os.path.join(agent_dir, "session_log.md")
     
-    today = datetime.now().strftime("%Y-%m-%d")
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist", offset
     
-    # Create or update log
-    if os.path.exists(log_path):
-        with open(log_path, 'r') as f:
-            log_content = f.read()
-    else:
-        log_content = f"# {agent_name.title()}'s Session Log\n\n"
+    try:
+        with agent_metrics.phase("wait"):
+            unread, read_offset = mailbox.wait_for_unread(agent_dir, "outbox", offset, timeout)
+    except json.JSONDecodeError:
+        return "Error reading outbox", offset
     
-    # Check if we already have a section for today
-    if f"## Session: {today}" in log_content:
-        # Append to today's section
-        log_content += f"\n### {message_type}\n```\n{content}\n```\n"
-    else:
-        # Create a new section for today
-        log_content += f"\n## Session: {today}\n\n### {message_type}\n```\n{content}\n```\n"
+    if not unread:
+        return f"No responses within {timeout} seconds", read_offset
+    agent_metrics.add_size("messages", len(unread))
     
-    # Save updated log
-    with open(log_path, 'w') as f:
-        f.write(log_content)
+    if mark_as_read:
+        with agent_metrics.phase("file_write"):
+            mailbox.mark_read_until(agent_dir, "outbox", read_offset)
+    
+    return format_responses(unread), read_offset
 
-def respond_to_message(agent_name, response):
+def follow_responses(agent_name, mark_as_read=True, timeout=None):
+    """
+    Yield responses from an agent as they arrive
+    
+    Args:
+        agent_name: Name of the agent
+        mark_as_read: Whether to mark messages as read
+        timeout: Stop after this many seconds without a new response
+        
+    Yields:
+        Formatted responses, or a final status message
+    """
+    offset = None
+    while True:
+        result, offset = wait_for_response(agent_name, timeout, mark_as_read, offset)
+        if not isinstance(result, list):
+            yield result
+            return
+        yield from result
+
+def log_message(agent_name, message_type, content):
+    """
+    Log a message in the agent's session log
+    
+    Args:
+        agent_name: Name of the agent
+        message_type: Type of message (Input/Response)
+        content: Message content
+    """
+    log_messages(agent_name, [(message_type, content)])
+
+def log_messages(agent_name, entries):
+    """
+    Log several messages in the agent's session log with a single append
+    
+    Args:
+        agent_name: Name of the agent
+        entries: List of (message type, content) tuples
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    with agent_metrics.phase("log_append"):
+        agent_log.append_entries(agent_dir, agent_name, entries)
+
+def respond_to_message(agent_name, response, message_type=None):
     """
     Add a response from the agent to their outbox
     
     Args:
         agent_name: Name of the agent
         response: Response content
+        message_type: Optional type of response (task, question, feedback)
         
     Returns:
         Status message
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
-    outbox_path = os.path.join(agent_dir, "outbox.json")
     
-    # Create or update outbox
-    if os.path.exists(outbox_path):
-        with open(outbox_path, 'r') as f:
-            try:
-                outbox = json.load(f)
-            except json.JSONDecodeError:
-                outbox = {"messages": []}
-    else:
-        outbox = {"messages": []}
-    
-    # Add new response
-    outbox["messages"].append({
-        "timestamp": int(time.time()),
-        "content": response,
-        "read": False
-    })
-    
-    # Save updated outbox
-    with open(outbox_path, 'w') as f:
-        json.dump(outbox, f, indent=2)
+    # Append new response
+    try:
+        record = {
+            "from": agent_name,
+            "timestamp": int(time.time()),
+            "content": response,
+            "read": False
+        }
+        if message_type:
+            record["type"] = message_type
+        with agent_metrics.phase("file_write"):
+            mailbox.append_message(agent_dir, "outbox", record)
+        agent_metrics.add_size("content_bytes", len(response))
+    except json.JSONDecodeError:
+        return f"Error: outbox.json for '{agent_name}' is corrupt; fix it and run migrate"
     
     # Log the response
     log_message(agent_name, "Response", response)
@@ -193,53 +444,353 @@ def list_agents():
     if not os.path.exists(AGENTS_DIR):
         return "No agents directory found"
     
-    agents = [d for d in os.listdir(AGENTS_DIR) 
-              if os.path.isdir(os.path.join(AGENTS_DIR, d))]
+    with agent_metrics.phase("path_resolution"):
+        agents = agent_registry.list_agents(AGENTS_DIR)
     
     if not agents:
         return "No agents found"
     
     return agents
 
-def create_agent(agent_name):
+def agent_stats():
     """
-    Create a new agent with basic structure
+    Get mailbox counts for all agents from the registry
+    
+    Returns:
+        Dictionary of agent name to creation time and inbox/outbox
+        message, unread and size counts, or status message
+    """
+    if not os.path.exists(AGENTS_DIR):
+        return "No agents directory found"
+    
+    with agent_metrics.phase("json_parse"):
+        counts = mailbox.agent_counts(AGENTS_DIR) if mailbox is not agent_mailbox else None
+        stats = agent_registry.agent_stats(AGENTS_DIR, counts)
+    
+    if not stats:
+        return "No agents found"
+    
+    return stats
+
+# Files every new agent starts with; {agent_name}, {agent_title} and {today}
+# are filled in per agent, other braces (e.g. {personality}) are kept as-is
+DEFAULT_TEMPLATE = {
+    "personality.md": "# {agent_title}\n\n## Core Identity\n- Add personality traits here\n\n## Knowledge & Expertise\n- Add areas of expertise here\n",
+    "memory.md": "# {agent_title}'s Memory Database\n\n## Project Knowledge\n- Initial memory entries go here\n",
+    "session_log.md": "# {agent_title}'s Session Log\n\n## Session: {today}\n\n",
+    "prompt_template.md": "# {agent_title} Agent Prompt Template\n\n## System Instructions\n\nYou are {agent_title}. Respond in character.\n\n## Character Definition\n\n{personality}\n\n## Current Memory State\n\n{memory}\n\n## Project Context\n\n{project_context}\n\n## Current Message\n\n{message}\n\n## Response Guidelines\n\n1. Always respond in character\n2. Provide technically sound advice\n\nNow, respond to the current message as {agent_title}.",
+}
+
+TEMPLATE_FIELDS = re.compile(r"(\{agent_name\}|\{agent_title\}|\{today\})")
+
+# Runtime files and directories that are never copied from a template agent,
+# matched by name at any depth
+TEMPLATE_SKIP = re.compile(r"^(inbox|outbox)\.|\.(lock|cursor|state|journal|sync|bak|tmp)$|^session_logs?(\.|$)|^mailbox_archive$|^prompt_cache\.json$|^search_index\.db|^(state\.json|session_state\.md|memory\.md)$")
+
+# Files every new agent starts with fresh from DEFAULT_TEMPLATE
+TEMPLATE_FRESH = ("memory.md", "session_log.md")
+
+def load_template(template_dir=None):
+    """
+    Load and pre-render the files for new agents
+    
+    Each file is split around its placeholders once, so creating an agent
+    only joins the pieces with that agent's values. Mailboxes, state,
+    memory and session log history of a template agent are not copied;
+    memory.md and session_log.md start fresh from DEFAULT_TEMPLATE.
+    
+    Args:
+        template_dir: Directory to copy files from (defaults to DEFAULT_TEMPLATE)
+        
+    Returns:
+        List of (relative path, content) tuples, where content is either
+        bytes or a list of text pieces and placeholder names
+    """
+    if template_dir is None:
+        files = DEFAULT_TEMPLATE.items()
+    else:
+        files = []
+        for root, dirs, names in os.walk(template_dir):
+            dirs[:] = [name for name in dirs if not TEMPLATE_SKIP.search(name)]
+            for name in sorted(names):
+                if TEMPLATE_SKIP.search(name):
+                    continue
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, template_dir)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                try:
+                    files.append((rel_path, data.decode("utf-8")))
+                except UnicodeDecodeError:
+                    files.append((rel_path, data))
+    
+    template = []
+    for rel_path, content in files:
+        if isinstance(content, str):
+            pieces = TEMPLATE_FIELDS.split(content)
+            content = content.encode("utf-8") if len(pieces) == 1 else pieces
+        template.append((rel_path, content))
+    
+    # Every agent gets a fresh memory and session log
+    for fresh_path in TEMPLATE_FRESH:
+        if not any(rel_path == fresh_path for rel_path, _ in template):
+            template.append((fresh_path, TEMPLATE_FIELDS.split(DEFAULT_TEMPLATE[fresh_path])))
+    return template
+
+def _provision_agent(agent_name, template):
+    """
+    Create an agent directory from a loaded template
     
     Args:
         agent_name: Name for the new agent
+        template: Result of load_template
         
     Returns:
         Status message
     """
     agent_dir = os.path.join(AGENTS_DIR, agent_name)
     
+    # Create agent directory
+    try:
+        os.makedirs(agent_dir)
+    except FileExistsError:
+        return f"Error: Agent '{agent_name}' already exists"
+    
+    values = {
+        "{agent_name}": agent_name,
+        "{agent_title}": agent_name.title(),
+        "{today}": datetime.now().strftime("%Y-%m-%d"),
+    }
+    
+    # Create files
+    for rel_path, content in template:
+        path = os.path.join(agent_dir, rel_path)
+        if os.path.dirname(rel_path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not isinstance(content, bytes):
+            content = "".join(values.get(piece, piece) for piece in content).encode("utf-8")
+        agent_durable.atomic_write(path, content)
+    
+    for box in agent_mailbox.MAILBOXES:
+        open(agent_mailbox.mailbox_path(agent_dir, box), 'w').close()
+    
+    # The new directory's own entry
+    agent_durable.sync_dir(AGENTS_DIR)
+    
+    return f"Agent '{agent_name}' created successfully"
+
+def create_agent(agent_name, template_dir=None):
+    """
+    Create a new agent with basic structure
+    
+    Args:
+        agent_name: Name for the new agent
+        template_dir: Optional directory to copy the agent's files from
+        
+    Returns:
+        Status message
+    """
     # Check if agent already exists
-    if os.path.exists(agent_dir):
+    if _agent_exists(agent_name):
         return f"Error: Agent '{agent_name}' already exists"
     
-    # Create agent directory
-    os.makedirs(agent_dir, exist_ok=True)
+    with agent_metrics.phase("file_write"):
+        result = _provision_agent(agent_name, load_template(template_dir))
+        if not result.startswith("Error"):
+            agent_registry.register_agent(AGENTS_DIR, agent_name)
     
-    # Create basic files
-    with open(os.path.join(agent_dir, "personality.md"), 'w') as f:
-        f.write(f"# {agent_name.title()}\n\n## Core Identity\n- Add personality traits here\n\n## Knowledge & Expertise\n- Add areas of expertise here\n")
+    return result
+
+def create_agents(agent_names, template_dir=None, max_workers=16):
+    """
+    Create many agents in parallel from one template
     
-    with open(os.path.join(agent_dir, "memory.md"), 'w') as f:
-        f.write(f"# {agent_name.title()}'s Memory Database\n\n## Project Knowledge\n- Initial memory entries go here\n")
+    Args:
+        agent_names: Names for the new agents
+        template_dir: Optional directory to copy the agents' files from
+        max_workers: Number of threads creating agents
+        
+    Returns:
+        Dictionary of agent name to status message
+    """
+    template = load_template(template_dir)
+    existing = set(agent_registry.list_agents(AGENTS_DIR))
     
-    with open(os.path.join(agent_dir, "inbox.json"), 'w') as f:
-        json.dump({"messages": []}, f, indent=2)
+    def provision(agent_name):
+        if agent_name in existing:
+            return f"Error: Agent '{agent_name}' already exists"
+        return _provision_agent(agent_name, template)
     
-    with open(os.path.join(agent_dir, "outbox.json"), 'w') as f:
-        json.dump({"messages": []}, f, indent=2)
+    with agent_metrics.phase("file_write"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(agent_names, executor.map(provision, agent_names)))
     
-    with open(os.path.join(agent_dir, "session_log.md"), 'w') as f:
-        f.write(f"# {agent_name.title()}'s Session Log\n\n## Session: {datetime.now().strftime('%Y-%m-%d')}\n\n")
+    # Register the whole batch with a single registry update
+    agent_registry.register_agents(
+        AGENTS_DIR, [name for name, result in results.items() if not result.startswith("Error")])
     
-    with open(os.path.join(agent_dir, "prompt_template.md"), 'w') as f:
-        f.write(f"# {agent_name.title()} Agent Prompt Template\n\n## System Instructions\n\nYou are {agent_name.title()}. Respond in character.\n\n## Character Definition\n\n{{personality}}\n\n## Current Memory State\n\n{{memory}}\n\n## Project Context\n\n{{project_context}}\n\n## Current Message\n\n{{message}}\n\n## Response Guidelines\n\n1. Always respond in character\n2. Provide technically sound advice\n\nNow, respond to the current message as {agent_name.title()}.")
+    return results
+
+def migrate_agent(agent_name):
+    """
+    Convert an agent's mailboxes to the format of the selected backend
     
-    return f"Agent '{agent_name}' created successfully"
+    With the JSONL backend this converts inbox.json/outbox.json; with the
+    SQLite backend it imports the JSON or JSONL mailbox files into the
+    database.
+    
+    Args:
+        agent_name: Name of the agent
+        
+    Returns:
+        Status message
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist"
+    
+    migrated = []
+    for box in agent_mailbox.MAILBOXES:
+        try:
+            with agent_metrics.phase("file_write"):
+                count = mailbox.migrate_mailbox(agent_dir, box)
+        except json.JSONDecodeError:
+            return f"Error: {box}.json for '{agent_name}' is not valid JSON"
+        if count:
+            migrated.append(f"{count} {box} messages")
+    
+    if not migrated:
+        return f"Nothing to migrate for {agent_name}"
+    
+    return f"Migrated {', '.join(migrated)} for {agent_name}"
+
+def sweep_agent(agent_name):
+    """
+    Drop expired messages from an agent's mailboxes
+    
+    Args:
+        agent_name: Name of the agent
+        
+    Returns:
+        Status message
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist"
+    
+    dropped = []
+    for box in agent_mailbox.MAILBOXES:
+        try:
+            with agent_metrics.phase("file_write"):
+                count = mailbox.sweep_expired(agent_dir, box)
+        except json.JSONDecodeError:
+            return f"Error: {box}.json for '{agent_name}' is not valid JSON"
+        if count:
+            dropped.append(f"{count} {box} messages")
+    
+    if not dropped:
+        return f"No expired messages for {agent_name}"
+    
+    return f"Dropped {', '.join(dropped)} for {agent_name}"
+
+def compact_agent(agent_name):
+    """
+    Move read messages from an agent's mailboxes into the archive
+    
+    Args:
+        agent_name: Name of the agent
+        
+    Returns:
+        Status message
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist"
+    
+    compacted = []
+    for box in agent_mailbox.MAILBOXES:
+        try:
+            with agent_metrics.phase("file_write"):
+                archived, expired = mailbox.compact_mailbox(agent_dir, box)
+        except json.JSONDecodeError:
+            return f"Error: {box}.json for '{agent_name}' is not valid JSON"
+        if archived or expired:
+            compacted.append(f"{archived} {box} messages archived, {expired} expired dropped")
+    
+    if not compacted:
+        return f"Nothing to compact for {agent_name}"
+    
+    return f"Compacted {agent_name}: {'; '.join(compacted)}"
+
+def search_archive(agent_name, box="outbox", text=None, since=None, until=None):
+    """
+    Search the archived messages of an agent
+    
+    Args:
+        agent_name: Name of the agent
+        box: Mailbox to search ("inbox" or "outbox")
+        text: Only return messages whose subject or content contains this text
+        since: First day to search as YYYY-MM-DD
+        until: Last day to search as YYYY-MM-DD
+        
+    Returns:
+        List of archived messages or status message
+    """
+    agent_dir = os.path.join(AGENTS_DIR, agent_name)
+    
+    if not _agent_exists(agent_name):
+        return f"Error: Agent '{agent_name}' does not exist"
+    
+    needle = text.lower() if text else None
+    with agent_metrics.phase("json_parse"):
+        return [m for m in agent_mailbox.iter_archived(agent_dir, box, since, until)
+                if needle is None
+                or needle in str(m.get("content", "")).lower()
+                or needle in str(m.get("subject", "")).lower()]
+
+def serve(path=None):
+    """
+    Run the coordinator daemon
+    
+    The daemon keeps mailboxes and the agent registry cached in memory and
+    serves send/get/respond/list over a Unix socket. Writes go straight to
+    disk, so the CLI keeps working when the daemon is stopped.
+    
+    Args:
+        path: Socket path (defaults to agent_daemon.socket_path)
+    """
+    # The SQLite backend has its own page cache and indexes
+    cache = agent_daemon.MailboxCache() if mailbox is agent_mailbox else None
+    
+    handlers = {
+        "send_message": send_message,
+        "send_messages": send_messages,
+        "get_responses": lambda agent_name, mark_as_read=True, priority=False: get_responses(
+            agent_name, mark_as_read, cache, priority),
+        "respond_to_message": respond_to_message,
+        "list_agents": list_agents,
+        "agent_stats": agent_stats,
+    }
+    
+    agent_daemon.serve(path or agent_daemon.socket_path(AGENTS_DIR), handlers)
+
+def run(operation, *args, **kwargs):
+    """
+    Run a coordinator operation through the daemon if one is running
+    
+    Args:
+        operation: Name of the coordinator function
+        *args, **kwargs: Arguments for the function
+        
+    Returns:
+        The function's result
+    """
+    try:
+        return agent_daemon.call(agent_daemon.socket_path(AGENTS_DIR), operation, *args, **kwargs)
+    except agent_daemon.DaemonUnavailable:
+        return globals()[operation](*args, **kwargs)
 
 def print_help():
     """Print detailed help information about the coordinator"""
@@ -257,19 +808,78 @@ def print_help():
       Options:
         --subject "Subject"   - Add a subject line
         --type [task|question|feedback|general] - Specify message type
+        --batch FILE          - Send every message in a JSONL file at once
+        --ttl S               - Expire the message if unread after S seconds
+        --idempotency-key KEY - Only ever send one message with this key
+        --dedupe              - Skip if the same from/subject/content was sent
+    
+    broadcast "<message>"     - Send a message to many agents in parallel
+      Options:
+        --agents a,b,c        - Agents to message (default: all agents)
+        --workers N           - Number of parallel senders
+        --ttl S               - Expire the message if unread after S seconds
     
     get <agent>               - Check for agent responses
       Options:
         --keep-unread         - Don't mark messages as read
+        --priority            - Most urgent types first (task, question, feedback, general)
+        --follow              - Keep waiting and print responses as they arrive
+        --timeout S           - With --follow, stop after S idle seconds
+        --limit N             - Stop after N responses (the rest stay unread)
+        --latest              - With --limit, take the newest responses
+        --since TIME          - Only responses since epoch seconds or YYYY-MM-DD[THH:MM]
+        --from SENDER         - Only responses from SENDER
+        --json                - Print raw JSON lines instead of formatted text
     
     respond <agent> "<msg>"   - Add a response from an agent (for development)
+      Options:
+        --type [task|question|feedback|general] - Specify response type
     
-    list                      - Show all available agents
+    list                      - Show all available agents with unread counts
     
     create <agent>            - Create a new agent with default files
+      Options:
+        --from-template DIR   - Copy files from DIR ({agent_name}, {agent_title}
+                                and {today} are filled in)
+        --count N             - Create <agent>-01 ... <agent>-N in parallel
+                                (numbers zero-padded to the width of N)
+    
+    migrate <agent|--all>     - Convert inbox.json/outbox.json to JSONL mailboxes
+                                (with AGENT_MAILBOX_BACKEND=sqlite, import the
+                                mailbox files into the SQLite database)
+    
+    sweep <agent|--all>       - Drop expired messages from mailboxes
+    
+    compact <agent|--all>     - Move read messages into gzip archives by day
+                                (also runs automatically as messages are read)
+    
+    history <agent>           - Search archived messages
+      Options:
+        --box [inbox|outbox]  - Mailbox to search (default: outbox)
+        --grep TEXT           - Only messages whose subject or content contains TEXT
+        --since YYYY-MM-DD    - First day to search
+        --until YYYY-MM-DD    - Last day to search
+    
+    serve                     - Run a daemon that caches mailboxes in memory;
+                                send/get/respond/list use it when it is running
+      Options:
+        --socket PATH         - Socket path (or set COORDINATOR_SOCKET)
+    
+    stats                     - Summarize metrics recorded in $AGENT_METRICS_FILE
+      Options:
+        --file PATH           - Metrics file to read instead
+        --for COMMAND         - Only one command (e.g. get)
+        --since TIME          - Only records since epoch seconds or YYYY-MM-DD[THH:MM]
+        --json                - Print the summary as JSON
     
     help                      - Show this detailed help message
     
+    Global options (before the command):
+        --timings             - Print where the command spent its time to stderr
+    
+    Set AGENT_METRICS_FILE=path to append a JSON line of timings and payload
+    sizes for every coordinator.py and agent_state.py command to that file.
+    
     Examples:
     --------
     python coordinator.py send heinz "Could you review this code?"
@@ -280,6 +890,8 @@ def print_help():
 
 def main():
     parser = argparse.ArgumentParser(description="Agent Coordinator for Notes Manager 2")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print where the command spent its time (to stderr)")
     subparsers = parser.add_subparsers(dest="command", help="Command to execute")
     
     # Help command
@@ -288,36 +900,167 @@ def main():
     # Send message command
     send_parser = subparsers.add_parser("send", help="Send a message to an agent")
     send_parser.add_argument("agent", help="Name of the agent")
-    send_parser.add_argument("message", help="Message content")
+    send_parser.add_argument("message", nargs="?", help="Message content")
     send_parser.add_argument("--subject", help="Subject line for the message")
     send_parser.add_argument("--type", choices=["task", "question", "feedback", "general"], 
                            default="general", help="Type of message")
+    send_parser.add_argument("--batch", metavar="FILE",
+                           help="JSONL file of messages (content/subject/type/from/ttl/idempotency_key) to send at once")
+    send_parser.add_argument("--ttl", type=int, help="Seconds after which an unread message expires")
+    send_parser.add_argument("--idempotency-key", help="Send the message only once under this key")
+    send_parser.add_argument("--dedupe", action="store_true",
+                           help="Skip messages with the same from/subject/content as one already sent")
+    
+    # Broadcast command
+    broadcast_parser = subparsers.add_parser("broadcast", help="Send a message to many agents")
+    broadcast_parser.add_argument("message", help="Message content")
+    broadcast_parser.add_argument("--agents", help="Comma-separated agent names (default: all agents)")
+    broadcast_parser.add_argument("--subject", help="Subject line for the message")
+    broadcast_parser.add_argument("--type", choices=["task", "question", "feedback", "general"], 
+                           default="general", help="Type of message")
+    broadcast_parser.add_argument("--workers", type=int, default=8, help="Number of parallel senders")
+    broadcast_parser.add_argument("--ttl", type=int, help="Seconds after which an unread message expires")
     
     # Get responses command
     get_parser = subparsers.add_parser("get", help="Get responses from an agent")
     get_parser.add_argument("agent", help="Name of the agent")
     get_parser.add_argument("--keep-unread", action="store_true", help="Don't mark messages as read")
+    get_parser.add_argument("--priority", action="store_true",
+                           help="Show responses by type priority instead of arrival order")
+    get_parser.add_argument("--follow", action="store_true", help="Keep waiting for new responses")
+    get_parser.add_argument("--timeout", type=float,
+                           help="With --follow, stop after this many seconds without a response")
+    get_parser.add_argument("--limit", type=int, help="Stop after this many responses")
+    get_parser.add_argument("--latest", action="store_true", help="Take the newest responses first")
+    get_parser.add_argument("--since", help="Only responses since epoch seconds or an ISO date/time")
+    get_parser.add_argument("--from", dest="sender", help="Only responses from this sender")
+    get_parser.add_argument("--json", action="store_true", help="Print raw JSON lines")
     
     # Respond command (for simulating agent responses)
     respond_parser = subparsers.add_parser("respond", help="Add a response from an agent")
     respond_parser.add_argument("agent", help="Name of the agent")
     respond_parser.add_argument("response", help="Response content")
+    respond_parser.add_argument("--type", choices=["task", "question", "feedback", "general"],
+                              help="Type of response")
     
     # List agents command
     subparsers.add_parser("list", help="List all available agents")
     
     # Create agent command
     create_parser = subparsers.add_parser("create", help="Create a new agent")
-    create_parser.add_argument("agent", help="Name for the new agent")
+    create_parser.add_argument("agent", help="Name for the new agent (prefix with --count)")
+    create_parser.add_argument("--from-template", metavar="DIR", help="Directory to copy agent files from")
+    create_parser.add_argument("--count", type=int, help="Create N agents named <agent>-01 ... <agent>-N, zero-padded to the width of N")
+    create_parser.add_argument("--workers", type=int, default=16, help="Number of parallel creators")
+    
+    # Metrics command
+    stats_parser = subparsers.add_parser("stats", help="Summarize recorded command metrics")
+    stats_parser.add_argument("--file", help="Metrics file (default: $AGENT_METRICS_FILE)")
+    stats_parser.add_argument("--for", dest="for_command", metavar="COMMAND", help="Only this command")
+    stats_parser.add_argument("--since", help="Only records since epoch seconds or an ISO date/time")
+    stats_parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    
+    # Daemon command
+    serve_parser = subparsers.add_parser("serve", help="Run the coordinator daemon")
+    serve_parser.add_argument("--socket", help="Socket path (default: $COORDINATOR_SOCKET or AGENTS_DIR/.coordinator.sock)")
+    
+    # Migrate mailboxes command
+    migrate_parser = subparsers.add_parser("migrate", help="Convert legacy JSON mailboxes to JSONL")
+    migrate_parser.add_argument("agent", nargs="?", help="Name of the agent")
+    migrate_parser.add_argument("--all", action="store_true", help="Migrate every agent")
+    
+    # Sweep expired messages command
+    sweep_parser = subparsers.add_parser("sweep", help="Drop expired messages")
+    sweep_parser.add_argument("agent", nargs="?", help="Name of the agent")
+    sweep_parser.add_argument("--all", action="store_true", help="Sweep every agent")
+    
+    # Compact mailboxes command
+    compact_parser = subparsers.add_parser("compact", help="Archive read messages")
+    compact_parser.add_argument("agent", nargs="?", help="Name of the agent")
+    compact_parser.add_argument("--all", action="store_true", help="Compact every agent")
+    
+    # Search archived messages command
+    history_parser = subparsers.add_parser("history", help="Search archived messages")
+    history_parser.add_argument("agent", help="Name of the agent")
+    history_parser.add_argument("--box", choices=list(agent_mailbox.MAILBOXES), default="outbox",
+                              help="Mailbox to search")
+    history_parser.add_argument("--grep", help="Only messages whose subject or content contains this text")
+    history_parser.add_argument("--since", help="First day to search (YYYY-MM-DD)")
+    history_parser.add_argument("--until", help="Last day to search (YYYY-MM-DD)")
     
     args = parser.parse_args()
     
-    # Handle commands
+    agent_metrics.begin("coordinator", args.command, args.timings)
+    try:
+        run_command(args, parser)
+    finally:
+        agent_metrics.finish()
+
+def run_command(args, parser):
+    """Run the subcommand selected on the command line"""
     if args.command == "send":
-        result = send_message(args.agent, args.message, subject=args.subject, message_type=args.type)
+        if args.batch:
+            try:
+                messages = load_batch(args.batch)
+            except (OSError, ValueError) as e:
+                print(f"Error reading batch file: {e}")
+                return
+            # Command line options act as defaults for every message
+            for message in messages:
+                message.setdefault("subject", args.subject)
+                message.setdefault("type", args.type)
+                message.setdefault("ttl", args.ttl)
+            result = run("send_messages", args.agent, messages, args.dedupe)
+        elif args.message is not None:
+            result = run("send_message", args.agent, args.message, subject=args.subject, message_type=args.type,
+                         ttl=args.ttl, idempotency_key=args.idempotency_key, dedupe=args.dedupe)
+        else:
+            result = "Error: Message content or --batch required"
         print(result)
+    elif args.command == "broadcast":
+        agents = args.agents.split(",") if args.agents else None
+        result = broadcast_message(args.message, agents, subject=args.subject,
+                                   message_type=args.type, max_workers=args.workers, ttl=args.ttl)
+        if isinstance(result, dict):
+            for agent, status in result.items():
+                print(f"{agent}: {status}")
+        else:
+            print(result)
+    elif args.command == "get" and args.follow:
+        try:
+            for msg in follow_responses(args.agent, not args.keep_unread, args.timeout):
+                print(msg)
+                print("-" * 40, flush=True)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "get" and not args.priority and (
+            args.limit is not None or args.latest or args.since or args.sender or args.json):
+        try:
+            since = parse_time(args.since) if args.since else None
+        except ValueError:
+            print(f"Error: Invalid --since value '{args.since}'")
+            return
+        result = iter_responses(args.agent, not args.keep_unread, args.limit, since, args.sender, args.latest)
+        if isinstance(result, str):
+            print(result)
+            return
+        count = 0
+        try:
+            for msg in result:
+                count += 1
+                if args.json:
+                    print(json.dumps(msg), flush=True)
+                else:
+                    print(format_responses([msg])[0])
+                    print("-" * 40, flush=True)
+        except json.JSONDecodeError:
+            print("Error reading outbox")
+        finally:
+            result.close()
+        if not count and not args.json:
+            print("No unread responses")
     elif args.command == "get":
-        result = get_responses(args.agent, not args.keep_unread)
+        result = run("get_responses", args.agent, not args.keep_unread, priority=args.priority)
         if isinstance(result, list):
             for msg in result:
                 print(msg)
@@ -325,19 +1068,79 @@ def main():
         else:
             print(result)
     elif args.command == "respond":
-        result = respond_to_message(args.agent, args.response)
+        result = run("respond_to_message", args.agent, args.response, args.type)
         print(result)
     elif args.command == "list":
-        agents = list_agents()
-        if isinstance(agents, list):
+        agents = run("agent_stats")
+        if isinstance(agents, dict):
             print("Available agents:")
-            for agent in agents:
-                print(f"- {agent}")
+            for agent, stats in agents.items():
+                inbox, outbox = stats["inbox"], stats["outbox"]
+                print(f"- {agent} (inbox: {inbox['unread']}/{inbox['messages']} unread, "
+                      f"outbox: {outbox['unread']}/{outbox['messages']} unread)")
         else:
             print(agents)
+    elif args.command == "create" and args.count:
+        width = len(str(args.count))
+        names = [f"{args.agent}-{i:0{width}d}" for i in range(1, args.count + 1)]
+        results = create_agents(names, args.from_template, args.workers)
+        errors = [result for result in results.values() if result.startswith("Error")]
+        for error in errors:
+            print(error)
+        print(f"Created {len(results) - len(errors)} agents")
     elif args.command == "create":
-        result = create_agent(args.agent)
+        result = create_agent(args.agent, args.from_template)
         print(result)
+    elif args.command in ("migrate", "sweep", "compact"):
+        if args.all:
+            agents = list_agents()
+            if not isinstance(agents, list):
+                print(agents)
+                return
+        elif args.agent:
+            agents = [args.agent]
+        else:
+            print("Error: Agent name or --all required")
+            return
+        operation = {"migrate": migrate_agent, "sweep": sweep_agent, "compact": compact_agent}[args.command]
+        for agent in agents:
+            print(operation(agent))
+    elif args.command == "history":
+        result = search_archive(args.agent, args.box, args.grep, args.since, args.until)
+        if isinstance(result, list):
+            for msg in format_responses(result):
+                print(msg)
+                print("-" * 40)
+        else:
+            print(result)
+    elif args.command == "stats":
+        path = args.file or agent_metrics.metrics_path()
+        if not path or not os.path.exists(path):
+            print("Error: No metrics file; set AGENT_METRICS_FILE or pass --file")
+            return
+        try:
+            since = parse_time(args.since) if args.since else None
+        except ValueError:
+            print(f"Error: Invalid --since value '{args.since}'")
+            return
+        summary = agent_metrics.summarize(path, args.for_command, since)
+        if args.json:
+            print(json.dumps(summary, indent=2))
+            return
+        for name, entry in summary.items():
+            total = entry["total"]
+            print(f"{name} ({entry['count']} runs): "
+                  f"p50 {total['p50']:.3f} ms, p95 {total['p95']:.3f} ms, p99 {total['p99']:.3f} ms")
+            for phase_name, stats in entry["phases"].items():
+                print(f"  {phase_name:<16} p50 {stats['p50']:9.3f}  p95 {stats['p95']:9.3f}  "
+                      f"p99 {stats['p99']:9.3f}  max {stats['max']:9.3f} ms")
+            for size, mean in entry["sizes"].items():
+                print(f"  {size:<16} mean {mean}")
+    elif args.command == "serve":
+        try:
+            serve(args.socket)
+        except RuntimeError as e:
+            print(f"Error: {e}")
     elif args.command == "help":
         print_help()
     else:
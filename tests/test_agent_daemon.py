@@ -0,0 +1,39 @@
+import pytest
+
+import agent_daemon
+import agent_mailbox
+
+@pytest.fixture
+def agents_dir(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+def _send(agent_dir, contents):
+    return agent_mailbox.append_messages(agent_dir, "inbox", [
+        {"from": "user", "content": c, "timestamp": 0} for c in contents])
+
+def test_cache_drops_messages_before_the_cursor(agents_dir):
+    """Read messages leave the cache, and reads still match the files."""
+    agent_dir = str(agents_dir / "a")
+    _send(agent_dir, [f"m{i}" for i in range(10)])
+    cache = agent_daemon.MailboxCache()
+    assert cache.read_unread(agent_dir, "inbox") == agent_mailbox.read_unread(agent_dir, "inbox")
+
+    agent_mailbox.pop_next(agent_dir, "inbox", 4)
+    starts = [start for start, _, _ in agent_mailbox.iter_unread(agent_dir, "inbox")]
+    agent_mailbox.mark_read_until(agent_dir, "inbox", starts[3])
+    _send(agent_dir, ["m10"])
+
+    assert cache.read_unread(agent_dir, "inbox") == agent_mailbox.read_unread(agent_dir, "inbox")
+    cached = cache.boxes[agent_mailbox.mailbox_path(agent_dir, "inbox")]
+    assert [m["content"] for m in cached["messages"]] == [f"m{i}" for i in range(7, 11)]
+
+def test_cache_keeps_at_most_max_boxes(agents_dir):
+    """The least recently read mailbox is dropped once max_boxes are cached."""
+    cache = agent_daemon.MailboxCache(max_boxes=1)
+    for name in ("a", "b"):
+        _send(str(agents_dir / name), [name])
+        assert [m["content"] for m in cache.read_unread(str(agents_dir / name), "inbox")[0]] == [name]
+
+    assert list(cache.boxes) == [agent_mailbox.mailbox_path(str(agents_dir / "b"), "inbox")]
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import agent_durable
+
+@pytest.fixture(autouse=True)
+def group_commit(monkeypatch):
+    monkeypatch.setenv(agent_durable.DURABILITY_ENV, "group")
+
+def test_group_commit_files_stay_out_of_the_directory(tmp_path):
+    """Durable writes leave only the written files and one hidden .sync directory."""
+    agent_durable.atomic_write(str(tmp_path / "memory.md"), b"# Memory\n")
+    agent_durable.append(str(tmp_path / "inbox.jsonl"), b"{}\n")
+    agent_durable.atomic_write(str(tmp_path / "memory.md"), b"# Memory\n- more\n")
+
+    assert sorted(os.listdir(tmp_path)) == [".sync", "inbox.jsonl", "memory.md"]
+    assert (tmp_path / "memory.md").read_bytes() == b"# Memory\n- more\n"
+    assert os.listdir(tmp_path / ".sync" / "memory.md.tmp") == []
+
+def test_stale_group_commit_file_does_not_skip_the_fsync(tmp_path):
+    """Counters left by an earlier boot never count as an fsync of a new write."""
+    (tmp_path / ".sync").mkdir()
+    (tmp_path / ".sync" / "log").write_text(f"{10**12:020d} {10**12:020d}\n")
+    flushes = []
+
+    agent_durable.sync(str(tmp_path / ".sync" / "log"), lambda: flushes.append(1))
+
+    assert flushes == [1]
+    assert (tmp_path / ".sync" / "log").read_text() == f"{10**12 + 1:020d} {10**12 + 1:020d}\n"
+
+def test_unreadable_group_commit_file_does_not_skip_the_fsync(tmp_path):
+    """A .sync file from an older version is replaced, and unparsable counters mean the fsync is run."""
+    (tmp_path / ".sync").write_text(f"{10**15:020d}\n")
+    agent_durable.sync_dir(str(tmp_path))
+    assert os.path.isdir(tmp_path / ".sync")
+
+    (tmp_path / ".sync" / "log").write_text("0000")
+    flushes = []
+    agent_durable.sync(str(tmp_path / ".sync" / "log"), lambda: flushes.append(1))
+
+    assert flushes == [1]
@@ -0,0 +1,70 @@
+import os
+import json
+import shutil
+
+import pytest
+
+import agent_journal
+
+@pytest.fixture
+def agent_dir(tmp_path):
+    path = tmp_path / "agent"
+    path.mkdir()
+    return str(path)
+
+# Large enough that a few patches are cheaper than a snapshot
+NOTES = "notes " * 200
+
+def _save_versions(agent_dir, count):
+    versions = []
+    for i in range(count):
+        state = {"x": i, "tasks": [f"task {j}" for j in range(i % 5)], "nested": {"even": i % 2 == 0},
+                 "notes": NOTES}
+        agent_journal.save_state(agent_dir, state, 1000 + i)
+        versions.append(state)
+    return versions
+
+def test_replay_across_snapshots(agent_dir):
+    """Every saved version can be rebuilt, across several snapshot intervals."""
+    versions = _save_versions(agent_dir, agent_journal.SNAPSHOT_INTERVAL * 2 + 5)
+
+    kinds = [kind for _, kind, _ in agent_journal.iter_versions(agent_dir)]
+    assert "patch" in kinds and kinds.count("snapshot") >= 3
+    assert agent_journal.load_state(agent_dir) == versions[-1]
+    for i, state in enumerate(versions):
+        assert agent_journal.load_state(agent_dir, at=1000 + i) == state
+        # Between two saves, the earlier one is returned
+        assert agent_journal.load_state(agent_dir, at=1000 + i + 0.5) == state
+
+def test_at_before_first_save(agent_dir):
+    """There is no version before the first save."""
+    _save_versions(agent_dir, 3)
+    assert agent_journal.load_state(agent_dir, at=999) is None
+
+def test_state_json_is_always_current(agent_dir):
+    """state.json holds the latest state, not the last snapshot."""
+    versions = _save_versions(agent_dir, 5)
+    with open(agent_journal.state_path(agent_dir), 'r') as f:
+        assert json.load(f) == versions[-1]
+
+def test_copy_and_restore_is_not_an_edit(agent_dir):
+    """Replacing state.json with an identical copy keeps the journal chain."""
+    versions = _save_versions(agent_dir, 5)
+    path = agent_journal.state_path(agent_dir)
+    shutil.copy2(path, path + ".backup")
+    os.replace(path + ".backup", path)
+
+    assert agent_journal.load_state(agent_dir) == versions[-1]
+    assert agent_journal.save_state(agent_dir, dict(versions[-1], x=99), 2000) == "patch"
+    assert agent_journal.load_state(agent_dir, at=1004) == versions[-1]
+
+def test_hand_edit_wins_and_is_snapshotted(agent_dir):
+    """A state.json with new contents is the latest state, and the next save snapshots."""
+    versions = _save_versions(agent_dir, 5)
+    with open(agent_journal.state_path(agent_dir), 'w') as f:
+        f.write('{"x": "edited"}')
+
+    assert agent_journal.load_state(agent_dir) == {"x": "edited"}
+    assert agent_journal.save_state(agent_dir, {"x": "saved"}, 2000) == "snapshot"
+    assert agent_journal.load_state(agent_dir) == {"x": "saved"}
+    assert agent_journal.load_state(agent_dir, at=1004) == versions[-1]
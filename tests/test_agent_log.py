@@ -0,0 +1,52 @@
+import pytest
+
+import agent_log
+import agent_search
+
+@pytest.fixture
+def agent_dir(tmp_path):
+    path = tmp_path / "agent"
+    path.mkdir()
+    return str(path)
+
+def test_headings_inside_fenced_entries_stay_in_the_entry(agent_dir):
+    """Markdown headings in a logged response do not start new entries."""
+    response = "## Plan\nstep one\n### Detail\nmore"
+    agent_log.append_entries(agent_dir, "tester", [("Response", response), ("Input", "next")],
+                             today="2026-01-01")
+
+    entries = list(agent_log.iter_entries(agent_dir))
+    assert [(e["type"], e["content"]) for e in entries] == [("Response", response), ("Input", "next")]
+    assert all(e["session"] == "2026-01-01" for e in entries)
+
+def test_search_index_keeps_fenced_headings_in_one_document(agent_dir):
+    """The search index, built from the same parser, sees one document per entry."""
+    agent_log.append_entries(agent_dir, "tester", [("Response", "## Plan\nstep one\n### Detail\nzeppelin")],
+                             today="2026-01-01")
+
+    results = agent_search.search(agent_dir, "zeppelin", kinds=["session_log"])
+    assert [r["title"] for r in results] == ["Response"]
+
+def test_search_finds_entries_written_after_rotation(agent_dir):
+    """A fresh segment that reuses the rotated one's inode is indexed from its start."""
+    agent_log.append_entries(agent_dir, "tester", [("Response", "before " * 20)], today="2026-01-01")
+    assert [r["title"] for r in agent_search.search(agent_dir, "before", kinds=["session_log"])] == ["Response"]
+
+    agent_log.append_entries(agent_dir, "tester", [("Response", "zeppelin")], today="2026-01-02")
+
+    assert [r["title"] for r in agent_search.search(agent_dir, "zeppelin", kinds=["session_log"])] == ["Response"]
+    assert len(agent_search.search(agent_dir, "before", kinds=["session_log"])) == 1
+
+def test_rotation_keeps_the_log_until_the_archive_is_written(agent_dir, monkeypatch):
+    """The archive is written through atomic_write, and the active segment survives a failure there."""
+    agent_log.append_entries(agent_dir, "tester", [("Input", "day one")], today="2026-01-01")
+    agent_log.append_entries(agent_dir, "tester", [("Input", "day two")], today="2026-01-02")
+    assert [e["content"] for e in agent_log.iter_entries(agent_dir)] == ["day one", "day two"]
+
+    def crash(path, data, durable=True):
+        raise OSError("crash")
+    monkeypatch.setattr(agent_log.agent_durable, "atomic_write", crash)
+    with pytest.raises(OSError):
+        agent_log.rotate_segment(agent_dir)
+
+    assert [e["content"] for e in agent_log.iter_entries(agent_dir)] == ["day one", "day two"]
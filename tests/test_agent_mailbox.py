@@ -0,0 +1,154 @@
+import os
+
+import pytest
+
+import agent_mailbox
+import agent_search
+
+@pytest.fixture
+def agent_dir(tmp_path):
+    path = tmp_path / "agent"
+    path.mkdir()
+    return str(path)
+
+def _send(agent_dir, contents, message_type="general"):
+    return agent_mailbox.append_messages(agent_dir, "inbox", [
+        {"from": "user", "content": c, "type": message_type, "timestamp": 0} for c in contents])
+
+def test_compaction_drops_messages_acked_out_of_order(agent_dir):
+    """Messages acknowledged past an unread one are removed and the acked set is cleared."""
+    _send(agent_dir, [f"m{i}" for i in range(10)])
+    offsets = [start for start, _, _ in agent_mailbox.iter_unread(agent_dir, "inbox")]
+    agent_mailbox.ack_offsets(agent_dir, "inbox", offsets[1:])
+    assert agent_mailbox.read_cursor_state(agent_dir, "inbox") == (0, set(offsets[1:]))
+
+    assert agent_mailbox.compact_mailbox(agent_dir, "inbox") == (9, 0)
+
+    assert agent_mailbox.read_cursor_state(agent_dir, "inbox") == (0, set())
+    assert [m["content"] for m in agent_mailbox.read_messages(agent_dir, "inbox")] == ["m0"]
+    assert [m["content"] for m in agent_mailbox.iter_archived(agent_dir, "inbox")] == [f"m{i}" for i in range(1, 10)]
+
+def test_pop_next_only_moves_queue_heads(agent_dir):
+    """Taking messages leaves the queue files alone and rewrites only the small heads file."""
+    _send(agent_dir, [f"g{i}" for i in range(50)])
+    _send(agent_dir, [f"t{i}" for i in range(50)], message_type="task")
+    directory = agent_mailbox.priority_index_path(agent_dir, "inbox")
+
+    assert [m["content"] for m in agent_mailbox.pop_next(agent_dir, "inbox", 2)] == ["t0", "t1"]
+    queues = {name: os.stat(os.path.join(directory, name)).st_ino for name in os.listdir(directory) if name != "heads"}
+
+    assert [m["content"] for m in agent_mailbox.pop_next(agent_dir, "inbox", 49)] == [f"t{i}" for i in range(2, 50)] + ["g0"]
+    assert {name: os.stat(os.path.join(directory, name)).st_ino for name in queues} == queues
+    # One head position per queue, however many messages are queued
+    assert os.path.getsize(os.path.join(directory, "heads")) < 64
+
+def test_pop_next_after_compaction(agent_dir):
+    """The priority queues survive compaction of messages acknowledged out of order."""
+    _send(agent_dir, ["g0", "g1"])
+    _send(agent_dir, ["t0", "t1"], message_type="task")
+    assert [m["content"] for m in agent_mailbox.pop_next(agent_dir, "inbox", 1)] == ["t0"]
+
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+    _send(agent_dir, ["q0"], message_type="question")
+
+    assert [m["content"] for m in agent_mailbox.pop_next(agent_dir, "inbox", 10)] == ["t1", "q0", "g0", "g1"]
+    assert agent_mailbox.pop_next(agent_dir, "inbox", 10) == []
+
+def test_offsets_stay_valid_across_compaction(agent_dir):
+    """Offsets handed out before a compaction still address the same messages after it."""
+    _send(agent_dir, [f"m{i}" for i in range(6)])
+    before = {m["content"]: (start, end) for start, end, m in agent_mailbox.iter_unread(agent_dir, "inbox")}
+    agent_mailbox.ack_offsets(agent_dir, "inbox", [before["m0"][0], before["m2"][0], before["m3"][0]])
+    _, end = agent_mailbox.read_unread(agent_dir, "inbox")
+
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+
+    after = {m["content"]: (start, end) for start, end, m in agent_mailbox.iter_unread(agent_dir, "inbox")}
+    assert after == {c: before[c] for c in ("m1", "m4", "m5")}
+    # The cursor's base counts the bytes removed from the head
+    assert agent_mailbox.load_cursor(agent_dir, "inbox")[2][0] == before["m1"][0]
+    assert agent_mailbox.read_unread(agent_dir, "inbox")[1] == end
+
+    # Stale offsets of removed messages are ignored, live ones still work
+    agent_mailbox.ack_offsets(agent_dir, "inbox", [before["m2"][0], before["m4"][0]])
+    assert [m["content"] for m in agent_mailbox.get_unread(agent_dir, "inbox")] == ["m1", "m5"]
+    agent_mailbox.mark_read_until(agent_dir, "inbox", before["m5"][0])
+    assert [m["content"] for m in agent_mailbox.get_unread(agent_dir, "inbox")] == ["m5"]
+
+    # New messages continue after the old end of the log
+    new = _send(agent_dir, ["m6"])
+    assert agent_mailbox.read_unread(agent_dir, "inbox", end)[0] == new
+    assert [start for start, _, _ in agent_mailbox.iter_unread(agent_dir, "inbox")] == [before["m5"][0], end]
+
+def test_ids_stay_valid_across_compaction(agent_dir):
+    """The id index finds messages after compaction and knows compacted ones are read."""
+    messages = _send(agent_dir, [f"m{i}" for i in range(6)])
+    ids = [m["id"] for m in messages]
+    assert agent_mailbox.ack_ids(agent_dir, "inbox", [ids[0], ids[2]]) == [ids[0], ids[2]]
+
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+
+    assert agent_mailbox.ack_ids(agent_dir, "inbox", [ids[2], ids[3], ids[5]]) == [ids[3], ids[5]]
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+    assert agent_mailbox.ack_ids(agent_dir, "inbox", ids) == [ids[1], ids[4]]
+    assert agent_mailbox.get_unread(agent_dir, "inbox") == []
+
+def test_out_of_order_acks_trigger_compaction(agent_dir, monkeypatch):
+    """Enough out-of-order acks compact the mailbox even though the cursor never moves."""
+    monkeypatch.setattr(agent_mailbox, "COMPACT_ACKED", 5)
+    ids = [m["id"] for m in _send(agent_dir, [f"m{i}" for i in range(10)])]
+    agent_mailbox.ack_ids(agent_dir, "inbox", ids[1:5])
+    assert len(list(agent_mailbox.iter_archived(agent_dir, "inbox"))) == 0
+
+    agent_mailbox.ack_ids(agent_dir, "inbox", ids[5:6])
+
+    assert [m["content"] for m in agent_mailbox.iter_archived(agent_dir, "inbox")] == [f"m{i}" for i in range(1, 6)]
+    assert agent_mailbox.read_cursor_state(agent_dir, "inbox") == (0, set())
+
+def test_archive_is_written_before_the_log(agent_dir, monkeypatch):
+    """A crash while rewriting the log leaves the messages archived and still in the log."""
+    _send(agent_dir, ["m0", "m1"])
+    agent_mailbox.mark_all_read(agent_dir, "inbox")
+    log = agent_mailbox.mailbox_path(agent_dir, "inbox")
+    with open(log, 'rb') as f:
+        data = f.read()
+
+    def crash(path, data, durable=True):
+        raise OSError("crash")
+    monkeypatch.setattr(agent_mailbox.agent_durable, "atomic_write", crash)
+    with pytest.raises(OSError):
+        agent_mailbox.compact_mailbox(agent_dir, "inbox")
+
+    assert [m["content"] for m in agent_mailbox.iter_archived(agent_dir, "inbox")] == ["m0", "m1"]
+    with open(log, 'rb') as f:
+        assert f.read() == data
+
+def test_keys_without_ttl_are_pruned_with_their_messages(agent_dir):
+    """Keys without a TTL block duplicates until their message is compacted, then leave the index."""
+    message = {"from": "user", "content": "build failed", "timestamp": 0, "key": "k1"}
+    first = agent_mailbox.append_messages(agent_dir, "inbox", [dict(message)])
+    agent_mailbox.append_messages(agent_dir, "inbox", [{"content": "other", "key": "k2", "timestamp": 0}])
+    assert agent_mailbox.append_messages(agent_dir, "inbox", [dict(message)]) == []
+
+    agent_mailbox.ack_ids(agent_dir, "inbox", [first[0]["id"]])
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+
+    # Buckets are named by the first two characters of the key
+    assert os.listdir(agent_mailbox.keys_dir(agent_dir, "inbox")) == ["k2"]
+    assert len(agent_mailbox.append_messages(agent_dir, "inbox", [dict(message)])) == 1
+    assert agent_mailbox.append_messages(agent_dir, "inbox", [{"content": "other", "key": "k2"}]) == []
+
+def test_search_reindexes_a_compacted_mailbox(agent_dir):
+    """A compacted log is indexed again even if it reuses the old file's inode and grows past it."""
+    _send(agent_dir, [f"old{i}" for i in range(3)])
+    assert len(agent_search.search(agent_dir, "old0", kinds=["inbox"])) == 1
+    keys = {source: key for source, _, key, _ in agent_search._sources(agent_dir, agent_mailbox)}
+
+    agent_mailbox.mark_all_read(agent_dir, "inbox")
+    agent_mailbox.compact_mailbox(agent_dir, "inbox")
+    _send(agent_dir, ["zeppelin " * 20])
+
+    new_keys = {source: key for source, _, key, _ in agent_search._sources(agent_dir, agent_mailbox)}
+    assert new_keys["inbox.jsonl"][0].split(":")[1] != keys["inbox.jsonl"][0].split(":")[1]
+    assert len(agent_search.search(agent_dir, "zeppelin", kinds=["inbox"])) == 1
+    assert len(agent_search.search(agent_dir, "old0", kinds=["inbox"])) == 1
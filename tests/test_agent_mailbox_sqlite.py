@@ -0,0 +1,43 @@
+import os
+import sqlite3
+
+import pytest
+
+import agent_mailbox_sqlite
+
+@pytest.fixture
+def agent_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv(agent_mailbox_sqlite.DB_ENV, raising=False)
+    (tmp_path / "tester").mkdir()
+    return str(tmp_path / "tester")
+
+def _send(agent_dir, contents):
+    return agent_mailbox_sqlite.append_messages(agent_dir, "inbox", [
+        {"from": "user", "content": c, "timestamp": 0} for c in contents])
+
+def test_database_writes_leave_the_agents_directory_alone(agent_dir):
+    """The database lives in its own directory, so writing it does not change the agents directory's mtime."""
+    agents_dir = os.path.dirname(agent_dir)
+    _send(agent_dir, ["first"])
+    mtime = os.stat(agents_dir).st_mtime_ns
+
+    for i in range(5):
+        _send(agent_dir, [f"m{i}"])
+        agent_mailbox_sqlite.mark_all_read(agent_dir, "inbox")
+
+    assert os.stat(agents_dir).st_mtime_ns == mtime
+    assert sorted(os.listdir(agents_dir)) == [agent_mailbox_sqlite.DB_DIR, "tester"]
+
+def test_legacy_database_is_moved(agent_dir):
+    """A database in the old location is moved into the database directory with its messages."""
+    agents_dir = os.path.dirname(agent_dir)
+    legacy = sqlite3.connect(os.path.join(agents_dir, agent_mailbox_sqlite.LEGACY_DB_NAME), isolation_level=None)
+    legacy.execute("PRAGMA journal_mode=WAL")
+    legacy.executescript(agent_mailbox_sqlite.SCHEMA)
+    legacy.execute("INSERT INTO messages (agent, box, data) VALUES ('tester', 'inbox', ?)",
+                   ('{"from": "user", "content": "kept"}',))
+    legacy.close()
+
+    assert [m["content"] for m in agent_mailbox_sqlite.get_unread(agent_dir, "inbox")] == ["kept"]
+    assert not os.path.exists(os.path.join(agents_dir, agent_mailbox_sqlite.LEGACY_DB_NAME))
+    assert os.path.exists(agent_mailbox_sqlite.database_path(agent_dir))
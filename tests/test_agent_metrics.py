@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import agent_metrics
+
+def test_worker_thread_phases_are_kept_apart(monkeypatch):
+    """Phases timed on worker threads are summed under threads.<name> without losing updates."""
+    monkeypatch.delenv(agent_metrics.METRICS_ENV, raising=False)
+    agent_metrics.begin("agent_state", "generate-prompt", timings=True)
+    record = agent_metrics._record
+
+    def work(_):
+        for _ in range(200):
+            with agent_metrics.phase("file_read"):
+                pass
+            agent_metrics.add_size("messages", 1)
+
+    with agent_metrics.phase("file_write"), ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(8)))
+    agent_metrics._record = None
+
+    assert set(record["phases"]) - {"import"} == {"file_write", "threads.file_read"}
+    assert record["sizes"] == {"messages": 1600}
+
+def test_percentile_is_nearest_rank():
+    samples = list(range(1, 101))
+    assert agent_metrics.percentile(samples, 0.50) == 50
+    assert agent_metrics.percentile(samples, 0.99) == 99
+    assert agent_metrics.percentile([], 0.5) is None
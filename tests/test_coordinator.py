@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import coordinator
+
+@pytest.fixture
+def agents_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(coordinator, "AGENTS_DIR", str(tmp_path))
+    return tmp_path
+
+def test_template_runtime_files_are_not_copied(agents_dir, tmp_path_factory):
+    """An agent created from another agent gets its files but not its state or memory."""
+    template = tmp_path_factory.mktemp("heinz")
+    for name, content in [("personality.md", "# {agent_title}\n"), ("memory.md", "secret plans\n"),
+                          ("state.json", "{}"), ("session_state.md", "busy\n"), ("session_log.md", "old\n"),
+                          ("install/setup.md", "# Setup\n"), ("install/session_log.md", "old\n"),
+                          ("install/memory.md", "old\n"), ("install/session_state.md", "old\n"),
+                          ("install/.sync/setup.md", "0 0\n"), ("install/session_logs/00001.md.gz", "old\n")]:
+        (template / name).parent.mkdir(parents=True, exist_ok=True)
+        (template / name).write_text(content)
+
+    assert coordinator.create_agent("david", str(template)) == "Agent 'david' created successfully"
+
+    agent_dir = agents_dir / "david"
+    assert (agent_dir / "personality.md").read_text() == "# David\n"
+    assert not (agent_dir / "state.json").exists()
+    assert not (agent_dir / "session_state.md").exists()
+    assert (agent_dir / "memory.md").read_text().startswith("# David's Memory Database")
+    assert "old" not in (agent_dir / "session_log.md").read_text()
+    # Runtime files are skipped at any depth; .sync is the new agent's own
+    assert sorted(os.listdir(agent_dir / "install")) == [".sync", "setup.md"]
+
+@pytest.mark.parametrize("line", ["123", "[1, 2]", "null", "true"])
+def test_load_batch_rejects_lines_that_are_not_messages(tmp_path, line):
+    """Lines that are neither objects nor strings fail with their line number."""
+    batch = tmp_path / "batch.jsonl"
+    batch.write_text('"hello"\n{"content": "hi"}\n' + line + "\n")
+
+    with pytest.raises(ValueError, match="^line 3: "):
+        coordinator.load_batch(str(batch))
@@ -0,0 +1,60 @@
+import json
+import multiprocessing
+
+import pytest
+
+import agent_mailbox
+
+WRITERS = 8
+SENDS_PER_WRITER = 500
+
+def _send_batch(args):
+    agent_dir, writer = args
+    for i in range(SENDS_PER_WRITER):
+        agent_mailbox.append_message(agent_dir, "inbox", {
+            "from": f"writer-{writer}",
+            "content": f"{writer}:{i}",
+            "read": False
+        })
+
+def _run_writers(agent_dir):
+    with multiprocessing.get_context("fork").Pool(WRITERS) as pool:
+        pool.map(_send_batch, [(agent_dir, w) for w in range(WRITERS)])
+
+@pytest.fixture
+def agent_dir(tmp_path):
+    path = tmp_path / "agent"
+    path.mkdir()
+    return str(path)
+
+def test_concurrent_sends_are_not_lost(agent_dir):
+    """Thousands of sends from concurrent processes all land intact."""
+    _run_writers(agent_dir)
+
+    contents = [m["content"] for m in agent_mailbox.read_messages(agent_dir, "inbox")]
+    expected = {f"{w}:{i}" for w in range(WRITERS) for i in range(SENDS_PER_WRITER)}
+    assert len(contents) == len(expected)
+    assert set(contents) == expected
+
+def test_concurrent_sends_during_migration(agent_dir):
+    """Writers racing on a legacy inbox.json migrate it exactly once."""
+    legacy = [{"from": "user", "content": f"legacy:{i}", "read": i < 2} for i in range(5)]
+    with open(agent_mailbox.legacy_mailbox_path(agent_dir, "inbox"), 'w') as f:
+        json.dump({"messages": legacy}, f)
+
+    _run_writers(agent_dir)
+
+    messages = agent_mailbox.read_messages(agent_dir, "inbox")
+    assert [m["content"] for m in messages[:5]] == [m["content"] for m in legacy]
+    assert len(messages) == 5 + WRITERS * SENDS_PER_WRITER
+    assert len(agent_mailbox.get_unread(agent_dir, "inbox")) == len(messages) - 2
+
+def test_corrupt_legacy_mailbox_is_not_reset(agent_dir):
+    """A corrupt legacy mailbox raises instead of being replaced by an empty one."""
+    with open(agent_mailbox.legacy_mailbox_path(agent_dir, "inbox"), 'w') as f:
+        f.write('{"messages": [')
+
+    with pytest.raises(json.JSONDecodeError):
+        agent_mailbox.append_message(agent_dir, "inbox", {"content": "new"})
+    with open(agent_mailbox.legacy_mailbox_path(agent_dir, "inbox"), 'r') as f:
+        assert f.read() == '{"messages": ['
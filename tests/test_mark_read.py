@@ -0,0 +1,85 @@
+import sys
+
+import pytest
+
+import agent_mailbox
+import agent_state
+
+@pytest.fixture
+def agent_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent_state, "AGENTS_DIR", str(tmp_path))
+    (tmp_path / "tester").mkdir()
+    return str(tmp_path / "tester")
+
+def _send(agent_dir, timestamps):
+    return agent_mailbox.append_messages(agent_dir, "inbox", [
+        {"from": "user", "content": f"at {t}", "timestamp": t} for t in timestamps])
+
+def _mark_read(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["agent_state.py", "mark-read", "tester", *args])
+    agent_state.main()
+    return capsys.readouterr().out
+
+def _unread(agent_dir):
+    return [m["content"] for m in agent_mailbox.get_unread(agent_dir, "inbox")]
+
+def test_mark_read_ids(agent_dir, monkeypatch, capsys):
+    """--ids marks just the listed messages, and counts only those that were unread."""
+    ids = [m["id"] for m in _send(agent_dir, [100, 200, 300, 400])]
+
+    out = _mark_read(monkeypatch, capsys, "--ids", f"{ids[1]},{ids[3]},unknown")
+    assert out == "Marked 2 of 3 messages as read for tester\n"
+    assert _unread(agent_dir) == ["at 100", "at 300"]
+
+    out = _mark_read(monkeypatch, capsys, "--ids", f"{ids[1]},{ids[0]}")
+    assert out == "Marked 1 of 2 messages as read for tester\n"
+    assert _unread(agent_dir) == ["at 300"]
+
+def test_mark_read_until(agent_dir, monkeypatch, capsys):
+    """--until marks the messages up to a time, including ones appended slightly out of order."""
+    _send(agent_dir, [100, 200, 150, 300, 1000])
+
+    out = _mark_read(monkeypatch, capsys, "--until", "200")
+    assert out.startswith("Marked messages up to ")
+    assert _unread(agent_dir) == ["at 300", "at 1000"]
+
+    _mark_read(monkeypatch, capsys, "--until", "299.5")
+    assert _unread(agent_dir) == ["at 300", "at 1000"]
+
+def test_mark_read_rejects_both_options(agent_dir, monkeypatch, capsys):
+    """--ids and --until cannot be combined."""
+    _send(agent_dir, [100])
+
+    assert _mark_read(monkeypatch, capsys, "--ids", "a", "--until", "200") == "Error: Use either --ids or --until\n"
+    assert _unread(agent_dir) == ["at 100"]
+
+def test_id_lookups_read_bounded_buckets(agent_dir, monkeypatch):
+    """Oversized id index buckets are split, so a lookup does not read unrelated entries."""
+    monkeypatch.setattr(agent_mailbox, "ID_BUCKET_SIZE", 4)
+    ids = [m["id"] for m in _send(agent_dir, range(2000))]
+
+    read_sizes = []
+    read_bucket = agent_mailbox._read_id_bucket
+    def counting_read(path):
+        entries = read_bucket(path)
+        read_sizes.append(len(entries))
+        return entries
+    monkeypatch.setattr(agent_mailbox, "_read_id_bucket", counting_read)
+
+    assert agent_mailbox.ack_ids(agent_dir, "inbox", ids[:50]) == ids[:50]
+    assert read_sizes and max(read_sizes) > 4
+
+    # Lookups split the buckets they touched, so looking the ids up again reads at most ID_BUCKET_SIZE entries each
+    read_sizes.clear()
+    assert agent_mailbox.ack_ids(agent_dir, "inbox", ids[:50]) == []
+    assert len(read_sizes) <= 50 and max(read_sizes) <= 4
+
+@pytest.mark.parametrize("count", ["x", "0", "-1"])
+def test_pop_next_rejects_invalid_counts(agent_dir, monkeypatch, capsys, count):
+    """pop-next reports a bad message count instead of failing with a traceback."""
+    _send(agent_dir, [100])
+    monkeypatch.setattr(sys, "argv", ["agent_state.py", "pop-next", "tester", count])
+    agent_state.main()
+
+    assert capsys.readouterr().out == f"Error: Invalid number of messages: {count}\n"
+    assert _unread(agent_dir) == ["at 100"]
@@ -0,0 +1,38 @@
+import pytest
+
+import agent_mailbox
+import agent_state
+
+@pytest.fixture
+def agent_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent_state, "AGENTS_DIR", str(tmp_path))
+    (tmp_path / "tester").mkdir()
+    return "tester"
+
+def test_long_single_line_message_keeps_what_fits(agent_name, tmp_path):
+    """A one-line message over budget is cut near the limit, not back to its heading."""
+    content = "word " * 2000
+    agent_mailbox.append_message(str(tmp_path / agent_name), "inbox",
+                                 {"from": "user", "subject": "Long", "content": content, "timestamp": 0})
+
+    prompt = agent_state.generate_state_prompt(agent_name, max_tokens=1000)
+
+    # Within budget, and the message gets its full per-message share
+    assert agent_state.MESSAGE_MAX_TOKENS <= agent_state.estimate_tokens(prompt) <= 1000
+    body = prompt.split("**Content:**\n", 1)[1].split("[... message truncated ...]", 1)[0]
+    assert body and content.startswith(body.rstrip("\n"))
+    # The message may use up to MESSAGE_MAX_TOKENS; nearly all of it is content
+    assert agent_state.estimate_tokens(body) >= agent_state.MESSAGE_MAX_TOKENS * 0.75
+
+def test_truncate_prefers_a_nearby_line_break():
+    """A line break close to the limit is still used as the cut point."""
+    text = "a" * 390 + "\n" + "b" * 400
+    cut = agent_state._truncate(text, 100, "|")
+    assert cut == "a" * 390 + "|"
+
+def test_truncate_ignores_a_distant_line_break():
+    """A line break far before the limit would drop too much, so the text is cut at the limit."""
+    text = "title\n" + "b" * 1000
+    cut = agent_state._truncate(text, 100, "|")
+    assert len(cut) == 400
+    assert cut.startswith("title\nbbb")